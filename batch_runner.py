@@ -0,0 +1,61 @@
+"""Submit a JSONL batch file to the API server and collect the results.
+
+Input lines use OpenAI's batch format::
+
+    {"custom_id": "fir-1", "method": "POST", "url": "/v1/chat/completions",
+     "body": {"model": "capstone-rag", "messages": [{"role": "user", "content": "..."}]}}
+
+Results are written to the output file (OpenAI batch output format, the
+file is overwritten) as soon as each one completes:
+
+    python batch_runner.py snippets.jsonl -o results.jsonl --parallel 8
+"""
+import argparse
+import json
+import sys
+import time
+
+import httpx
+
+
+def _read_requests(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Batch input JSONL file")
+    parser.add_argument("-o", "--output", default="-", help="Output JSONL file (default: stdout)")
+    parser.add_argument("--server", default="http://localhost:8000", help="API server base URL")
+    parser.add_argument("--parallel", type=int, default=8, help="Upstream calls in flight per batch")
+    parser.add_argument("--chunk", type=int, default=500, help="Requests sent per HTTP call")
+    parser.add_argument("--timeout", type=float, default=3600.0)
+    args = parser.parse_args(argv)
+
+    requests = _read_requests(args.input)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    done = failed = 0
+    started = time.perf_counter()
+    try:
+        with httpx.Client(base_url=args.server, timeout=args.timeout) as client:
+            for start in range(0, len(requests), args.chunk):
+                payload = {"requests": requests[start:start + args.chunk], "max_parallel": args.parallel}
+                with client.stream("POST", "/v1/batch/chat/completions", json=payload) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        out.write(line + "\n")
+                        out.flush()
+                        done += 1
+                        failed += json.loads(line).get("error") is not None
+                        print(f"\r{done}/{len(requests)} done, {failed} failed", end="", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"\n{done} results in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Compare approximate FAISS index types against the exact (flat) index.
+
+For every configuration this reports recall@k against the flat index's
+results, single-query search latency, serialized index size and build time:
+
+    python bench_index.py --k 4 --queries 500
+    python bench_index.py --types ivf hnsw --json bench_index.json
+    python bench_index.py --save --min-recall 0.95
+
+``--save`` sweeps the served index itself instead and publishes the cheapest
+setting reaching ``--min-recall`` (or the best one) as a new index generation
+(``search_params.json``), which the server workers load.
+
+Queries are vectors sampled from the index with a little Gaussian noise
+added, or real text (one query per line) from ``--query-file``, embedded
+with the backend the server uses (``embedding_backends.make_embeddings``).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from index_store import (
+    HNSW_M,
+    INDEX_DIR,
+    INDEX_NAME,
+    generation_dir,
+    index_type_of,
+    index_vectors,
+    load_index,
+    make_index,
+    save_index_atomic,
+    set_search_params,
+)
+
+# Query-time settings swept per index type.
+SWEEPS = {
+    "flat": [{}],
+    "ivf": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "ivfpq": [{"nprobe": n} for n in (1, 4, 16, 64)],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128)],
+}
+
+
+def _load_queries(args, vectors: np.ndarray) -> np.ndarray:
+    if args.query_file:
+        from embedding_backends import make_embeddings
+
+        with open(args.query_file, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        embeddings = make_embeddings()
+        return np.asarray(embeddings.embed_documents(texts), dtype="float32")
+
+    rng = np.random.default_rng(args.seed)
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    queries = vectors[picks]
+    noise = rng.normal(0.0, args.noise * float(np.std(vectors)), size=queries.shape)
+    return (queries + noise).astype("float32")
+
+
+def _latencies_ms(index, queries: np.ndarray, k: int) -> np.ndarray:
+    # One query at a time, as the server issues them.
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q[None, :], k)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return np.asarray(times)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found.tolist(), truth.tolist()))
+    return hits / truth.size
+
+
+def _tune(index, queries: np.ndarray, truth: np.ndarray, args) -> dict:
+    # Sweep the index's own settings (cheapest first) and return the first
+    # reaching the recall target, or the best one if none does.
+    best, best_recall = {}, -1.0
+    for params in SWEEPS[index_type_of(index)]:
+        set_search_params(index, **params)
+        _, found = index.search(queries, args.k)
+        recall = _recall(found, truth)
+        print(f"{params}: recall@{args.k} {recall:.4f}", file=sys.stderr)
+        if recall >= args.min_recall:
+            return params
+        if recall > best_recall:
+            best, best_recall = params, recall
+    return best
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=INDEX_DIR, help="Index folder holding the reference vectors")
+    parser.add_argument("--types", nargs="+", default=list(SWEEPS), choices=list(SWEEPS))
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=500, help="Number of sampled queries")
+    parser.add_argument("--query-file", default=None, help="Text queries to embed, one per line")
+    parser.add_argument("--noise", type=float, default=0.05, help="Noise added to sampled queries (x std)")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M)
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    parser.add_argument("--save", action="store_true", help="Tune the served index and store its search parameters")
+    parser.add_argument("--min-recall", type=float, default=0.95, help="Recall target for --save")
+    args = parser.parse_args(argv)
+
+    if args.save:
+        # Tuned on, and published with, the index of one generation.
+        vstore = load_index(None, args.index, mmap=False)
+        reference = vstore.index
+    else:
+        reference = faiss.read_index(os.path.join(generation_dir(args.index), f"{INDEX_NAME}.faiss"))
+    vectors = index_vectors(reference)
+    queries = _load_queries(args, vectors)
+    truth_index = make_index("flat", vectors, metric=reference.metric_type)
+    _, truth = truth_index.search(queries, args.k)
+    print(f"{len(vectors)} vectors (d={vectors.shape[1]}), {len(queries)} queries, k={args.k}", file=sys.stderr)
+
+    if args.save:
+        params = _tune(reference, queries, truth, args)
+        written = save_index_atomic(vstore, args.index, search_params=params)
+        print(f"{index_type_of(reference)}: saved {params or 'no parameters (flat index)'} in {written}")
+        return
+
+    results = []
+    for index_type in args.types:
+        start = time.perf_counter()
+        index = make_index(
+            index_type, vectors, nlist=args.nlist, hnsw_m=args.hnsw_m, pq_m=args.pq_m, metric=reference.metric_type
+        )
+        build_s = time.perf_counter() - start
+        size_bytes = int(faiss.serialize_index(index).nbytes)
+        for params in SWEEPS[index_type]:
+            set_search_params(index, **params)
+            _, found = index.search(queries, args.k)
+            lat = _latencies_ms(index, queries, args.k)
+            results.append({
+                "type": index_type,
+                "params": params,
+                f"recall@{args.k}": round(_recall(found, truth), 4),
+                "latency_ms_mean": round(float(lat.mean()), 4),
+                "latency_ms_p50": round(float(np.percentile(lat, 50)), 4),
+                "latency_ms_p99": round(float(np.percentile(lat, 99)), 4),
+                "size_mb": round(size_bytes / 2**20, 3),
+                "build_s": round(build_s, 3),
+            })
+
+    header = f"{'type':<7} {'params':<18} {'recall@' + str(args.k):>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'size MB':>9} {'build s':>8}"
+    print(header)
+    for r in results:
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items()) or "-"
+        print(
+            f"{r['type']:<7} {params:<18} {r[f'recall@{args.k}']:>9.4f} {r['latency_ms_mean']:>9.4f} "
+            f"{r['latency_ms_p50']:>9.4f} {r['latency_ms_p99']:>9.4f} {r['size_mb']:>9.3f} {r['build_s']:>8.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "vectors": len(vectors), "queries": len(queries), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
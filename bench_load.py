@@ -0,0 +1,250 @@
+"""Load-test ``/v1/chat/completions`` at fixed concurrency levels.
+
+Sends real C snippets (built in, or ``--snippets`` files) to a running API
+server, streaming and non-streaming, and reports throughput, latency and
+time-to-first-token percentiles for every (mode, concurrency) pair. Point the
+server at ``stub_llm.py`` to measure the server itself rather than the
+upstream:
+
+    python stub_llm.py --port 8200 --latency 0.3 --tokens-per-sec 80
+    OPENROUTER_BASE_URL=http://127.0.0.1:8200/v1 OPENROUTER_API_KEY=stub python server.py
+    python bench_load.py --concurrency 1 8 32 --requests 200 --json bench_load.json
+
+Each request gets a unique comment line so it misses the response cache;
+pass ``--allow-cache`` to send the snippets unchanged.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+
+SNIPPETS = [
+    """void fir_32f(const float *taps, int ntaps, const float *src, float *dst, int len, float *delay)
+{
+    for (int n = 0; n < len; n++) {
+        for (int k = ntaps - 1; k > 0; k--)
+            delay[k] = delay[k - 1];
+        delay[0] = src[n];
+        float acc = 0.0f;
+        for (int k = 0; k < ntaps; k++)
+            acc += taps[k] * delay[k];
+        dst[n] = acc;
+    }
+}""",
+    """float dot_32f(const float *a, const float *b, int len)
+{
+    float sum = 0.0f;
+    for (int i = 0; i < len; i++)
+        sum += a[i] * b[i];
+    return sum;
+}""",
+    """void add_scaled_16s(const short *a, const short *b, short *dst, int len, int shift)
+{
+    for (int i = 0; i < len; i++) {
+        int v = ((int)a[i] + (int)b[i]) >> shift;
+        dst[i] = (short)(v > 32767 ? 32767 : (v < -32768 ? -32768 : v));
+    }
+}""",
+    """void threshold_8u(const unsigned char *src, int srcStep, unsigned char *dst, int dstStep,
+                  int width, int height, unsigned char level)
+{
+    for (int y = 0; y < height; y++) {
+        const unsigned char *s = src + y * srcStep;
+        unsigned char *d = dst + y * dstStep;
+        for (int x = 0; x < width; x++)
+            d[x] = s[x] > level ? 255 : 0;
+    }
+}""",
+    """void magnitude_32fc(const float *re, const float *im, float *mag, int len)
+{
+    for (int i = 0; i < len; i++)
+        mag[i] = sqrtf(re[i] * re[i] + im[i] * im[i]);
+}""",
+    """void box_filter_3x3_8u(const unsigned char *src, unsigned char *dst, int width, int height)
+{
+    for (int y = 1; y < height - 1; y++)
+        for (int x = 1; x < width - 1; x++) {
+            int sum = 0;
+            for (int dy = -1; dy <= 1; dy++)
+                for (int dx = -1; dx <= 1; dx++)
+                    sum += src[(y + dy) * width + (x + dx)];
+            dst[y * width + x] = (unsigned char)(sum / 9);
+        }
+}""",
+]
+
+
+def _load_snippets(paths: List[str]) -> List[str]:
+    # Files, or every .c/.h file in a directory.
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith((".c", ".h"))
+            )
+        else:
+            files.append(path)
+    snippets = []
+    for path in files:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            snippets.append(f.read())
+    return snippets
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (``q`` in 0..100); None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+async def _one(client: httpx.AsyncClient, content: str, stream: bool) -> Dict:
+    payload = {"model": "capstone-rag", "messages": [{"role": "user", "content": content}], "stream": stream}
+    start = time.perf_counter()
+    result = {"ok": False, "latency": None, "ttft": None, "completion_tokens": 0, "cached": False}
+    try:
+        if not stream:
+            response = await client.post("/v1/chat/completions", json=payload)
+            result["latency"] = result["ttft"] = time.perf_counter() - start
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            body = response.json()
+            result["completion_tokens"] = body.get("usage", {}).get("completion_tokens", 0)
+            result["cached"] = response.headers.get("x-cache") == "hit"
+            result["ok"] = True
+            return result
+
+        async with client.stream("POST", "/v1/chat/completions", json=payload) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["latency"] = time.perf_counter() - start
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            result["cached"] = response.headers.get("x-cache") == "hit"
+            finish_reason = None
+            async for line in response.aiter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                chunk = json.loads(line[6:])
+                if "error" in chunk:
+                    result["error"] = chunk["error"].get("message", "stream error")
+                for choice in chunk.get("choices", []):
+                    if choice["delta"].get("content") and result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - start
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                if chunk.get("usage"):
+                    result["completion_tokens"] = chunk["usage"].get("completion_tokens", 0)
+            result["latency"] = time.perf_counter() - start
+            result["ok"] = finish_reason == "stop"
+            return result
+    except httpx.HTTPError as e:
+        result["latency"] = time.perf_counter() - start
+        result["error"] = type(e).__name__
+        return result
+
+
+async def run_level(args, snippets: List[str], stream: bool, concurrency: int) -> Dict:
+    """Send ``args.requests`` requests with ``concurrency`` in flight; summarize them."""
+    results: List[Dict] = []
+    counter = iter(range(args.requests))
+
+    def content(i: int) -> str:
+        snippet = snippets[i % len(snippets)]
+        return snippet if args.allow_cache else f"// bench {uuid.uuid4().hex}\n{snippet}"
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for i in counter:
+            results.append(await _one(client, content(i), stream))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=args.server, timeout=args.timeout, limits=limits) as client:
+        for i in range(args.warmup):
+            await _one(client, content(i), stream)
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r["ok"]:
+            reason = r.get("error", "incomplete")
+            errors[reason] = errors.get(reason, 0) + 1
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000.0, 1)
+
+    return {
+        "mode": "stream" if stream else "non-stream",
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": errors,
+        "cache_hits": sum(r["cached"] for r in ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "completion_tokens_per_s": round(sum(r["completion_tokens"] for r in ok) / elapsed, 1) if elapsed else None,
+        "latency_ms": {f"p{q}": ms(percentile(latencies, q)) for q in (50, 95, 99)},
+        "ttft_ms": {f"p{q}": ms(percentile(ttfts, q)) for q in (50, 95, 99)},
+    }
+
+
+def _print_row(row: Dict) -> None:
+    lat, ttft = row["latency_ms"], row["ttft_ms"]
+    print(
+        f"{row['mode']:<10} {row['concurrency']:>5} {row['ok']:>5}/{row['requests']:<5} "
+        f"{row['throughput_rps'] or 0:>8.2f} {row['completion_tokens_per_s'] or 0:>9.1f} "
+        f"{lat['p50'] or 0:>9.1f} {lat['p95'] or 0:>9.1f} {lat['p99'] or 0:>9.1f} "
+        f"{ttft['p50'] or 0:>9.1f} {ttft['p95'] or 0:>9.1f} {ttft['p99'] or 0:>9.1f}"
+    )
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://localhost:8000", help="API server base URL")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrency levels to run")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per (mode, concurrency) level")
+    parser.add_argument("--mode", choices=("stream", "non-stream", "both"), default="both")
+    parser.add_argument("--snippets", nargs="*", default=[], help="C files or directories to use instead of the built-in snippets")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each level")
+    parser.add_argument("--allow-cache", action="store_true", help="Do not make requests unique (measures cache hits)")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    snippets = _load_snippets(args.snippets) if args.snippets else SNIPPETS
+    if not snippets:
+        parser.error("no snippets found")
+    modes = [True, False] if args.mode == "both" else [args.mode == "stream"]
+
+    print(
+        f"{'mode':<10} {'conc':>5} {'ok':>5}/{'n':<5} {'req/s':>8} {'tok/s':>9} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p50':>9} {'ttft p95':>9} {'ttft p99':>9}"
+    )
+    rows = []
+    for stream in modes:
+        for concurrency in args.concurrency:
+            row = asyncio.run(run_level(args, snippets, stream, concurrency))
+            _print_row(row)
+            if row["errors"]:
+                print(f"  errors: {row['errors']}", file=sys.stderr)
+            rows.append(row)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"server": args.server, "created": int(time.time()), "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
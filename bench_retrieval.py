@@ -0,0 +1,225 @@
+"""Micro-benchmark of the retrieval hot path: query embedding and FAISS search.
+
+Loads ``ipp_index`` and measures embedding throughput per batch size and
+input length, search latency per ``k`` (raw FAISS search and the full
+``similarity_search_by_vector`` the retriever runs, docstore reads
+included), cold and warm index load time, and process memory. Results go to
+stdout and, with ``--json``, to a file for comparing runs over time:
+
+    python bench_retrieval.py --json bench_retrieval.json
+    python bench_retrieval.py --batch-sizes 1 32 --lengths 256 1000 --ks 4 16
+
+Embeddings come from ``make_embeddings()``, so ``RAG_EMBEDDINGS_URL``
+benchmarks the shared embedding service instead of a local model. The cold
+load runs in a fresh interpreter; the OS page cache may still hold the index
+files from earlier runs.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from docstore import DOCSTORE_NAME
+from embedding_backends import make_embeddings
+from index_store import INDEX_DIR, INDEX_NAME, generation_dir, index_type_of, load_index
+
+
+def rss_mb() -> float | None:
+    """Resident set size of this process in MB, if the platform exposes it."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _round(value, digits: int = 3):
+    return None if value is None else round(value, digits)
+
+
+def _stats_ms(times) -> dict:
+    lat = np.asarray(times) * 1000.0
+    return {
+        "mean_ms": round(float(lat.mean()), 4),
+        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+        "p95_ms": round(float(np.percentile(lat, 95)), 4),
+        "p99_ms": round(float(np.percentile(lat, 99)), 4),
+    }
+
+
+def _cold_load(folder: str) -> dict:
+    # A fresh interpreter: module imports and the first index open included.
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--cold-probe", "--index", folder],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _cold_probe(folder: str) -> None:
+    start = time.perf_counter()
+    import faiss  # noqa: F401
+    from langchain_community.vectorstores import FAISS  # noqa: F401
+
+    imports_s = time.perf_counter() - start
+    start = time.perf_counter()
+    # No embedding model needed just to open the index.
+    vstore = load_index(None, folder)
+    load_s = time.perf_counter() - start
+    print(json.dumps({
+        "imports_s": round(imports_s, 4),
+        "load_s": round(load_s, 4),
+        "vectors": int(vstore.index.ntotal),
+        "rss_mb": _round(rss_mb(), 1),
+    }))
+
+
+def sample_texts(vstore, n: int, rng) -> list:
+    """Up to ``n`` random non-empty chunk texts from the index."""
+    positions = rng.choice(vstore.index.ntotal, min(n, vstore.index.ntotal), replace=False)
+    texts = []
+    for pos in positions.tolist():
+        doc = vstore.docstore.search(vstore.index_to_docstore_id[pos])
+        if not isinstance(doc, str) and doc.page_content.strip():
+            texts.append(doc.page_content)
+    return texts
+
+
+def _sized(texts: list, length: int) -> list:
+    # Each text cut or repeated to exactly ``length`` characters.
+    return [(text * (length // max(1, len(text)) + 1))[:length] for text in texts]
+
+
+def bench_embeddings(embeddings, texts: list, batch_sizes, lengths, max_texts: int) -> list:
+    results = []
+    for length in lengths:
+        inputs = _sized(texts, length)
+        for batch_size in batch_sizes:
+            count = max(batch_size, min(max_texts, len(inputs)) // batch_size * batch_size)
+            batches = [
+                [inputs[(start + j) % len(inputs)] for j in range(batch_size)] for start in range(0, count, batch_size)
+            ]
+            embeddings.embed_documents(batches[0])  # warm this shape
+            times = []
+            for batch in batches:
+                start = time.perf_counter()
+                embeddings.embed_documents(batch)
+                times.append(time.perf_counter() - start)
+            total = sum(times)
+            results.append({
+                "length_chars": length,
+                "batch_size": batch_size,
+                "texts": count,
+                "texts_per_s": round(count / total, 2),
+                "batch": _stats_ms(times),
+            })
+    return results
+
+
+def bench_search(vstore, queries: np.ndarray, ks) -> list:
+    results = []
+    for k in ks:
+        raw, full = [], []
+        for q in queries:
+            start = time.perf_counter()
+            vstore.index.search(q[None, :], k)
+            raw.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            vstore.similarity_search_by_vector(q.tolist(), k=k)
+            full.append(time.perf_counter() - start)
+        results.append({"k": k, "queries": len(queries), "faiss": _stats_ms(raw), "with_docstore": _stats_ms(full)})
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=INDEX_DIR, help="Index folder")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--lengths", type=int, nargs="+", default=[128, 512, 1000], help="Input lengths in characters")
+    parser.add_argument("--texts", type=int, default=256, help="Texts embedded per (length, batch size)")
+    parser.add_argument("--ks", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200, help="Search queries per k")
+    parser.add_argument("--loads", type=int, default=5, help="Warm in-process index loads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Also write results to this JSON file")
+    parser.add_argument("--cold-probe", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.cold_probe:
+        _cold_probe(args.index)
+        return
+
+    rng = np.random.default_rng(args.seed)
+    memory = {"start_rss_mb": _round(rss_mb(), 1)}
+    cold = _cold_load(args.index)
+
+    embeddings = make_embeddings()
+    memory["embeddings_rss_mb"] = _round(rss_mb(), 1)
+    warm = []
+    for _ in range(max(1, args.loads)):
+        start = time.perf_counter()
+        vstore = load_index(embeddings, args.index)
+        warm.append(time.perf_counter() - start)
+    memory["index_rss_mb"] = _round(rss_mb(), 1)
+    load = {"cold": cold, "warm": _stats_ms(warm)}
+
+    folder = generation_dir(args.index)
+    files = {name: os.path.getsize(os.path.join(folder, name))
+             for name in (f"{INDEX_NAME}.faiss", DOCSTORE_NAME) if os.path.exists(os.path.join(folder, name))}
+    index_info = {
+        "type": index_type_of(vstore.index),
+        "vectors": int(vstore.index.ntotal),
+        "dim": int(vstore.index.d),
+        "file_mb": {name: round(size / 2**20, 3) for name, size in files.items()},
+    }
+    print(f"{index_info['vectors']} vectors (d={index_info['dim']}, {index_info['type']}), "
+          f"cold load {cold['load_s']:.3f}s + imports {cold['imports_s']:.3f}s, "
+          f"warm load p50 {load['warm']['p50_ms']:.1f} ms", file=sys.stderr)
+
+    texts = sample_texts(vstore, max(args.texts, args.queries), rng)
+    if not texts:
+        sys.exit("index has no documents to sample")
+    embedding = bench_embeddings(embeddings, texts, args.batch_sizes, args.lengths, args.texts)
+    memory["after_embedding_rss_mb"] = _round(rss_mb(), 1)
+    print(f"{'chars':>6} {'batch':>6} {'texts/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for r in embedding:
+        print(f"{r['length_chars']:>6} {r['batch_size']:>6} {r['texts_per_s']:>9.1f} "
+              f"{r['batch']['p50_ms']:>9.2f} {r['batch']['p99_ms']:>9.2f}")
+
+    queries = np.asarray(embeddings.embed_documents(texts[:args.queries]), dtype="float32")
+    search = bench_search(vstore, queries, args.ks)
+    memory["after_search_rss_mb"] = _round(rss_mb(), 1)
+    print(f"{'k':>4} {'faiss p50':>10} {'faiss p99':>10} {'full p50':>10} {'full p99':>10}")
+    for r in search:
+        print(f"{r['k']:>4} {r['faiss']['p50_ms']:>10.4f} {r['faiss']['p99_ms']:>10.4f} "
+              f"{r['with_docstore']['p50_ms']:>10.4f} {r['with_docstore']['p99_ms']:>10.4f}")
+    print("memory: " + ", ".join(f"{k}={v}" for k, v in memory.items()), file=sys.stderr)
+
+    if args.json:
+        result = {
+            "created": int(time.time()),
+            "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+            "embeddings": type(embeddings).__name__,
+            "index": index_info,
+            "load": load,
+            "memory": memory,
+            "embedding": embedding,
+            "search": search,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Splitting C sources into top-level units for map-reduce refactoring.
+
+A small scanner, not a full parser: it tracks comments, string and character
+literals, preprocessor lines and brace depth, and cuts the source at the end
+of every top-level function body, aggregate definition (``struct``/``union``/
+``enum``, including typedefs) and declaration. Concatenating the units' text
+gives back the source exactly; each unit carries the comments that precede it.
+
+Functions and aggregates are refactored; everything else (includes, macros,
+prototypes, globals) is kept verbatim and shown to every job as shared
+declarations.
+"""
+import re
+from typing import Iterator, List, Optional, Union
+
+from tokens import count_tokens, truncate_tokens
+
+FUNCTION = "function"
+STRUCT = "struct"
+DECLARATION = "declaration"
+REFACTORABLE = (FUNCTION, STRUCT)
+
+_AGGREGATE = re.compile(r"\b(struct|union|enum)\b(?:\s+(\w+))?")
+_CALL = re.compile(r"(\w+)\s*\(")
+_TYPEDEF_NAME = re.compile(r"(\w+)\s*(?:\[[^\]]*\]\s*)*;\s*$")
+_INCLUDE = re.compile(r"^[ \t]*#[ \t]*include[ \t]*[<\"]([^>\"]+)[>\"].*$", re.MULTILINE)
+_FENCE = re.compile(r"```[ \t]*(?:c|C|cpp|c\+\+|h)?[ \t]*\n(.*?)```", re.DOTALL)
+_COMMENTS = re.compile(r"/\*.*?\*/|//[^\n]*", re.DOTALL)
+
+
+class CUnit:
+    """One top-level piece of a C source file."""
+
+    __slots__ = ("kind", "name", "text", "line")
+
+    def __init__(self, kind: str, name: Optional[str], text: str, line: int) -> None:
+        self.kind = kind
+        self.name = name
+        self.text = text
+        self.line = line  # 1-based line where the unit's comments or code start
+
+    def __repr__(self) -> str:
+        return f"CUnit({self.kind!r}, {self.name!r}, line={self.line})"
+
+
+def _skip_literal(source: str, i: int) -> int:
+    # Index just past the string or character literal starting at ``i``.
+    quote = source[i]
+    i += 1
+    while i < len(source) and source[i] != quote and source[i] != "\n":
+        i += 2 if source[i] == "\\" else 1
+    return i + 1
+
+
+def _skip_comment(source: str, i: int) -> int:
+    # Index just past the comment starting at ``i``, or ``i`` if there is none.
+    if source.startswith("//", i):
+        end = source.find("\n", i)
+        return len(source) if end == -1 else end
+    if source.startswith("/*", i):
+        end = source.find("*/", i + 2)
+        return len(source) if end == -1 else end + 2
+    return i
+
+
+def _skip_directive(source: str, i: int) -> int:
+    # Index of the newline ending the preprocessor line at ``i`` (continuations followed).
+    while True:
+        end = source.find("\n", i)
+        if end == -1:
+            return len(source)
+        # Look at the line's last characters only: slicing from 0 is quadratic in long files.
+        line_end = end - 1 if end > i and source[end - 1] == "\r" else end
+        if source.endswith("\\", i, line_end):
+            i = end + 1
+            continue
+        return end
+
+
+def _next_code_char(source: str, i: int) -> str:
+    while i < len(source):
+        if source[i].isspace():
+            i += 1
+            continue
+        end = _skip_comment(source, i)
+        if end == i:
+            return source[i]
+        i = end
+    return ""
+
+
+def _classify(text: str, header: Optional[str]) -> CUnit:
+    code = _COMMENTS.sub(" ", text).strip()
+    if header is not None:
+        head = _COMMENTS.sub(" ", header).strip()
+        if head.endswith(")") and "=" not in head:
+            match = _CALL.search(head)
+            return CUnit(FUNCTION, match.group(1) if match else None, text, 0)
+        aggregate = _AGGREGATE.search(head)
+        if aggregate is not None and "=" not in head:
+            name = aggregate.group(2)
+            if code.startswith("typedef"):
+                typedef = _TYPEDEF_NAME.search(code)
+                name = typedef.group(1) if typedef else name
+            return CUnit(STRUCT, name, text, 0)
+    return CUnit(DECLARATION, None, text, 0)
+
+
+def split_units(source: str) -> List[CUnit]:
+    """Top-level units of ``source`` in order; their texts concatenate to ``source``."""
+    units: List[CUnit] = []
+    start = 0  # first character of the unit being scanned
+    depth = 0
+    header_end: Optional[int] = None  # position of the unit's first top-level "{"
+    has_code = False
+    at_line_start = True
+    i = 0
+    n = len(source)
+
+    def close(end: int) -> None:
+        nonlocal start, header_end, has_code
+        text = source[start:end]
+        header = source[start:header_end] if header_end is not None else None
+        unit = _classify(text, header)
+        unit.line = source.count("\n", 0, start + len(text) - len(text.lstrip())) + 1
+        units.append(unit)
+        start, header_end, has_code = end, None, False
+
+    while i < n:
+        c = source[i]
+        if c == "\n":
+            at_line_start = True
+            i += 1
+            continue
+        if c.isspace():
+            i += 1
+            continue
+        end = _skip_comment(source, i)
+        if end != i:
+            i = end
+            continue
+        if c == "#" and at_line_start:
+            end = _skip_directive(source, i)
+            if depth == 0 and not has_code:
+                # A directive on its own is a unit (with its trailing newline).
+                close(min(n, end + 1))
+                i = start
+            else:
+                i = end
+            continue
+        at_line_start = False
+        if c in "\"'":
+            has_code = True
+            i = _skip_literal(source, i)
+            continue
+        if c == "{":
+            if depth == 0 and header_end is None:
+                header_end = i
+            depth += 1
+        elif c == "}":
+            depth = max(0, depth - 1)
+            if depth == 0 and header_end is not None:
+                unit_header = _COMMENTS.sub(" ", source[start:header_end]).strip()
+                is_function = unit_header.endswith(")") and "=" not in unit_header
+                if is_function and _next_code_char(source, i + 1) != ";":
+                    close(i + 1)
+                    i += 1
+                    continue
+        elif c == ";" and depth == 0:
+            close(i + 1)
+            i += 1
+            continue
+        has_code = True
+        i += 1
+
+    rest = source[start:]
+    if rest.strip():
+        close(n)
+    elif rest and units:
+        units[-1].text += rest
+    elif rest:
+        units.append(CUnit(DECLARATION, None, rest, 1))
+    return units
+
+
+def plan_jobs(units: List[CUnit], max_tokens: int) -> List[List[int]]:
+    """Group adjacent refactorable units into jobs of up to ``max_tokens``.
+
+    Each job is a list of unit indexes. A unit larger than the budget is a
+    job of its own; declarations between units always end a job.
+    """
+    jobs: List[List[int]] = []
+    current: List[int] = []
+    size = 0
+    for index, unit in enumerate(units):
+        if unit.kind not in REFACTORABLE:
+            if unit.text.strip() and current:
+                jobs.append(current)
+                current, size = [], 0
+            continue
+        tokens = count_tokens(unit.text)
+        if current and size + tokens > max_tokens:
+            jobs.append(current)
+            current, size = [], 0
+        current.append(index)
+        size += tokens
+    if current:
+        jobs.append(current)
+    return jobs
+
+
+def shared_declarations(units: List[CUnit], max_tokens: int) -> str:
+    """Includes, macros, prototypes, globals and aggregate definitions, capped at ``max_tokens``."""
+    text = "".join(unit.text for unit in units if unit.kind != FUNCTION).strip()
+    return truncate_tokens(text, max_tokens)
+
+
+def includes(text: str) -> List[str]:
+    """Header names included by ``text``."""
+    return _INCLUDE.findall(text)
+
+
+def code_blocks(text: str) -> List[str]:
+    """Contents of the fenced code blocks in ``text``, in order."""
+    return _FENCE.findall(text)
+
+
+def strip_code_blocks(text: str) -> str:
+    """``text`` with every fenced code block replaced by a space."""
+    return _FENCE.sub(" ", text)
+
+
+def strip_comments(code: str) -> str:
+    """``code`` with every comment replaced by a space."""
+    return _COMMENTS.sub(" ", code)
+
+
+def extract_code(answer: str) -> str:
+    """The code of a model answer: its longest fenced block, or the whole answer."""
+    blocks = code_blocks(answer)
+    if not blocks:
+        return answer.strip()
+    return max(blocks, key=len).strip()
+
+
+def clean_output(code: str, included: List[str]) -> str:
+    """Drop ``#include`` lines for headers the stitched file already includes."""
+    known = set(included)
+    return _INCLUDE.sub(lambda m: "" if m.group(1) in known else m.group(0), code).strip("\n")
+
+
+def stitch_plan(units: List[CUnit], jobs: List[List[int]]) -> Iterator[Union[str, int]]:
+    """The stitched file in order: verbatim text, or a job index whose output goes there.
+
+    Whitespace around a replaced job is kept so the layout between units survives.
+    """
+    first = {job[0]: j for j, job in enumerate(jobs)}
+    last = {job[-1] for job in jobs}
+    replaced = {index for job in jobs for index in job}
+    for index, unit in enumerate(units):
+        if index not in replaced:
+            yield unit.text
+            continue
+        if index in first:
+            yield unit.text[: len(unit.text) - len(unit.text.lstrip())]
+            yield first[index]
+        if index in last:
+            yield unit.text[len(unit.text.rstrip()):]
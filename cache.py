@@ -0,0 +1,246 @@
+"""In-process caches used by ``Model``."""
+import atexit
+import hashlib
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class LRUCache:
+    """Bounded, thread-safe least-recently-used map with hit/miss counters.
+
+    With ``ttl`` (seconds), entries also expire that long after insertion.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, expires_at: Optional[float]) -> bool:
+        return expires_at is not None and expires_at <= time.monotonic()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def items(self) -> List[tuple]:
+        """Live ``(key, value)`` pairs, least recently used first."""
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items() if not self._expired(expires_at)]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace runs so reformatted copies of a snippet share a key."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding backend with an LRU cache of query embeddings.
+
+    Only queries are cached; ``embed_documents`` (ingestion) passes straight
+    through. Queries are embedded in their whitespace-normalized form so a
+    cached vector is exactly what a fresh call would return. With ``path``,
+    the cache is loaded at start-up and written back at interpreter exit.
+    """
+
+    def __init__(self, inner: Embeddings, max_size: int = 4096, path: Optional[str] = None) -> None:
+        self.inner = inner
+        self.cache = LRUCache(max_size)
+        self.path = path
+        if path:
+            self.load(path)
+            atexit.register(self.save, path)
+
+    # Vectors are stored as float32 arrays: ~1.5 KB each for MiniLM instead
+    # of ~12 KB as a list of Python floats.
+    def _get(self, key: str) -> Optional[List[float]]:
+        vector = self.cache.get(key)
+        return None if vector is None else vector.tolist()
+
+    def _put(self, key: str, vector: List[float]) -> None:
+        self.cache.put(key, array("f", vector))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_queries([text]))[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries, computing only the cache misses (in one call)."""
+        keys, results, missing = self._lookup(texts)
+        if missing:
+            vectors = self.inner.embed_documents([normalize_text(texts[i]) for i in missing])
+            self._fill(keys, results, missing, vectors)
+        return results
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        keys, results, missing = self._lookup(texts)
+        if missing:
+            vectors = await self.inner.aembed_documents([normalize_text(texts[i]) for i in missing])
+            self._fill(keys, results, missing, vectors)
+        return results
+
+    def _lookup(self, texts: List[str]):
+        keys = [text_key(text) for text in texts]
+        results = [self._get(key) for key in keys]
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        return keys, results, missing
+
+    def _fill(self, keys, results, missing, vectors) -> None:
+        for i, vector in zip(missing, vectors):
+            self._put(keys[i], vector)
+            results[i] = list(vector)
+
+    def load(self, path: str) -> None:
+        import numpy as np
+
+        if not os.path.exists(path):
+            return
+        with np.load(path, allow_pickle=False) as data:
+            for key, vector in zip(data["keys"].tolist(), data["vectors"]):
+                self._put(key, vector.tolist())
+
+    def save(self, path: str) -> None:
+        import numpy as np
+
+        items = self.cache.items()
+        if not items:
+            return
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(
+            tmp_path,
+            keys=np.array([key for key, _ in items]),
+            vectors=np.array([vector for _, vector in items], dtype="float32"),
+        )
+        os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """Completed answers, looked up by exact request or by near-duplicate query.
+
+    Exact keys hash the normalized query together with a ``namespace`` (the
+    system prompt, instruction and model), so a hit is only possible for
+    the same prompts and model. With ``similarity`` set, a miss falls back to
+    the cached entry of the same namespace whose query embedding has the
+    highest cosine similarity, if it reaches the threshold.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, similarity: Optional[float] = None) -> None:
+        self.entries = LRUCache(max_size, ttl=ttl)
+        self.similarity = similarity
+        self.semantic_hits = 0
+
+    @staticmethod
+    def namespace(*parts: str) -> str:
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def key(namespace: str, query: str) -> str:
+        return hashlib.sha256(f"{namespace}\x1f{normalize_text(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, namespace: str, query: str, vector: Optional[List[float]] = None) -> Optional[str]:
+        entry = self.entries.get(self.key(namespace, query))
+        if entry is not None:
+            return entry[0]
+        if self.similarity is None or vector is None:
+            return None
+        answer = self._nearest(namespace, vector)
+        if answer is not None:
+            self.semantic_hits += 1
+        return answer
+
+    def put(self, namespace: str, query: str, answer: str, vector: Optional[List[float]] = None) -> None:
+        unit = None
+        if self.similarity is not None and vector is not None:
+            unit = _unit(vector)
+        self.entries.put(self.key(namespace, query), (answer, namespace, unit))
+
+    def _nearest(self, namespace: str, vector: List[float]) -> Optional[str]:
+        import numpy as np
+
+        candidates = [entry for _, entry in self.entries.items() if entry[1] == namespace and entry[2] is not None]
+        if not candidates:
+            return None
+        scores = np.stack([entry[2] for entry in candidates]) @ _unit(vector)
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.similarity else None
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.entries.stats()
+        # A semantic hit was first counted as an exact-key miss.
+        stats["misses"] -= self.semantic_hits
+        stats["semantic_hits"] = self.semantic_hits
+        lookups = stats["hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+def _unit(vector: List[float]):
+    import numpy as np
+
+    v = np.asarray(vector, dtype="float32")
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm else v
@@ -0,0 +1,103 @@
+"""Single-flight coalescing of identical in-flight completions.
+
+The first request for a key starts the computation as a background task;
+requests arriving with the same key while it runs subscribe to it instead of
+starting their own. Every subscriber gets the whole token stream: a late
+joiner first receives everything produced so far in one piece, then the rest
+live. The computation is cancelled once its last subscriber leaves.
+"""
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from metrics import Trace
+
+
+class Flight:
+    """One in-flight computation and the tokens it has produced so far."""
+
+    def __init__(self, key: str, registry: Dict[str, "Flight"]) -> None:
+        self.key = key
+        self._registry = registry
+        self.pieces: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.trace = Trace()  # shared by all subscribers: usage of the one upstream call
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        # Wake current waiters; later waiters get a fresh event.
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """Yield every piece from the start; raise the computation's error, if any."""
+        self.subscribers += 1
+        try:
+            sent = 0
+            while True:
+                if sent < len(self.pieces):
+                    # Catch up in one piece (a replay for late joiners).
+                    chunk = "".join(self.pieces[sent:])
+                    sent = len(self.pieces)
+                    yield chunk
+                    continue
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                # Nobody is listening any more; new requests must not join a dying flight.
+                self.unregister()
+                self.task.cancel()
+
+    def unregister(self) -> None:
+        if self._registry.get(self.key) is self:
+            del self._registry[self.key]
+
+
+class SingleFlight:
+    """Registry of in-flight computations by key."""
+
+    def __init__(self) -> None:
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, key: str, produce: Callable[[Trace], AsyncIterator[str]]) -> "tuple[Flight, bool]":
+        """The flight for ``key``, started with ``produce(trace)`` if none is running.
+
+        Returns the flight and whether it was already running. Subscribe to it
+        right away: a flight nobody has subscribed to yet is not cancelled.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.joined += 1
+            return flight, True
+        flight = Flight(key, self._flights)
+        self._flights[key] = flight
+        flight.task = asyncio.create_task(self._pump(flight, produce))
+        self.started += 1
+        return flight, False
+
+    async def _pump(self, flight: Flight, produce: Callable[[Trace], AsyncIterator[str]]) -> None:
+        try:
+            async for piece in produce(flight.trace):
+                flight.pieces.append(piece)
+                flight._notify()
+        except BaseException as e:
+            flight.error = e if isinstance(e, Exception) else RuntimeError("request cancelled")
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            flight.done = True
+            # Later requests go to the response cache (or start a new flight).
+            flight.unregister()
+            flight._notify()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
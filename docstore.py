@@ -0,0 +1,190 @@
+"""Compact on-disk document store for the FAISS index (``docstore.sqlite``).
+
+Replaces the pickled ``index.pkl``: chunk text and metadata live in an
+SQLite file that is memory-mapped and read lazily, one row per search hit,
+so opening the index costs the same regardless of corpus size and never
+unpickles anything. The same file holds the FAISS position -> chunk id
+table that langchain's ``FAISS`` wrapper needs.
+
+Writes are staged in memory on the docstore object and applied in a single
+transaction by ``commit``, to a copy of the file for the index's next
+generation (see ``index_store.save_index_atomic``).
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_NAME = "docstore.sqlite"
+# Upper bound on how much of the file SQLite maps into the address space.
+MMAP_SIZE = 1 << 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS positions (
+    pos INTEGER PRIMARY KEY,
+    id TEXT NOT NULL
+);
+"""
+
+
+def _connect(path: str, readonly: bool) -> sqlite3.Connection:
+    if readonly:
+        conn = sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True, timeout=30, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    return conn
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore backed by ``docstore.sqlite``, read lazily by id.
+
+    ``add``/``delete`` only stage changes on this object (they are visible
+    to its own ``search`` immediately); ``commit`` writes them to disk.
+    ``copy`` returns an independent view of the same file, which is how
+    the index is updated copy-on-write while other threads keep reading.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._added: Dict[str, Document] = {}
+        self._deleted: Set[str] = set()
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _connect(self.path, readonly=True)
+            self._local.conn = conn
+        return conn
+
+    def _exists(self, doc_id: str) -> bool:
+        if doc_id in self._added:
+            return True
+        if doc_id in self._deleted:
+            return False
+        return self._conn().execute("SELECT 1 FROM docs WHERE id = ?", (doc_id,)).fetchone() is not None
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        if search in self._deleted:
+            return f"ID {search} not found."
+        row = self._conn().execute("SELECT text, metadata FROM docs WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [doc_id for doc_id in texts if self._exists(doc_id)]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+        self._deleted.difference_update(texts)
+
+    def delete(self, ids: List) -> None:
+        missing = [doc_id for doc_id in ids if not self._exists(doc_id)]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for doc_id in ids:
+            if self._added.pop(doc_id, None) is None:
+                self._deleted.add(doc_id)
+
+    def copy(self) -> "SQLiteDocstore":
+        other = SQLiteDocstore(self.path)
+        other._added = dict(self._added)
+        other._deleted = set(self._deleted)
+        return other
+
+    def staged(self) -> Tuple[Dict[str, Document], Set[str]]:
+        """Copies of the staged additions and deletions, not yet committed."""
+        return dict(self._added), set(self._deleted)
+
+    def texts(self) -> Iterator[Tuple[str, str]]:
+        """``(id, text)`` of every committed chunk."""
+        return iter(self._conn().execute("SELECT id, text FROM docs"))
+
+    def load_positions(self) -> Dict[int, str]:
+        """The committed position -> id table as a plain (mutable) dict."""
+        return dict(self._conn().execute("SELECT pos, id FROM positions"))
+
+    def commit(self, positions: Mapping[int, str], path: Optional[str] = None) -> None:
+        """Write staged changes and the position table in one transaction.
+
+        With ``path``, the file is first copied there and the changes go to
+        the copy, which this store reads from afterwards; the original file
+        (and every other store reading it) is left untouched.
+        """
+        if path is not None:
+            source = _connect(self.path, readonly=True)
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                source.backup(conn)
+            finally:
+                source.close()
+                conn.close()
+        conn = _connect(path or self.path, readonly=False)
+        try:
+            with conn:
+                conn.executemany("DELETE FROM docs WHERE id = ?", ((doc_id,) for doc_id in self._deleted))
+                conn.executemany(
+                    "INSERT INTO docs (id, text, metadata) VALUES (?, ?, ?)",
+                    ((doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in self._added.items()),
+                )
+                if not isinstance(positions, SQLitePositions):
+                    conn.execute("DELETE FROM positions")
+                    conn.executemany("INSERT INTO positions (pos, id) VALUES (?, ?)", positions.items())
+        finally:
+            conn.close()
+        if path is not None:
+            self.path = path
+            self._local = threading.local()  # new connections, to the new file
+        self._added.clear()
+        self._deleted.clear()
+
+
+class SQLitePositions(Mapping):
+    """Read-only, lazily loaded FAISS position -> chunk id table.
+
+    Copy it into a dict (``dict(positions)``) before modifying the index.
+    """
+
+    def __init__(self, docstore: SQLiteDocstore) -> None:
+        self._docstore = docstore
+
+    def __getitem__(self, pos: int) -> str:
+        row = self._docstore._conn().execute("SELECT id FROM positions WHERE pos = ?", (int(pos),)).fetchone()
+        if row is None:
+            raise KeyError(pos)
+        return row[0]
+
+    def __iter__(self) -> Iterator[int]:
+        return (row[0] for row in self._docstore._conn().execute("SELECT pos FROM positions ORDER BY pos"))
+
+    def __len__(self) -> int:
+        return self._docstore._conn().execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+
+def write_docstore(path: str, docs: Iterable[Tuple[str, Document]], positions: Mapping[int, str]) -> None:
+    """Write a fresh docstore file at ``path`` from ``(id, document)`` pairs."""
+    conn = _connect(path, readonly=False)
+    try:
+        with conn:
+            conn.executescript(_SCHEMA)
+            conn.executemany(
+                "INSERT INTO docs (id, text, metadata) VALUES (?, ?, ?)",
+                ((doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in docs),
+            )
+            conn.executemany("INSERT INTO positions (pos, id) VALUES (?, ?)", positions.items())
+    finally:
+        conn.close()
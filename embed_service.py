@@ -0,0 +1,58 @@
+"""Shared embedding service: one MiniLM model for every server worker.
+
+Run it once per host and point the API workers at it:
+
+    python embed_service.py --port 8100
+    RAG_EMBEDDINGS_URL=http://127.0.0.1:8100 python -m uvicorn server:app --workers 8
+
+Exposes an OpenAI-compatible ``POST /v1/embeddings``.
+"""
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from embedding_backends import local_embeddings
+from index_store import EMBEDDING_MODEL
+
+app = FastAPI(title="CapstoneRAGTool embeddings", version="1.0.0")
+
+embeddings: Any = None
+# One forward pass at a time: concurrent passes only oversubscribe the CPU.
+_embed_lock = threading.Lock()
+
+
+class EmbeddingRequest(BaseModel):
+	input: Union[str, List[str]]
+	model: Optional[str] = None  # ignored; the service hosts a single model
+
+
+@app.on_event("startup")
+def _load() -> None:
+	global embeddings
+	embeddings = local_embeddings()
+
+
+@app.post("/v1/embeddings")
+def create_embeddings(req: EmbeddingRequest) -> Dict[str, Any]:
+	texts = [req.input] if isinstance(req.input, str) else req.input
+	with _embed_lock:
+		vectors = embeddings.embed_documents(texts)
+	return {
+		"object": "list",
+		"model": EMBEDDING_MODEL,
+		"data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+		"usage": {"prompt_tokens": 0, "total_tokens": 0},
+	}
+
+
+if __name__ == "__main__":
+	import uvicorn
+
+	parser = argparse.ArgumentParser(description="Shared embedding service")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8100)
+	args = parser.parse_args()
+	uvicorn.run(app, host=args.host, port=args.port)
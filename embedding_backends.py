@@ -0,0 +1,153 @@
+"""Embedding backends used for queries and ingestion, selected by configuration.
+
+By default every process loads its own MiniLM model. Setting
+``RAG_EMBEDDINGS_URL`` (e.g. ``http://127.0.0.1:8100``) points them at one
+shared ``embed_service.py`` process instead, so N server workers hold one
+copy of the model rather than N.
+
+``RAG_EMBEDDINGS_BACKEND=onnx`` runs the same MiniLM exported to int8 ONNX
+(``python export_onnx.py export``) with onnxruntime instead of torch and
+sentence-transformers, which start much faster and need far less memory.
+"""
+import os
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from index_store import EMBEDDING_MODEL
+
+EMBEDDINGS_URL_ENV = "RAG_EMBEDDINGS_URL"
+EMBEDDINGS_BACKEND_ENV = "RAG_EMBEDDINGS_BACKEND"
+ONNX_MODEL_DIR_ENV = "RAG_ONNX_MODEL_DIR"
+ONNX_MODEL_DIR = "minilm-onnx"
+ONNX_MODEL_FILE = "model_int8.onnx"
+# all-MiniLM-L6-v2's max_seq_length; longer inputs are truncated like in sentence-transformers.
+MAX_SEQ_LENGTH = 256
+
+
+class RemoteEmbeddings(Embeddings):
+    """Client for the shared embedding service (OpenAI ``/v1/embeddings`` shape)."""
+
+    def __init__(self, base_url: str, timeout: float = 30.0) -> None:
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # Keep-alive connection pool reused by every call from this process.
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout)
+        self._aclient: Optional["httpx.AsyncClient"] = None
+
+    @staticmethod
+    def _vectors(payload: dict) -> List[List[float]]:
+        data = sorted(payload["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        response = self._client.post("/v1/embeddings", json={"input": texts, "model": EMBEDDING_MODEL})
+        response.raise_for_status()
+        return self._vectors(response.json())
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        import httpx
+
+        if not texts:
+            return []
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        response = await self._aclient.post("/v1/embeddings", json={"input": texts, "model": EMBEDDING_MODEL})
+        response.raise_for_status()
+        return self._vectors(response.json())
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class OnnxEmbeddings(Embeddings):
+    """MiniLM as an ONNX graph on onnxruntime (CPU), pooled like sentence-transformers.
+
+    Mean pooling over the attention mask followed by L2 normalization, so the
+    vectors are interchangeable with ``local_embeddings()`` and work with the
+    existing index.
+    """
+
+    def __init__(
+        self,
+        model_dir: str = ONNX_MODEL_DIR,
+        model_file: str = ONNX_MODEL_FILE,
+        batch_size: int = 32,
+        threads: Optional[int] = None,
+    ) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("RAG_EMBEDDINGS_BACKEND=onnx needs onnxruntime: pip install onnxruntime") from e
+        from tokenizers import Tokenizer
+
+        path = os.path.join(model_dir, model_file)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; create it with: python export_onnx.py export --out {model_dir}")
+        self.batch_size = batch_size
+        self._tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self._tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        self._tokenizer.enable_padding()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {node.name for node in self._session.get_inputs()}
+
+    def _embed_batch(self, texts: List[str]):
+        import numpy as np
+
+        encodings = self._tokenizer.encode_batch(texts)
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self._session.run(None, {k: v for k, v in feed.items() if k in self._input_names})[0]
+        mask = feed["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def onnx_embeddings() -> Embeddings:
+    """The int8 ONNX MiniLM from ``RAG_ONNX_MODEL_DIR``."""
+    return OnnxEmbeddings(os.getenv(ONNX_MODEL_DIR_ENV, ONNX_MODEL_DIR))
+
+
+def torch_embeddings() -> Embeddings:
+    """MiniLM through sentence-transformers (torch); the reference implementation."""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def local_embeddings() -> Embeddings:
+    """The in-process MiniLM model, on torch or (``RAG_EMBEDDINGS_BACKEND=onnx``) onnxruntime."""
+    if os.getenv(EMBEDDINGS_BACKEND_ENV, "").lower() == "onnx":
+        return onnx_embeddings()
+    return torch_embeddings()
+
+
+def make_embeddings() -> Embeddings:
+    """Embedding backend for this process, chosen from the environment."""
+    url = os.getenv(EMBEDDINGS_URL_ENV)
+    if url:
+        return RemoteEmbeddings(url)
+    return local_embeddings()
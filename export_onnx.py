@@ -0,0 +1,183 @@
+"""Export MiniLM to int8 ONNX and check it against the torch model.
+
+``export`` (needs torch and transformers, once) writes ``model.onnx``,
+the dynamically quantized ``model_int8.onnx`` and ``tokenizer.json``:
+
+    python export_onnx.py export --out minilm-onnx
+
+``check`` embeds chunks sampled from ``ipp_index`` with both backends and
+reports cosine similarity, top-k agreement of index searches, single-query
+and batched embedding speed, and cold start (imports + model load + first
+query in a fresh interpreter). It exits non-zero when parity is below
+``--min-cosine`` / ``--min-recall``:
+
+    python export_onnx.py check --json onnx_check.json
+
+Serve with it by setting ``RAG_EMBEDDINGS_BACKEND=onnx`` (and
+``RAG_ONNX_MODEL_DIR`` if the model is not in ``minilm-onnx``).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from embedding_backends import MAX_SEQ_LENGTH, ONNX_MODEL_DIR, ONNX_MODEL_FILE
+from index_store import EMBEDDING_MODEL, INDEX_DIR
+
+
+def export(args: argparse.Namespace) -> None:
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(args.out, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    tokenizer.save_pretrained(args.out)  # tokenizer.json is all the runtime needs
+    model = AutoModel.from_pretrained(EMBEDDING_MODEL).eval()
+
+    sample = tokenizer(["int main(void) { return 0; }"], return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    fp32_path = os.path.join(args.out, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in names),
+            fp32_path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]},
+            opset_version=args.opset,
+        )
+    int8_path = os.path.join(args.out, ONNX_MODEL_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    fp32_mb, int8_mb = (os.path.getsize(path) / 2**20 for path in (fp32_path, int8_path))
+    print(f"Wrote {fp32_path} ({fp32_mb:.1f} MB) and {int8_path} ({int8_mb:.1f} MB)", file=sys.stderr)
+
+
+def _backend(name: str, model_dir: str):
+    from embedding_backends import OnnxEmbeddings, torch_embeddings
+
+    return OnnxEmbeddings(model_dir) if name == "onnx" else torch_embeddings()
+
+
+def _probe(name: str, model_dir: str) -> None:
+    # Runs in a fresh interpreter: what a worker pays before its first query.
+    from bench_retrieval import rss_mb
+
+    start = time.perf_counter()
+    embeddings = _backend(name, model_dir)
+    load_s = time.perf_counter() - start
+    embeddings.embed_query("warm-up")
+    print(json.dumps({"load_s": round(load_s, 3), "first_query_s": round(time.perf_counter() - start, 3), "rss_mb": rss_mb()}))
+
+
+def _cold_start(name: str, model_dir: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "check", "--probe", name, "--model-dir", model_dir],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def check(args: argparse.Namespace) -> None:
+    if args.probe:
+        _probe(args.probe, args.model_dir)
+        return
+    import numpy as np
+
+    from bench_retrieval import sample_texts
+    from index_store import load_index
+
+    reference = _backend("torch", args.model_dir)
+    candidate = _backend("onnx", args.model_dir)
+    vstore = load_index(reference, args.index)
+    texts = sample_texts(vstore, args.texts, np.random.default_rng(args.seed))
+    if not texts:
+        sys.exit("index has no documents to sample")
+
+    ref = np.asarray(reference.embed_documents(texts), dtype="float32")
+    onnx = np.asarray(candidate.embed_documents(texts), dtype="float32")
+    cosine = (ref * onnx).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(onnx, axis=1))
+    # Do both backends retrieve the same chunks from the existing index?
+    _, ref_ids = vstore.index.search(ref, args.k)
+    _, onnx_ids = vstore.index.search(onnx, args.k)
+    recall = sum(len(set(a) & set(b)) for a, b in zip(ref_ids.tolist(), onnx_ids.tolist())) / ref_ids.size
+    parity = {
+        "texts": len(texts),
+        "cosine_min": round(float(cosine.min()), 5),
+        "cosine_mean": round(float(cosine.mean()), 5),
+        f"recall@{args.k}": round(recall, 4),
+    }
+
+    queries = texts[: args.queries]
+    speed = {}
+    for name, backend in (("torch", reference), ("onnx", candidate)):
+        backend.embed_query(queries[0])
+        single = [_timed(backend.embed_query, q) for q in queries]
+        batches = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+        batched = sum(_timed(backend.embed_documents, batch) for batch in batches)
+        speed[name] = {
+            "single_p50_ms": round(float(np.percentile(single, 50)) * 1000, 3),
+            "single_p99_ms": round(float(np.percentile(single, 99)) * 1000, 3),
+            f"batch{args.batch_size}_texts_per_s": round(len(texts) / batched, 1),
+            "cold_start": _cold_start(name, args.model_dir),
+        }
+    speedup = {
+        "single_p50": round(speed["torch"]["single_p50_ms"] / speed["onnx"]["single_p50_ms"], 2),
+        "batched": round(speed["onnx"][f"batch{args.batch_size}_texts_per_s"] / speed["torch"][f"batch{args.batch_size}_texts_per_s"], 2),
+        "cold_start": round(speed["torch"]["cold_start"]["first_query_s"] / speed["onnx"]["cold_start"]["first_query_s"], 2),
+    }
+
+    print(f"parity: cosine min {parity['cosine_min']:.5f} mean {parity['cosine_mean']:.5f}, "
+          f"recall@{args.k} vs torch {parity[f'recall@{args.k}']:.4f} ({len(texts)} texts)")
+    for name, r in speed.items():
+        print(f"{name:<6} single p50 {r['single_p50_ms']:8.2f} ms  p99 {r['single_p99_ms']:8.2f} ms  "
+              f"batch {r[f'batch{args.batch_size}_texts_per_s']:8.1f} texts/s  "
+              f"cold start {r['cold_start']['first_query_s']:6.2f} s  rss {r['cold_start']['rss_mb'] or 0:7.1f} MB")
+    print(f"speedup: single {speedup['single_p50']}x, batched {speedup['batched']}x, cold start {speedup['cold_start']}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"model": EMBEDDING_MODEL, "max_seq_length": MAX_SEQ_LENGTH, "parity": parity,
+                       "speed": speed, "speedup": speedup}, f, indent=2)
+    if parity["cosine_min"] < args.min_cosine or recall < args.min_recall:
+        sys.exit(f"parity check failed (min cosine {args.min_cosine}, min recall {args.min_recall})")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Export MiniLM to ONNX and quantize it to int8")
+    p_export.add_argument("--out", default=ONNX_MODEL_DIR, help="Output folder")
+    p_export.add_argument("--opset", type=int, default=17)
+    p_export.set_defaults(func=export)
+
+    p_check = sub.add_parser("check", help="Parity and speed of the ONNX model against torch")
+    p_check.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    p_check.add_argument("--index", default=INDEX_DIR)
+    p_check.add_argument("--texts", type=int, default=256, help="Index chunks to compare")
+    p_check.add_argument("--queries", type=int, default=100, help="Single-query timings per backend")
+    p_check.add_argument("--batch-size", type=int, default=32)
+    p_check.add_argument("--k", type=int, default=4)
+    p_check.add_argument("--min-cosine", type=float, default=0.98)
+    p_check.add_argument("--min-recall", type=float, default=0.9)
+    p_check.add_argument("--seed", type=int, default=0)
+    p_check.add_argument("--json", default=None, help="Also write results to this JSON file")
+    p_check.add_argument("--probe", choices=("torch", "onnx"), help=argparse.SUPPRESS)
+    p_check.set_defaults(func=check)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from tkinter import *
 from tkinter import filedialog, messagebox
-from model import Model
 import threading
+import time
 import re
 
 
@@ -22,10 +22,12 @@ class GUI(Tk):
         # Bottom bar: Settings | Run | Load Data | Save Output | NEW: Copy Code
         self._build_bottom_bar()
 
-        # Instantiate Model and check connection
-        self.model = Model() 
-        self._check_model_connection() 
-        
+        # Load the Model in the background so the window paints and responds
+        # right away; buttons that need it stay disabled until it is ready.
+        self.model = None
+        self._set_model_buttons(DISABLED)
+        self._load_model()
+
 
     # ------------------------- UI Builders -------------------------
     def _build_top_bar(self):
@@ -205,17 +207,45 @@ class GUI(Tk):
         margin = 10
         c.create_line(margin, y, w - margin - 10, y, width=3, arrow=LAST, arrowshape=(12, 15, 6))
 
+    def _set_status(self, text: str):
+        # Safe from worker threads: the label is updated on the Tk main loop.
+        self.after(0, lambda: self.model_status_lb.config(text=f"Model Status: {text}"))
+
+    def _set_model_buttons(self, state):
+        for btn in (self.settings_btn, self.run_btn, self.load_btn):
+            btn.config(state=state)
+
+    def _load_model(self):
+        def load():
+            start = time.perf_counter()
+            self._set_status("Importing libraries...")
+            try:
+                # Imported here, not at module level: langchain, torch and faiss
+                # take seconds to import and must not delay the first paint.
+                from model import Model
+
+                model = Model(progress=lambda step: self._set_status(f"{step}..."))
+            except Exception as e:
+                self._set_status(f"Load failed - {e}")
+                return
+            self.model = model
+            self.after(0, lambda: self._set_model_buttons(NORMAL))
+            self._set_status(f"Loaded in {time.perf_counter() - start:.1f}s")
+            self._check_model_connection()
+
+        threading.Thread(target=load, name="model-loader", daemon=True).start()
+
     def _check_model_connection(self):
         def check():
-            self.model_status_lb.config(text="Model Status: Checking...")
+            self._set_status("Checking...")
             try:
                 response = self.model.check_connection()
                 if response:
-                    self.model_status_lb.config(text="Model Status: Connected")
+                    self._set_status("Connected")
                 else:
-                    self.model_status_lb.config(text="Model Status: No response")
+                    self._set_status("No response")
             except Exception as e:
-                self.model_status_lb.config(text=f"Model Status: Error - {e}")
+                self._set_status(f"Error - {e}")
 
         threading.Thread(target=check, daemon=True).start()
 
@@ -306,8 +336,22 @@ class GUI(Tk):
         ])
         if not path:
             return
-        self.model.add_pdf_to_rag(path)
-        messagebox.showinfo("Load Data", f"Loaded data from:\n{path}. Please restart the application to ensure changes take effect.")
+
+        self.load_btn.config(state=DISABLED)
+        self.model_status_lb.config(text="Model Status: Indexing data...")
+
+        def load():
+            try:
+                self.model.add_pdf_to_rag(path)
+                self.after(0, lambda: messagebox.showinfo("Load Data", f"Loaded data from:\n{path}"))
+                self.after(0, lambda: self.model_status_lb.config(text="Model Status: Connected"))
+            except Exception as e:
+                self.after(0, lambda err=e: messagebox.showerror("Load Data", f"Failed to load data:\n{err}"))
+                self.after(0, lambda: self.model_status_lb.config(text="Model Status: Load failed"))
+            finally:
+                self.after(0, lambda: self.load_btn.config(state=NORMAL))
+
+        threading.Thread(target=load, daemon=True).start()
 
     def on_save_output(self):
         output_content = self.output_text.get("1.0", END).strip()
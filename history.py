@@ -0,0 +1,114 @@
+"""Token-budgeted window over the turns of a multi-turn chat.
+
+The API server flattens a request's messages into one transcript. In a
+refactoring session every follow-up re-sends all earlier code and answers,
+so the prompt (and its token count, response-cache key and split decision)
+grows with each turn. ``HistoryWindow.fit`` bounds it:
+
+* the current turn and the latest user turn with code (fenced blocks or
+  real C, see ``query_plan.has_code``) are kept whole;
+* earlier turns are kept whole, newest first, while they fit in
+  ``max_tokens``;
+* older turns are replaced by short extractive summaries (the request in a
+  sentence, the functions the code defines, the IPP functions mentioned),
+  cached by a hash of their content so each is computed once per session;
+* turns whose summaries no longer fit are dropped.
+
+Retrieval only looks at the latest user code (see ``query_plan.user_code``),
+so summarized turns never reach the embedder.
+"""
+import hashlib
+import re
+from typing import List, Sequence, Tuple
+
+from c_units import FUNCTION, code_blocks, split_units, strip_code_blocks, strip_comments
+from cache import LRUCache
+from query_plan import has_code
+from tokens import count_tokens, truncate_tokens
+
+MAX_TOKENS = 2000
+SUMMARY_TOKENS = 48
+MAX_NAMES = 6
+SUMMARY_PREFIX = "(earlier turn, summarized) "
+
+_IPP_NAME = re.compile(r"\bipp[a-z]*[A-Z]\w*")
+_SENTENCE = re.compile(r"(?<=[.!?])\s")
+
+Turn = Tuple[str, str]  # (role, content)
+
+
+def _names(items: List[str]) -> str:
+    items = list(dict.fromkeys(items))
+    more = f" and {len(items) - MAX_NAMES} more" if len(items) > MAX_NAMES else ""
+    return ", ".join(items[:MAX_NAMES]) + more
+
+
+def summarize_turn(content: str, max_tokens: int = SUMMARY_TOKENS) -> str:
+    """A one-line digest of a turn: its first sentence, the functions its code defines, the IPP functions it names."""
+    blocks = code_blocks(content)
+    if blocks:
+        code, prose = "\n".join(blocks), strip_code_blocks(content)
+    elif has_code(content):
+        code, prose = content, ""
+    else:
+        code, prose = "", content
+    parts = []
+    prose = " ".join(prose.split())
+    if prose:
+        parts.append(_SENTENCE.split(prose, 1)[0].rstrip(".!?"))
+    if code:
+        functions = [unit.name for unit in split_units(strip_comments(code)) if unit.kind == FUNCTION and unit.name]
+        parts.append(f"code defining {_names(functions)}" if functions else "code")
+    ipp = _IPP_NAME.findall(content)
+    if ipp:
+        parts.append(f"uses {_names(ipp)}")
+    return truncate_tokens(SUMMARY_PREFIX + ". ".join(parts), max_tokens)
+
+
+class HistoryWindow:
+    """Fits chat turns into a token budget, summarizing the oldest (``max_tokens`` <= 0 keeps everything)."""
+
+    def __init__(self, max_tokens: int = MAX_TOKENS, summary_tokens: int = SUMMARY_TOKENS, cache_size: int = 1024) -> None:
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summaries = LRUCache(cache_size)
+
+    def summary(self, role: str, content: str) -> str:
+        key = hashlib.sha256(f"{role}\x1f{content}".encode("utf-8")).hexdigest()
+        summary = self.summaries.get(key)
+        if summary is None:
+            summary = summarize_turn(content, self.summary_tokens)
+            self.summaries.put(key, summary)
+        return summary
+
+    def fit(self, turns: Sequence[Turn]) -> List[Turn]:
+        """``turns`` (oldest first) with older ones summarized or dropped to fit the budget."""
+        if self.max_tokens <= 0 or len(turns) <= 1:
+            return list(turns)
+        last = len(turns) - 1
+        pinned = {last}
+        code_turn = next((i for i in range(last, -1, -1) if turns[i][0] == "user" and has_code(turns[i][1])), None)
+        if code_turn is not None:
+            pinned.add(code_turn)
+        # Pinned turns are kept even if they alone exceed the budget.
+        budget = self.max_tokens - sum(count_tokens(turns[i][1]) for i in pinned)
+        kept = {i: turns[i][1] for i in pinned}
+        summarizing = False
+        for i in range(last - 1, -1, -1):
+            if i in pinned:
+                continue
+            role, content = turns[i]
+            if not summarizing:
+                cost = count_tokens(content)
+                if cost <= budget:
+                    kept[i] = content
+                    budget -= cost
+                    continue
+                summarizing = True  # this turn and every older one
+            summary = self.summary(role, content)
+            cost = count_tokens(summary)
+            if cost > budget:
+                break
+            kept[i] = summary
+            budget -= cost
+        return [(turns[i][0], kept[i]) for i in sorted(kept)]
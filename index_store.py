@@ -0,0 +1,536 @@
+"""Loading, copying and persisting the FAISS index stored in ``ipp_index/``.
+
+Every save writes a new generation directory (``ipp_index/gen-000042/``)
+holding the faiss index, docstore, lexical index, manifest and search
+parameters, then switches the ``CURRENT`` pointer file to it. Files of a
+generation are never modified after the switch, so processes still serving
+an older generation keep reading consistent data until they reload.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+INDEX_DIR = "ipp_index"
+INDEX_NAME = "index"
+MANIFEST_NAME = "manifest.json"
+SEARCH_PARAMS_NAME = "search_params.json"
+CURRENT_NAME = "CURRENT"
+# Generations kept on disk besides the current one, for processes still reading them.
+KEEP_GENERATIONS = 2
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+# faiss/langchain are imported inside the functions so that importing this
+# module for its constants stays cheap (e.g. in ingestion worker processes).
+
+_GENERATION = re.compile(r"^gen-(\d+)$")
+# Files of an index written before generations existed, directly in the folder.
+_LEGACY_FILES = (f"{INDEX_NAME}.faiss", f"{INDEX_NAME}.pkl", "docstore.sqlite", "lexical.npz", MANIFEST_NAME, SEARCH_PARAMS_NAME)
+
+
+def current_generation(folder: str = INDEX_DIR) -> Optional[str]:
+    """Name of the generation ``folder``'s ``CURRENT`` pointer names, or None."""
+    try:
+        with open(os.path.join(folder, CURRENT_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def generation_dir(folder: str = INDEX_DIR) -> str:
+    """Directory holding the live index files of ``folder``.
+
+    That is the current generation, or ``folder`` itself for an index saved
+    before generations existed (or a generation directory passed directly).
+    Resolve it once and pass the result on to read files of one generation.
+    """
+    name = current_generation(folder)
+    return os.path.join(folder, name) if name else folder
+
+
+def _generations(folder: str) -> List[Tuple[int, str]]:
+    found = []
+    for name in os.listdir(folder):
+        match = _GENERATION.match(name)
+        if match and os.path.isdir(os.path.join(folder, name)):
+            found.append((int(match.group(1)), name))
+    return sorted(found)
+
+
+def _new_generation(folder: str) -> str:
+    # Create (exclusively, so concurrent writers never share one) the next generation directory.
+    number = max((n for n, _ in _generations(folder)), default=0)
+    while True:
+        number += 1
+        path = os.path.join(folder, f"gen-{number:06d}")
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            continue
+
+
+def _switch_generation(folder: str, path: str) -> None:
+    pointer = os.path.join(folder, CURRENT_NAME)
+    tmp_path = f"{pointer}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path))
+    os.replace(tmp_path, pointer)
+
+
+def _remove_old_generations(folder: str, keep: int = KEEP_GENERATIONS) -> None:
+    # Older generations and legacy top-level files; files still open elsewhere
+    # (not removable on Windows) are left for the next save.
+    current = current_generation(folder)
+    old = [name for _, name in _generations(folder) if name != current]
+    for name in old[:max(0, len(old) - keep)]:
+        shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+    for name in _LEGACY_FILES:
+        try:
+            os.remove(os.path.join(folder, name))
+        except OSError:
+            pass
+
+
+def read_faiss_index(path: str, mmap: bool = True):
+    """Read a raw faiss index, memory-mapping it read-only when possible."""
+    import faiss
+
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError:
+            pass  # index type or platform without mmap support
+    return faiss.read_index(path)
+
+
+def load_index(embeddings, folder: str = INDEX_DIR, mmap: bool = True) -> "FAISS":
+    """Load the vector store saved in ``folder`` (its current generation, see ``generation_dir``).
+
+    With ``mmap`` (the default, for serving) the faiss index is memory-mapped
+    read-only and chunk ids are looked up lazily, so the store must be copied
+    with ``clone_index`` before it is modified. Pass ``mmap=False`` to get a
+    store that can be modified in place.
+
+    Indexes saved before ``docstore.sqlite`` existed fall back to unpickling
+    ``index.pkl``; run ``python rag_creator.py migrate`` to convert them.
+
+    Query-time knobs (``nprobe``/``ef_search``) are set from the folder's
+    tuned search parameters, or sensible defaults (see ``load_search_params``).
+    """
+    from langchain_community.vectorstores import FAISS
+
+    from docstore import DOCSTORE_NAME, SQLiteDocstore, SQLitePositions
+
+    folder = generation_dir(folder)
+    docstore_path = os.path.join(folder, DOCSTORE_NAME)
+    if not os.path.exists(docstore_path):
+        vstore = FAISS.load_local(
+            folder,
+            embeddings,
+            index_name=INDEX_NAME,
+            allow_dangerous_deserialization=True,
+        )
+    else:
+        docstore = SQLiteDocstore(docstore_path)
+        vstore = FAISS(
+            embedding_function=embeddings,
+            index=read_faiss_index(os.path.join(folder, f"{INDEX_NAME}.faiss"), mmap=mmap),
+            docstore=docstore,
+            index_to_docstore_id=SQLitePositions(docstore) if mmap else docstore.load_positions(),
+        )
+    set_search_params(vstore.index, **load_search_params(vstore.index, folder))
+    return vstore
+
+
+def clone_index(vstore: "FAISS") -> "FAISS":
+    """Return an independent, modifiable copy of ``vstore``.
+
+    The copy can be appended to while the original keeps serving searches;
+    swapping the reference afterwards publishes the update (copy-on-write).
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    from docstore import SQLiteDocstore, SQLitePositions
+
+    if isinstance(vstore.docstore, SQLiteDocstore):
+        docstore = vstore.docstore.copy()
+    else:
+        docstore = InMemoryDocstore(dict(vstore.docstore._dict))
+    positions = vstore.index_to_docstore_id
+    return FAISS(
+        embedding_function=vstore.embedding_function,
+        # A serialized round trip, not faiss.clone_index: clones of a memory-mapped
+        # index can still view the read-only mapping and abort on add/remove.
+        index=faiss.deserialize_index(faiss.serialize_index(vstore.index)),
+        docstore=docstore,
+        # One query instead of a lookup per position for a lazily read table.
+        index_to_docstore_id=vstore.docstore.load_positions() if isinstance(positions, SQLitePositions) else dict(positions),
+        relevance_score_fn=vstore.override_relevance_score_fn,
+        normalize_L2=vstore._normalize_L2,
+        distance_strategy=vstore.distance_strategy,
+    )
+
+
+def search_batch(vstore: "FAISS", vectors, k: int) -> List[List["Document"]]:
+    """Top-``k`` documents for each query vector, using one faiss search call."""
+    import faiss
+    import numpy as np
+    from langchain_core.documents import Document
+
+    queries = np.asarray(vectors, dtype="float32")
+    if vstore._normalize_L2:
+        faiss.normalize_L2(queries)
+    _, indices = vstore.index.search(queries, k)
+    results: List[List[Document]] = []
+    for row in indices:
+        docs = []
+        for pos in row:
+            if pos == -1:
+                continue
+            doc_id = vstore.index_to_docstore_id[int(pos)]
+            doc = vstore.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+            docs.append(doc)
+        results.append(docs)
+    return results
+
+
+def chunk_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def save_index_atomic(
+    vstore: "FAISS",
+    folder: str = INDEX_DIR,
+    manifest: Optional["IndexManifest"] = None,
+    rebuild_lexical: bool = False,
+    search_params: Optional[Dict[str, int]] = None,
+) -> str:
+    """Persist ``vstore`` (and ``manifest``) as a new generation of ``folder``.
+
+    All files are written into a fresh generation directory, which the
+    ``CURRENT`` pointer is switched to with one atomic rename; readers of the
+    previous generation are not affected. When ``vstore`` was loaded from the
+    current generation, its docstore file is copied and the staged changes
+    applied to the copy (the store then reads from it), and the lexical index
+    is updated with the same changes; otherwise (or with ``rebuild_lexical``)
+    both are written from scratch. The manifest and tuned search parameters
+    are carried over unless a new ``manifest`` or ``search_params`` is
+    given. Old generations (beyond the last few) and files of the
+    pre-generation layout are removed afterwards.
+
+    Returns the new generation directory.
+    """
+    import faiss
+
+    from docstore import DOCSTORE_NAME, SQLiteDocstore, write_docstore
+    from lexical import LexicalIndex
+
+    os.makedirs(folder, exist_ok=True)
+    base = generation_dir(folder)
+    target = _new_generation(folder)
+    docstore_path = os.path.join(target, DOCSTORE_NAME)
+    docstore = vstore.docstore
+    positions = vstore.index_to_docstore_id
+
+    faiss.write_index(vstore.index, os.path.join(target, f"{INDEX_NAME}.faiss"))
+    lexical = None
+    base_docstore = os.path.join(base, DOCSTORE_NAME)
+    if isinstance(docstore, SQLiteDocstore) and os.path.abspath(docstore.path) == os.path.abspath(base_docstore):
+        added, deleted = docstore.staged()
+        docstore.commit(positions, path=docstore_path)
+        lexical = None if rebuild_lexical else LexicalIndex.load(base)
+        if lexical is not None:
+            lexical = lexical.updated(((doc_id, doc.page_content) for doc_id, doc in added.items()), deleted)
+    else:
+        write_docstore(
+            docstore_path,
+            ((doc_id, docstore.search(doc_id)) for doc_id in positions.values()),
+            positions,
+        )
+    if lexical is None:
+        lexical = LexicalIndex.build(SQLiteDocstore(docstore_path).texts())
+    lexical.save(target)
+
+    if manifest is not None:
+        manifest.save(target)
+    elif os.path.exists(os.path.join(base, MANIFEST_NAME)):
+        shutil.copyfile(os.path.join(base, MANIFEST_NAME), os.path.join(target, MANIFEST_NAME))
+    if search_params is not None:
+        save_search_params(vstore.index, target, **search_params)
+    elif os.path.exists(os.path.join(base, SEARCH_PARAMS_NAME)):
+        # Ignored on load if the index was rebuilt with another type or list count.
+        shutil.copyfile(os.path.join(base, SEARCH_PARAMS_NAME), os.path.join(target, SEARCH_PARAMS_NAME))
+
+    _switch_generation(folder, target)
+    _remove_old_generations(folder)
+    return target
+
+
+class IndexManifest:
+    """Content hashes of every source file and chunk in the index.
+
+    ``sources`` maps a source name (the PDF file name) to
+    ``{"sha256": <file hash>, "chunks": {<chunk text sha256>: <docstore id>}}``.
+    """
+
+    VERSION = 1
+
+    def __init__(self, sources: Optional[Dict[str, dict]] = None) -> None:
+        self.sources: Dict[str, dict] = sources or {}
+
+    @classmethod
+    def load(cls, folder: str = INDEX_DIR) -> Optional["IndexManifest"]:
+        path = os.path.join(generation_dir(folder), MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("sources", {}))
+
+    @classmethod
+    def from_docstore(cls, vstore: "FAISS") -> Tuple["IndexManifest", List[str]]:
+        """Build a manifest for an index created before manifests existed.
+
+        Returns the manifest and the ids of chunks that duplicate another
+        chunk of the same source. File hashes are unknown, so each source is
+        re-read (but not re-embedded) the next time it is ingested.
+        """
+        manifest = cls()
+        duplicates: List[str] = []
+        for doc_id in vstore.index_to_docstore_id.values():
+            doc = vstore.docstore.search(doc_id)
+            if isinstance(doc, str):  # docstore returns an error string for unknown ids
+                continue
+            source = os.path.basename(str(doc.metadata.get("source", "")))
+            entry = manifest.sources.setdefault(source, {"sha256": None, "chunks": {}})
+            digest = chunk_sha256(doc.page_content)
+            if digest in entry["chunks"]:
+                duplicates.append(doc_id)
+            else:
+                entry["chunks"][digest] = doc_id
+        return manifest, duplicates
+
+    def save(self, folder: str = INDEX_DIR) -> None:
+        path = os.path.join(folder, MANIFEST_NAME)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "sources": self.sources}, f)
+        os.replace(tmp_path, path)
+
+
+# ---------------------------------------------------------------------------
+# Approximate index types
+# ---------------------------------------------------------------------------
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+TRAIN_SIZE = 50_000
+HNSW_M = 32
+
+
+def index_type_of(index) -> str:
+    """Name (one of INDEX_TYPES) of a raw faiss index."""
+    import faiss
+
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def index_vectors(index):
+    """All vectors stored in ``index`` as a float32 array, in position order."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_index(
+    index_type: str,
+    vectors,
+    nlist: Optional[int] = None,
+    hnsw_m: int = HNSW_M,
+    pq_m: Optional[int] = None,
+    train_size: int = TRAIN_SIZE,
+    metric: Optional[int] = None,
+):
+    """Build a faiss index of ``index_type`` holding ``vectors`` in order.
+
+    IVF variants are trained on a random sample of at most ``train_size``
+    vectors. ``nlist`` defaults to ~4*sqrt(n) (capped so every list gets
+    enough training points) and ``pq_m`` to the largest of 64/48/32/16/8
+    sub-quantizers that divides the dimension.
+    """
+    import faiss
+    import numpy as np
+
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, d = vectors.shape
+    metric = faiss.METRIC_L2 if metric is None else metric
+
+    if index_type == "flat":
+        index = faiss.IndexFlat(d, metric)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, metric)
+    elif index_type in ("ivf", "ivfpq"):
+        if nlist is None:
+            nlist = max(1, min(int(4 * n ** 0.5), n // 39))
+        if index_type == "ivf":
+            description = f"IVF{nlist},Flat"
+        else:
+            pq_m = pq_m or next((m for m in (64, 48, 32, 16, 8) if d % m == 0), 1)
+            nbits = 8 if min(n, train_size) >= 256 * 39 else 4
+            description = f"IVF{nlist},PQ{pq_m}x{nbits}"
+        index = faiss.index_factory(d, description, metric)
+        sample = vectors
+        if n > train_size:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(n, train_size, replace=False)]
+        index.train(sample)
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+
+    index.add(vectors)
+    return index
+
+
+def convert_index(vstore: "FAISS", index_type: str, **params) -> None:
+    """Replace the index of ``vstore`` in place with one of ``index_type``.
+
+    Vectors keep their positions, so the docstore mapping stays valid.
+    ``params`` are passed to ``make_index``.
+    """
+    vstore.index = make_index(index_type, index_vectors(vstore.index), metric=vstore.index.metric_type, **params)
+
+
+def set_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """Apply query-time knobs: ``nprobe`` for IVF indexes, ``ef_search`` for HNSW."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if nprobe is not None and ivf is not None:
+        ivf.nprobe = nprobe
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def _index_signature(index) -> Dict[str, object]:
+    # What tuned search parameters are valid for: the index type and list count.
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    return {"type": index_type_of(index), "nlist": ivf.nlist if ivf is not None else None}
+
+
+def default_search_params(index) -> Dict[str, int]:
+    """Query-time knobs for an index nobody tuned (faiss's own defaults,
+    nprobe=1 and efSearch=16, lose much of the recall)."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return {"nprobe": min(ivf.nlist, max(8, ivf.nlist // 16))}
+    if isinstance(index, faiss.IndexHNSW):
+        return {"ef_search": 64}
+    return {}
+
+
+def save_search_params(index, folder: str = INDEX_DIR, **params: int) -> None:
+    """Write tuned query-time knobs for ``index`` into ``folder``, a generation being written.
+
+    Use ``save_index_atomic(..., search_params=...)`` to publish new ones.
+    """
+    path = os.path.join(folder, SEARCH_PARAMS_NAME)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"index": _index_signature(index), "params": params}, f)
+    os.replace(tmp_path, path)
+
+
+def load_search_params(index, folder: str = INDEX_DIR) -> Dict[str, int]:
+    """Tuned query-time knobs stored for ``index`` in ``folder``, else the defaults.
+
+    Parameters tuned for another index type or list count (the index was
+    rebuilt since) are ignored.
+    """
+    path = os.path.join(generation_dir(folder), SEARCH_PARAMS_NAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("index") == _index_signature(index):
+            return data.get("params", {})
+    return default_search_params(index)
+
+
+def _compact_ivf(old, keep: List[int]):
+    # A copy of IVF index ``old`` holding only the vectors at positions
+    # ``keep``, renumbered 0..len(keep)-1 in that order.
+    import faiss
+    import numpy as np
+
+    new = faiss.clone_index(old)  # keeps the trained quantizer (and PQ codebooks)
+    new.reset()
+    old_ivf, new_ivf = faiss.extract_index_ivf(old), faiss.extract_index_ivf(new)
+    new_ivf.make_direct_map(False)
+    renumber = np.full(old.ntotal, -1, dtype="int64")
+    renumber[np.asarray(keep, dtype="int64")] = np.arange(len(keep), dtype="int64")
+    lists, code_size = old_ivf.invlists, old_ivf.invlists.code_size
+    for list_no in range(old_ivf.nlist):
+        size = lists.list_size(list_no)
+        if size == 0:
+            continue
+        list_ids = renumber[faiss.rev_swig_ptr(lists.get_ids(list_no), size)]
+        codes = faiss.rev_swig_ptr(lists.get_codes(list_no), size * code_size).reshape(size, code_size)
+        kept = list_ids >= 0
+        if kept.any():
+            list_ids, codes = np.ascontiguousarray(list_ids[kept]), np.ascontiguousarray(codes[kept])
+            new_ivf.invlists.add_entries(list_no, len(list_ids), faiss.swig_ptr(list_ids), faiss.swig_ptr(codes))
+    new_ivf.ntotal = new.ntotal = len(keep)
+    return new
+
+
+def delete_ids(vstore: "FAISS", ids: List[str]) -> None:
+    """Delete documents by docstore id from both the index and the docstore.
+
+    Only a flat index renumbers its vectors on removal the way the position
+    mapping does. An IVF index keeps the ids of the remaining vectors (so
+    positions would point at the wrong chunks), so its kept entries are
+    copied, codes unchanged and ids compacted, into an empty copy of the
+    trained index. HNSW graphs cannot drop nodes, so they are rebuilt from the
+    remaining vectors.
+    """
+    import faiss
+
+    old = vstore.index
+    if index_type_of(old) == "flat":
+        vstore.delete(ids)
+        return
+
+    drop = set(ids)
+    keep = [pos for pos, doc_id in sorted(vstore.index_to_docstore_id.items()) if doc_id not in drop]
+    if isinstance(old, faiss.IndexHNSW):
+        new = faiss.IndexHNSWFlat(old.d, old.hnsw.nb_neighbors(1), old.metric_type)
+        new.hnsw.efConstruction = old.hnsw.efConstruction
+        new.hnsw.efSearch = old.hnsw.efSearch
+        if keep:
+            new.add(index_vectors(old)[keep])
+    else:
+        new = _compact_ivf(old, keep)
+    present = set(vstore.index_to_docstore_id.values())
+    vstore.docstore.delete([doc_id for doc_id in drop if doc_id in present])
+    vstore.index = new
+    vstore.index_to_docstore_id = {i: vstore.index_to_docstore_id[pos] for i, pos in enumerate(keep)}
@@ -0,0 +1,233 @@
+"""Streaming, incremental PDF ingestion pipeline for ``ipp_index``.
+
+Pages are parsed in a process pool, split into chunks as they arrive,
+embedded in fixed-size batches and appended to the FAISS index batch by
+batch, so memory use is bounded by the batch size and the number of pages
+in flight rather than by the size of the documents.
+
+Every source file and chunk is recorded by content hash in the index
+manifest (see ``index_store.IndexManifest``). Re-ingesting a file only
+embeds chunks whose text is new, and deletes chunks that disappeared.
+"""
+import hashlib
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pypdf import PdfReader
+
+from index_store import INDEX_DIR, IndexManifest, chunk_sha256, delete_ids
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 256
+PAGES_PER_TASK = 16
+
+
+def _extract_pages(job: Tuple[str, int, int]) -> List[Tuple[int, str]]:
+    # Runs in a worker process: extract the text of pages [start, end).
+    path, start, end = job
+    reader = PdfReader(path)
+    return [(i, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def iter_pdf_pages(
+    path: str,
+    pool: Optional[Executor] = None,
+    max_in_flight: int = 1,
+    pages_per_task: int = PAGES_PER_TASK,
+) -> Iterator["Document"]:
+    """Yield one Document per page of ``path``, in order.
+
+    With a ``pool``, page ranges are parsed by its workers with at most
+    ``max_in_flight`` ranges outstanding; without one, pages are parsed inline.
+    """
+    from langchain_core.documents import Document
+
+    source = os.path.basename(path)
+    n_pages = len(PdfReader(path).pages)
+    jobs = iter([
+        (path, start, min(start + pages_per_task, n_pages))
+        for start in range(0, n_pages, pages_per_task)
+    ])
+    if pool is None:
+        results = map(_extract_pages, jobs)
+    else:
+        window = deque(pool.submit(_extract_pages, job) for job in islice(jobs, max_in_flight))
+
+        def drain():
+            while window:
+                future = window.popleft()
+                for job in islice(jobs, 1):
+                    window.append(pool.submit(_extract_pages, job))
+                yield future.result()
+
+        results = drain()
+
+    for pages in results:
+        for page_no, text in pages:
+            yield Document(page_content=text, metadata={"source": source, "page": page_no})
+
+
+def iter_chunks(pages: Iterable["Document"], splitter) -> Iterator["Document"]:
+    """Split pages into chunks one page at a time."""
+    for page in pages:
+        yield from splitter.split_documents([page])
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestStats:
+    """Ingestion counters with throughput reporting."""
+
+    def __init__(self) -> None:
+        self.pages = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.skipped = 0
+        self.deleted = 0
+        self.unchanged_files = 0
+        self.started = time.perf_counter()
+
+    def count_pages(self, pages: Iterable["Document"]) -> Iterator["Document"]:
+        for page in pages:
+            self.pages += 1
+            yield page
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        elapsed = max(self.elapsed, 1e-9)
+        return (
+            f"pages: {self.pages} ({self.pages / elapsed:.1f}/s)  "
+            f"chunks: {self.chunks} ({self.chunks / elapsed:.1f}/s)  "
+            f"embedded: {self.embedded}  unchanged: {self.skipped}  deleted: {self.deleted}  "
+            f"unchanged files: {self.unchanged_files}  elapsed: {elapsed:.1f}s"
+        )
+
+
+def open_manifest(vstore, folder: str = INDEX_DIR) -> IndexManifest:
+    """Load the manifest for ``vstore``, creating one from its docstore if missing.
+
+    Bootstrapping adopts the chunks already in the index (grouped by their
+    ``source`` metadata) and deletes exact duplicates within a source.
+    """
+    manifest = IndexManifest.load(folder)
+    if manifest is None:
+        manifest, duplicates = IndexManifest.from_docstore(vstore)
+        if duplicates:
+            delete_ids(vstore, duplicates)
+    return manifest
+
+
+def _add_batch(vstore, batch: List[Tuple[str, "Document"]], embeddings):
+    from langchain_community.vectorstores import FAISS
+
+    ids = [doc_id for doc_id, _ in batch]
+    texts = [doc.page_content for _, doc in batch]
+    metadatas = [doc.metadata for _, doc in batch]
+    vectors = embeddings.embed_documents(texts)
+    if vstore is None:
+        return FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids)
+    vstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+    return vstore
+
+
+def ingest_pdfs(
+    paths: Sequence[str],
+    embeddings,
+    vstore=None,
+    manifest: Optional[IndexManifest] = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: Optional[int] = None,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    log=sys.stderr,
+):
+    """Add or refresh ``paths`` in ``vstore`` with the streaming pipeline.
+
+    ``vstore`` is modified in place (pass None to build a new store) and
+    ``manifest`` is updated to match. Files whose hash is unchanged are not
+    parsed; otherwise only chunks with new text are embedded and chunks no
+    longer present in the file are deleted. ``workers=0`` parses in-process.
+
+    Returns ``(vstore, manifest, stats)``; ``vstore`` is None if nothing was
+    ever added.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    manifest = manifest if manifest is not None else IndexManifest()
+    stats = IngestStats()
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    try:
+        for path in paths:
+            source = os.path.basename(path)
+            file_hash = file_sha256(path)
+            previous = manifest.sources.get(source)
+            if previous is not None and previous.get("sha256") == file_hash:
+                stats.unchanged_files += 1
+                continue
+
+            old_chunks: Dict[str, str] = dict(previous["chunks"]) if previous else {}
+            live_ids = set(vstore.index_to_docstore_id.values()) if vstore is not None else set()
+            new_chunks: Dict[str, str] = {}
+            pending: List[Tuple[str, "Document"]] = []
+
+            pages = stats.count_pages(iter_pdf_pages(path, pool, max_in_flight=2 * max(workers, 1)))
+            for chunk in iter_chunks(pages, splitter):
+                stats.chunks += 1
+                digest = chunk_sha256(chunk.page_content)
+                if digest in new_chunks:
+                    # Identical text repeated within the file: keep one copy.
+                    stats.skipped += 1
+                    continue
+                if old_chunks.get(digest) in live_ids:
+                    new_chunks[digest] = old_chunks[digest]
+                    stats.skipped += 1
+                    continue
+                doc_id = str(uuid.uuid4())
+                new_chunks[digest] = doc_id
+                pending.append((doc_id, chunk))
+                if len(pending) >= batch_size:
+                    vstore = _add_batch(vstore, pending, embeddings)
+                    stats.embedded += len(pending)
+                    pending = []
+                    if log is not None:
+                        print(stats.summary(), file=log, flush=True)
+            if pending:
+                vstore = _add_batch(vstore, pending, embeddings)
+                stats.embedded += len(pending)
+
+            removed = [
+                doc_id for digest, doc_id in old_chunks.items()
+                if digest not in new_chunks and doc_id in live_ids
+            ]
+            if removed:
+                delete_ids(vstore, removed)
+                stats.deleted += len(removed)
+
+            manifest.sources[source] = {"sha256": file_hash, "chunks": new_chunks}
+            if log is not None:
+                print(f"{source}: {stats.summary()}", file=log, flush=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return vstore, manifest, stats
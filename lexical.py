@@ -0,0 +1,234 @@
+"""Lexical index over the chunks of ``ipp_index`` (``lexical.npz``).
+
+MiniLM similarity is fuzzy about exact API names: a query mentioning
+``ippsFIRSR_32f`` does not reliably bring back the page that documents it.
+This is a compact inverted index over the same chunks, searched with BM25,
+where IPP identifiers in a query (``ippsFIRSR_32f``, ``IppsFIRSpec_32f``,
+``ippsFIRSR``) also match exactly, with a boost, and as a prefix of longer
+identifiers (``ippsFIRSR`` finds ``ippsFIRSRGetSize`` and ``ippsFIRSRInit_32f``).
+Identifiers are indexed whole and by their parts, so ``FIR`` or ``32f``
+match them too.
+
+The index is immutable once built; ``updated`` returns a new index with
+chunks added and removed. ``index_store.save_index_atomic`` keeps the file in
+step with the docstore, so every ingestion path updates it. It is stored as
+plain numpy arrays (postings in CSR form, strings as one joined buffer), so
+loading unpickles nothing.
+"""
+import bisect
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LEXICAL_NAME = "lexical.npz"
+# BM25 parameters (the usual defaults).
+K1 = 1.2
+B = 0.75
+# Score multiplier for an exact identifier match, and the most index terms a
+# query identifier expands to as a prefix.
+IDENTIFIER_BOOST = 3.0
+MAX_EXPANSIONS = 64
+
+_TOKEN = re.compile(r"\w+")
+_CASE_PART = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+[A-Za-z]*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from if in is it of on or that the this to with".split()
+)
+
+
+def _is_identifier(token: str) -> bool:
+    return len(token) > 4 and token[:3].lower() == "ipp"
+
+
+def tokenize(text: str) -> List[str]:
+    """Index terms of ``text``: each word lowercased, plus the parts of compound identifiers."""
+    terms = []
+    for token in _TOKEN.findall(text):
+        word = token.lower()
+        if len(word) > 1 and word not in _STOPWORDS:
+            terms.append(word)
+        if word == token and word.isalpha():
+            continue  # a plain word has no parts
+        parts = _CASE_PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(part.lower() for part in parts if len(part) > 1 and part.lower() not in _STOPWORDS)
+    return terms
+
+
+def _join(strings: List[str]):
+    import numpy as np
+
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _split(buffer) -> List[str]:
+    text = buffer.tobytes().decode("utf-8")
+    return text.split("\n") if text else []
+
+
+class LexicalIndex:
+    """BM25 plus exact and prefix identifier lookup over chunk texts."""
+
+    def __init__(self, ids: List[str], lengths, vocab: List[str], indptr, rows, tf) -> None:
+        import numpy as np
+
+        self.ids = ids  # row -> docstore id
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.vocab = vocab  # sorted, for prefix lookup
+        self._term = {term: i for i, term in enumerate(vocab)}
+        self.indptr = indptr  # postings of term i: rows[indptr[i]:indptr[i + 1]]
+        self.rows = rows
+        self.tf = tf
+        self.avg_length = float(self.lengths.mean()) if len(ids) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls) -> "LexicalIndex":
+        import numpy as np
+
+        return cls([], np.zeros(0), [], np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                   np.zeros(0, dtype=np.uint16))
+
+    @classmethod
+    def build(cls, docs: Iterable[Tuple[str, str]]) -> "LexicalIndex":
+        """Index ``(id, text)`` pairs."""
+        return cls.empty().updated(added=docs)
+
+    def updated(self, added: Iterable[Tuple[str, str]] = (), deleted: Iterable[str] = ()) -> "LexicalIndex":
+        """A new index without the ``deleted`` ids and with the ``added`` ``(id, text)`` pairs."""
+        import numpy as np
+
+        # Existing postings as (term, row, tf) triples, minus deleted rows.
+        terms = np.repeat(np.arange(len(self.vocab), dtype=np.int64), np.diff(self.indptr))
+        deleted = set(deleted)
+        keep = np.array([doc_id not in deleted for doc_id in self.ids], dtype=bool)
+        new_row = np.cumsum(keep) - 1
+        mask = keep[self.rows]
+        terms, rows, tf = terms[mask], new_row[self.rows[mask]], self.tf[mask]
+        ids = [doc_id for doc_id, alive in zip(self.ids, keep) if alive]
+        lengths = array("i", self.lengths[keep].astype(np.int32).tolist())
+
+        vocab = list(self.vocab)
+        term_ids: Dict[str, int] = dict(self._term)
+        add_terms, add_rows, add_tf = array("q"), array("q"), array("i")
+        for doc_id, text in added:
+            if doc_id in deleted:
+                continue
+            counts = Counter(tokenize(text))
+            row = len(ids)
+            ids.append(doc_id)
+            lengths.append(sum(counts.values()))
+            for term in counts:
+                if term not in term_ids:
+                    term_ids[term] = len(vocab)
+                    vocab.append(term)
+            add_terms.extend(map(term_ids.__getitem__, counts.keys()))
+            add_rows.extend([row] * len(counts))
+            add_tf.extend(min(count, 65535) for count in counts.values())
+
+        # Renumber terms in sorted order and regroup the postings by term.
+        order = sorted(range(len(vocab)), key=vocab.__getitem__)
+        rank = np.empty(len(vocab), dtype=np.int64)
+        rank[order] = np.arange(len(vocab))
+        terms = rank[np.concatenate([terms, np.frombuffer(add_terms, dtype=np.int64)])]
+        rows = np.concatenate([rows, np.frombuffer(add_rows, dtype=np.int64)])
+        tf = np.concatenate([tf, np.frombuffer(add_tf, dtype=np.int32)])
+        by_term = np.lexsort((rows, terms))
+        terms, rows, tf = terms[by_term], rows[by_term], tf[by_term]
+        # Terms left without postings (all their chunks deleted) stay in the
+        # vocabulary with empty postings until the next full build.
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=indptr[1:])
+        return LexicalIndex(
+            ids, np.frombuffer(lengths, dtype=np.int32), [vocab[i] for i in order],
+            indptr, rows.astype(np.int32), tf.astype(np.uint16),
+        )
+
+    # --------------- Search ---------------
+    def _bm25(self, index: int):
+        # (rows, scores) of one term's postings.
+        import numpy as np
+
+        start, end = self.indptr[index], self.indptr[index + 1]
+        rows, tf = self.rows[start:end], self.tf[start:end].astype(np.float32)
+        df = end - start
+        idf = np.log(1.0 + (len(self.ids) - df + 0.5) / (df + 0.5))
+        norm = K1 * (1.0 - B + B * self.lengths[rows] / (self.avg_length or 1.0))
+        return rows, idf * tf * (K1 + 1.0) / (tf + norm)
+
+    def _expansions(self, prefix: str) -> List[int]:
+        start = bisect.bisect_left(self.vocab, prefix)
+        end = bisect.bisect_left(self.vocab, prefix + "\uffff", start)
+        return [i for i in range(start, min(end, start + MAX_EXPANSIONS + 1)) if self.vocab[i] != prefix]
+
+    def scores(self, query: str):
+        """BM25 score of every row for ``query``, identifier matches included."""
+        import numpy as np
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            index = self._term.get(term)
+            if index is not None:
+                rows, score = self._bm25(index)
+                scores[rows] += score
+        for token in {token for token in _TOKEN.findall(query) if _is_identifier(token)}:
+            prefix = token.lower()
+            index = self._term.get(prefix)
+            if index is not None:
+                # On top of the plain BM25 match counted above.
+                rows, score = self._bm25(index)
+                scores[rows] += (IDENTIFIER_BOOST - 1.0) * score
+            # A longer identifier only counts once per chunk, however many match.
+            best = np.zeros_like(scores)
+            for index in self._expansions(prefix):
+                rows, score = self._bm25(index)
+                np.maximum.at(best, rows, score)
+            scores += best
+        return scores
+
+    def search(self, query: str, k: int) -> List[str]:
+        """Ids of the ``k`` best-scoring chunks for ``query``, best first (only chunks that match)."""
+        import numpy as np
+
+        if not self.ids or k <= 0:
+            return []
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.ids[row] for row in top.tolist() if scores[row] > 0]
+
+    # --------------- Persistence ---------------
+    def save(self, folder: str) -> None:
+        import numpy as np
+
+        path = os.path.join(folder, LEXICAL_NAME)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(
+            tmp_path,
+            ids=_join(self.ids),
+            lengths=self.lengths.astype(np.int32),
+            vocab=_join(self.vocab),
+            indptr=self.indptr,
+            rows=self.rows,
+            tf=self.tf,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder: str) -> Optional["LexicalIndex"]:
+        """The index saved in ``folder``, or None if there is none."""
+        import numpy as np
+
+        path = os.path.join(folder, LEXICAL_NAME)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                _split(data["ids"]), data["lengths"], _split(data["vocab"]),
+                data["indptr"], data["rows"], data["tf"],
+            )
@@ -0,0 +1,343 @@
+"""Chat model backends: one or more OpenAI-compatible upstreams behind a pool.
+
+By default the pool has a single upstream built from ``OPENROUTER_MODEL``,
+``OPENROUTER_BASE_URL`` and ``OPENROUTER_API_KEY``. ``RAG_UPSTREAMS`` lists
+several instead, as JSON or as the path of a JSON file::
+
+    [{"base_url": "http://gpu1:1234/v1", "model": "gpt-oss-20b", "weight": 2, "allow_no_key": true},
+     {"base_url": "http://gpu2:1234/v1", "model": "gpt-oss-20b", "allow_no_key": true},
+     {"base_url": "https://openrouter.ai/api/v1", "model": "openai/gpt-oss-20b:free",
+      "api_key_env": "OPENROUTER_API_KEY", "weight": 0.5}]
+
+Every upstream needs an API key unless its entry sets ``allow_no_key``
+(e.g. a local LM Studio); a missing key fails at startup, not per request.
+
+Each call goes to the healthy upstream with the fewest requests in flight
+relative to its weight. Rate limits (429), 5xx responses and connection
+errors are retried with exponential backoff on another upstream where
+possible, and an upstream that keeps failing is taken out of rotation by a
+circuit breaker for a cooldown period.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from metrics import REGISTRY, Counter
+
+UPSTREAMS_ENV = "RAG_UPSTREAMS"
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_MODEL = "openai/gpt-oss-20b:free"
+
+UPSTREAM_ATTEMPT_FAILURES = REGISTRY.register(Counter(
+    "rag_upstream_attempt_failures_total",
+    "Failed attempts per upstream, including ones that were retried elsewhere.",
+    labels=("upstream",),
+))
+
+
+class NoUpstreamAvailable(RuntimeError):
+    """Every upstream's circuit breaker is open."""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections."""
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class Upstream:
+    """One OpenAI-compatible endpoint with its own keep-alive pool and breaker."""
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        api_key: Optional[str] = None,
+        weight: float = 1.0,
+        temperature: float = 0.2,
+        max_connections: int = 64,
+        timeout: float = 120.0,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        allow_no_key: bool = False,
+    ) -> None:
+        import httpx
+        from langchain_openai import ChatOpenAI
+
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        if not api_key and not allow_no_key:
+            raise ValueError(
+                f"No API key for upstream {self.name}; set one, or \"allow_no_key\": true for a server that needs none"
+            )
+        self.weight = weight if weight > 0 else 1.0
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.outstanding = 0
+        self.failures = 0  # consecutive
+        self.opened_at: Optional[float] = None
+        self.probing = False  # a half-open trial request is in flight
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.llm = ChatOpenAI(
+            model=model,
+            openai_api_base=self.base_url,
+            openai_api_key=api_key or "none",
+            temperature=temperature,
+            # Ask for token usage on streamed completions too (final chunk).
+            stream_usage=True,
+            timeout=timeout,
+            # Retries are the pool's job, so they can move to another upstream.
+            max_retries=0,
+            http_client=httpx.Client(limits=limits, timeout=timeout),
+            http_async_client=httpx.AsyncClient(limits=limits, timeout=timeout),
+        )
+
+    @property
+    def name(self) -> str:
+        return f"{self.base_url}#{self.model}"
+
+    def available(self, now: float) -> bool:
+        # Closed, or open long enough that one trial request may go through.
+        if self.opened_at is None:
+            return True
+        return now - self.opened_at >= self.cooldown and not self.probing
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = now
+
+    def stats(self) -> Dict[str, Any]:
+        if self.opened_at is None:
+            state = "closed"
+        else:
+            state = "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "circuit": state,
+        }
+
+
+class LLMPool:
+    """Load-balancing, retrying stand-in for a single ``ChatOpenAI``.
+
+    Offers the ``invoke``/``ainvoke``/``stream``/``astream`` calls ``Model``
+    makes. A stream is only retried if it fails before its first chunk;
+    after that the error reaches the caller.
+    """
+
+    def __init__(
+        self, upstreams: List[Upstream], max_attempts: int = 3, backoff: float = 0.25, max_backoff: float = 8.0
+    ) -> None:
+        if not upstreams:
+            raise ValueError("LLMPool needs at least one upstream")
+        self.upstreams = upstreams
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        # Part of the response cache key: answers are only shared between
+        # configurations serving the same models.
+        return "+".join(sorted({upstream.model for upstream in self.upstreams}))
+
+    def _acquire(self, tried: List[Upstream], last_error: Optional[Exception] = None) -> Upstream:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [u for u in self.upstreams if u.available(now)]
+            if not candidates:
+                # Mid-retry, the upstream's own error says more than ours.
+                if last_error is not None:
+                    raise last_error
+                raise NoUpstreamAvailable("all LLM upstreams are failing; circuit breakers open")
+            # Prefer upstreams this call has not failed on yet.
+            fresh = [u for u in candidates if u not in tried] or candidates
+            best = min((u.outstanding + 1) / u.weight for u in fresh)
+            upstream = random.choice([u for u in fresh if (u.outstanding + 1) / u.weight == best])
+            upstream.outstanding += 1
+            if upstream.opened_at is not None:
+                upstream.probing = True
+            return upstream
+
+    def _release(self, upstream: Upstream, error: Optional[Exception] = None) -> None:
+        with self._lock:
+            upstream.outstanding -= 1
+            upstream.probing = False
+            if error is None:
+                upstream.record_success()
+            elif is_retryable(error):
+                upstream.record_failure(time.monotonic())
+                UPSTREAM_ATTEMPT_FAILURES.inc(upstream=upstream.name)
+            else:
+                # The request itself was bad (4xx); the upstream is fine.
+                upstream.record_success()
+
+    def _delay(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _should_retry(self, attempt: int, error: Exception) -> bool:
+        return attempt + 1 < self.max_attempts and is_retryable(error)
+
+    @contextmanager
+    def _attempt(self, upstream: Upstream) -> Iterator[None]:
+        # Release the upstream with the outcome; client disconnects
+        # (GeneratorExit, cancellation) count as neither success nor failure.
+        try:
+            yield
+        except Exception as e:
+            self._release(upstream, e)
+            raise
+        except BaseException:
+            with self._lock:
+                upstream.outstanding -= 1
+                upstream.probing = False
+            raise
+        else:
+            self._release(upstream)
+
+    def invoke(self, messages: list, **kwargs) -> Any:
+        tried: List[Upstream] = []
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            upstream = self._acquire(tried, last_error)
+            tried.append(upstream)
+            try:
+                with self._attempt(upstream):
+                    return upstream.llm.invoke(messages, **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                last_error = e
+                time.sleep(self._delay(attempt, e))
+
+    async def ainvoke(self, messages: list, **kwargs) -> Any:
+        tried: List[Upstream] = []
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            upstream = self._acquire(tried, last_error)
+            tried.append(upstream)
+            try:
+                with self._attempt(upstream):
+                    return await upstream.llm.ainvoke(messages, **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                last_error = e
+                await asyncio.sleep(self._delay(attempt, e))
+
+    def stream(self, messages: list, **kwargs) -> Iterator[Any]:
+        tried: List[Upstream] = []
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            upstream = self._acquire(tried, last_error)
+            tried.append(upstream)
+            started = False
+            try:
+                with self._attempt(upstream):
+                    for chunk in upstream.llm.stream(messages, **kwargs):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or not self._should_retry(attempt, e):
+                    raise
+                last_error = e
+                time.sleep(self._delay(attempt, e))
+
+    async def astream(self, messages: list, **kwargs) -> AsyncIterator[Any]:
+        tried: List[Upstream] = []
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_attempts):
+            upstream = self._acquire(tried, last_error)
+            tried.append(upstream)
+            started = False
+            try:
+                with self._attempt(upstream):
+                    async for chunk in upstream.llm.astream(messages, **kwargs):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or not self._should_retry(attempt, e):
+                    raise
+                last_error = e
+                await asyncio.sleep(self._delay(attempt, e))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [upstream.stats() for upstream in self.upstreams]
+
+
+def _upstream_specs() -> List[Dict[str, Any]]:
+    raw = os.getenv(UPSTREAMS_ENV)
+    if not raw:
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            raise ValueError("OPENROUTER_API_KEY is not set (or configure upstreams with RAG_UPSTREAMS)")
+        return [{
+            "base_url": os.getenv("OPENROUTER_BASE_URL", os.getenv("OPENAI_API_BASE", DEFAULT_BASE_URL)),
+            "model": os.getenv("OPENROUTER_MODEL", DEFAULT_MODEL),
+            "api_key": api_key,
+        }]
+    if os.path.isfile(raw):
+        with open(raw, "r", encoding="utf-8") as f:
+            raw = f.read()
+    specs = json.loads(raw)
+    for spec in specs:
+        # Keep secrets out of the config: name the variable holding the key.
+        if "api_key_env" in spec:
+            name = spec.pop("api_key_env")
+            spec["api_key"] = os.getenv(name)
+            if not spec["api_key"] and not spec.get("allow_no_key"):
+                raise ValueError(f"{name} is not set (api_key_env of upstream {spec.get('base_url')})")
+    return specs
+
+
+def make_llm(temperature: float = 0.2) -> LLMPool:
+    """Chat model pool for this process, configured from the environment."""
+    breaker = {
+        "failure_threshold": int(os.getenv("RAG_UPSTREAM_FAILURE_THRESHOLD", "5")),
+        "cooldown": float(os.getenv("RAG_UPSTREAM_COOLDOWN", "30")),
+        "max_connections": int(os.getenv("RAG_UPSTREAM_MAX_CONNECTIONS", "64")),
+        "timeout": float(os.getenv("RAG_UPSTREAM_TIMEOUT", "120")),
+    }
+    upstreams = [Upstream(**{"temperature": temperature, **breaker, **spec}) for spec in _upstream_specs()]
+    return LLMPool(
+        upstreams,
+        max_attempts=int(os.getenv("RAG_UPSTREAM_MAX_ATTEMPTS", "3")),
+        backoff=float(os.getenv("RAG_UPSTREAM_BACKOFF", "0.25")),
+    )
@@ -0,0 +1,211 @@
+"""Pipeline metrics in the Prometheus text exposition format.
+
+A small in-process registry (counters, gauges, histograms with labels) so the
+server can expose ``/metrics`` without an extra dependency. Values are per
+process: with several uvicorn workers each one reports its own.
+"""
+import abc
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; covers a cached embedding lookup up to a slow full generation.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Sample lines for this metric, one per label set (and bucket)."""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels: str) -> None:
+        """Mirror a total kept elsewhere (e.g. the caches' own hit counters)."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        names = self.labels + ("le",)
+        for key, (counts, total, count) in items:
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {n}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds",
+    "Time spent in each pipeline stage (embed, search, pack, llm_first_token, llm).",
+    labels=("stage",),
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "rag_request_seconds",
+    "End-to-end request latency by endpoint and response-cache result.",
+    labels=("endpoint", "cache"),
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "rag_upstream_errors_total",
+    "Failed calls to the upstream LLM.",
+))
+TOKENS = REGISTRY.register(Counter(
+    "rag_tokens_total",
+    "Tokens sent to and received from the upstream LLM.",
+    labels=("kind",),
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "rag_requests_in_flight",
+    "Completion requests holding or waiting for a concurrency slot.",
+))
+CACHE_HITS = REGISTRY.register(Counter(
+    "rag_cache_hits_total",
+    "Cache lookups that found an entry.",
+    labels=("cache",),
+))
+CACHE_MISSES = REGISTRY.register(Counter(
+    "rag_cache_misses_total",
+    "Cache lookups that found nothing.",
+    labels=("cache",),
+))
+
+
+class Trace:
+    """Stage timings and token usage of a single request, filled in by ``Model``."""
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, float] = {}
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        # A stage that runs more than once (e.g. retries) accumulates.
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """The timings as a ``Server-Timing`` header value (milliseconds)."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items())
+
+
+def observe_stage(name: str, seconds: float, trace: Optional[Trace] = None) -> None:
+    STAGE_SECONDS.observe(seconds, stage=name)
+    if trace is not None:
+        trace.record(name, seconds)
+
+
+@contextmanager
+def stage(name: str, trace: Optional[Trace] = None) -> Iterator[None]:
+    """Time the enclosed block as pipeline stage ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start, trace)
+
+
+@contextmanager
+def upstream_call(trace: Optional[Trace] = None) -> Iterator[None]:
+    """Time an upstream LLM call as the ``llm`` stage and count its failures."""
+    with stage("llm", trace):
+        try:
+            yield
+        except Exception:
+            UPSTREAM_ERRORS.inc()
+            raise
@@ -1,10 +1,35 @@
+import asyncio
+import contextlib
 import os
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncContextManager, AsyncIterator, Callable, Iterator, List, Optional, Tuple
+
+from c_units import clean_output, extract_code, includes, plan_jobs, shared_declarations, split_units, stitch_plan
+from cache import CachedEmbeddings, LRUCache, ResponseCache
+from embedding_backends import MAX_SEQ_LENGTH, make_embeddings
+from history import HistoryWindow
+from index_store import (
+    INDEX_DIR,
+    clone_index,
+    generation_dir,
+    load_index,
+    save_index_atomic,
+    search_batch,
+    set_search_params,
+)
+from lexical import LEXICAL_NAME, LexicalIndex
+from llm_backends import make_llm
+from metrics import TOKENS, Trace, observe_stage, stage, upstream_call
+from query_plan import retrieval_queries, user_code
+from retrieval import fuse_ranked, pack_context
+from tokens import count_tokens
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+    from ingest import IngestStats
 
 PROMPT = """
 Please refactor this code snippet to use IPP instead of basic C. Functional parity should be preserved.
@@ -17,136 +42,726 @@ DEFAULT_SYSTEM_PROMPT = (
     "Avoid referencing functions not present in the provided context unless they are standard IPP APIs."
 )
 
+# Question for one part of a large C file (see Model._split).
+UNIT_QUESTION = """This is part {part} of {parts} of a larger C file, split at top-level functions and types.
+Refactor only this part. Reply with its refactored code in a single ```c block and do not repeat the shared declarations.
+
+Shared declarations of the file (for reference):
+{shared}
+
+Part to refactor:
+{code}"""
+
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY") 
 #Linux -> export OPENROUTER_API_KEY="apikey"
 #WIndows -> $env or set OPENROUTER_API_KEY="apikey"
 
+# langchain, faiss, torch and the chat client are imported on first use (in
+# the functions below and in the backend modules), so importing this module is
+# cheap and the GUI/server can start before the model loads.
+
+
+def _chat_prompt(system_prompt: str, instruction: str):
+    from langchain_core.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_messages([
+        # Literal text: braces in a system prompt are not template variables.
+        ("system", system_prompt.replace("{", "{{").replace("}", "}}")),
+        (
+            "human",
+            # Provide both the instruction (existing prompt) and placeholders for context/question
+            "{instruction}\n\nContext:\n{context}\n\nQuestion:\n{question}",
+        ),
+    ]).partial(instruction=instruction)  # injected once instead of passed on each call
+
+
+class Prompts:
+    """A system prompt and instruction with their compiled chat template.
+
+    Get them from ``Model.prompts_for``, which reuses one instance per
+    distinct pair of texts. Never modified after construction, so requests
+    with different prompts can run side by side on the same ``Model``.
+    """
+
+    __slots__ = ("system", "instruction", "template")
+
+    def __init__(self, system: str, instruction: str) -> None:
+        self.system = system
+        self.instruction = instruction
+        self.template = _chat_prompt(system, instruction)
+
+
 class Model:
-    def __init__(self, prompt: str = PROMPT, system_prompt: str | None = DEFAULT_SYSTEM_PROMPT):
+    def __init__(
+        self,
+        prompt: str = PROMPT,
+        system_prompt: str | None = DEFAULT_SYSTEM_PROMPT,
+        progress: Optional[Callable[[str], None]] = None,
+    ):
         """RAG-backed refactoring model.
 
         Args:
             prompt: Instruction text prepended to user input (treated as part of the user message).
             system_prompt: High-level system instruction passed as a system message to the chat model.
+            progress: Called with a short description as each loading step starts.
         """
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        vstore = FAISS.load_local(
-            "ipp_index",
-            self.embeddings,
-            allow_dangerous_deserialization=True,
+        report = progress or (lambda step: None)
+        report("Loading embedding model")
+        # Query embeddings are cached (LRU keyed by normalized text); set
+        # RAG_EMBED_CACHE_PATH to keep the cache across restarts.
+        self.embeddings = CachedEmbeddings(
+            make_embeddings(),
+            max_size=int(os.getenv("RAG_EMBED_CACHE_SIZE", "4096")),
+            path=os.getenv("RAG_EMBED_CACHE_PATH") or None,
         )
+        report("Loading index")
+        # The vectors, chunks and lexical index all come from one generation of
+        # the index folder (see index_store).
+        self.index_dir = generation_dir(INDEX_DIR)
+        vstore = self._load_vstore(self.index_dir)
+        self.vstore = vstore
         self.retriever = vstore.as_retriever(search_type="similarity", search_kwargs={"k": 4})
+        # Retrieval runs up to RAG_MAX_SUBQUERIES short queries (RAG_SUBQUERY_TOKENS
+        # each) built from the user's code, embedded and searched in one batch;
+        # their top-k hits are fused into RAG_CONTEXT_DOCS chunks (see query_plan).
+        self.max_subqueries = int(os.getenv("RAG_MAX_SUBQUERIES", "4"))
+        self.subquery_tokens = int(os.getenv("RAG_SUBQUERY_TOKENS", "64"))
+        self.context_docs = int(os.getenv("RAG_CONTEXT_DOCS", "6"))
+        # Each sub-query is also run against the BM25/identifier index of the
+        # same chunks and its hits fused with the vector hits (RAG_LEXICAL=0 turns it off).
+        report("Loading lexical index")
+        self.lexical = self._load_lexical(self.index_dir)
+        # Serializes index writers and reloads; readers never take it (see add_pdf_to_rag).
+        self._index_write_lock = threading.Lock()
+        # A generation saved by another process (another server worker, the GUI,
+        # rag_creator) is picked up within RAG_INDEX_RELOAD_INTERVAL seconds (0 disables).
+        self.index_reload_interval = float(os.getenv("RAG_INDEX_RELOAD_INTERVAL", "5"))
+        self._index_checked = time.monotonic()
 
-        # --- OpenRouter configuration ---
-        # Configure ChatOpenAI to use OpenRouter's OpenAI-compatible endpoint.
-        # Set OPENROUTER_API_KEY in your environment. You can also override the model and base URL.
-        openrouter_model = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-20b:free")
-        # Allow both OPENROUTER_BASE_URL and OPENAI_API_BASE for convenience
-        openrouter_base = os.getenv("OPENROUTER_BASE_URL", os.getenv("OPENAI_API_BASE", "https://openrouter.ai/api/v1"))
-        openrouter_key = os.getenv("OPENROUTER_API_KEY")
-
-        self.llm = ChatOpenAI(
-            model=openrouter_model,
-            openai_api_base=openrouter_base,
-            openai_api_key=openrouter_key,
-            temperature=0.2,
-        )
+        # --- Upstream LLM configuration ---
+        # OpenRouter by default (OPENROUTER_MODEL / OPENROUTER_BASE_URL / OPENROUTER_API_KEY),
+        # or a weighted pool of OpenAI-compatible endpoints from RAG_UPSTREAMS (see llm_backends).
+        report("Preparing chat model")
+        self.llm = make_llm(temperature=0.2)
+
+        # Completed answers, keyed by normalized query + prompts + model. Optional
+        # near-duplicate matching on the query embedding (cosine threshold).
+        cache_size = int(os.getenv("RAG_RESPONSE_CACHE_SIZE", "1024"))
+        similarity = os.getenv("RAG_RESPONSE_CACHE_SIMILARITY")
+        self.response_cache = ResponseCache(
+            max_size=cache_size,
+            ttl=float(os.getenv("RAG_RESPONSE_CACHE_TTL", "86400")),
+            similarity=float(similarity) if similarity else None,
+        ) if cache_size > 0 else None
+        # Near-duplicate matching embeds the user's code; longer code (in
+        # tokens, kept under MiniLM's input length) is matched exactly only.
+        self.similarity_max_tokens = int(os.getenv("RAG_RESPONSE_CACHE_SIMILARITY_TOKENS", str(MAX_SEQ_LENGTH * 2 // 3)))
 
-        # Build a chat prompt with an optional system message and a human message
-        sys_msg = system_prompt or ""
-        chat_prompt = ChatPromptTemplate.from_messages([
-            ("system", sys_msg),
-            (
-                "human",
-                # Provide both the instruction (existing prompt) and placeholders for context/question
-                "{instruction}\n\nContext:\n{context}\n\nQuestion:\n{question}",
-            ),
-        ])
-
-        # Inject the current instruction prompt as a partial to avoid passing it each call
-        chat_prompt = chat_prompt.partial(instruction=prompt)
-
-        self.qa = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            retriever=self.retriever,
-            chain_type="stuff",
-            chain_type_kwargs={
-                "prompt": chat_prompt,
-            },
+        # Compiled prompt templates keyed by a hash of their texts; requests
+        # bringing their own system prompt or instruction (see prompts_for)
+        # share them instead of compiling one per call.
+        self._prompt_templates = LRUCache(int(os.getenv("RAG_PROMPT_CACHE_SIZE", "256")))
+        # Used by calls that pass no prompts of their own.
+        self.prompts = self.prompts_for(system_prompt or "", prompt)
+
+        # Prompt size cap (tokens). Retrieved context gets whatever the system
+        # prompt, instruction and user code leave, but never less than the floor.
+        self.prompt_token_budget = int(os.getenv("RAG_PROMPT_TOKEN_BUDGET", "6000"))
+        self.min_context_tokens = int(os.getenv("RAG_MIN_CONTEXT_TOKENS", "512"))
+
+        # Inputs above RAG_SPLIT_THRESHOLD_TOKENS (0 disables) are split into
+        # top-level C units, refactored in parallel and stitched back together.
+        self.split_threshold = int(os.getenv("RAG_SPLIT_THRESHOLD_TOKENS", "1500"))
+        self.split_unit_tokens = int(os.getenv("RAG_SPLIT_UNIT_TOKENS", "1200"))
+        self.split_shared_tokens = int(os.getenv("RAG_SPLIT_SHARED_TOKENS", "800"))
+        self.split_max_parallel = int(os.getenv("RAG_SPLIT_MAX_PARALLEL", "8"))
+
+        # Multi-turn chats are cut to the latest user code, the current turn and
+        # RAG_HISTORY_TOKENS of recent turns (0 keeps the whole transcript);
+        # older turns become cached RAG_HISTORY_SUMMARY_TOKENS summaries.
+        self.history = HistoryWindow(
+            max_tokens=int(os.getenv("RAG_HISTORY_TOKENS", "2000")),
+            summary_tokens=int(os.getenv("RAG_HISTORY_SUMMARY_TOKENS", "48")),
+            cache_size=int(os.getenv("RAG_HISTORY_CACHE_SIZE", "1024")),
         )
 
         self.prompt = prompt
         self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
 
-    def run(self, query: str) -> str:
+    def run(
+        self, query: str, check_cache: bool = True, trace: Optional[Trace] = None, prompts: Optional[Prompts] = None
+    ) -> str:
+        """Answer ``query``; stage timings and token usage go to ``trace`` if given.
+
+        ``prompts`` (from ``prompts_for``) overrides the model's system prompt
+        and instruction for this call only.
+        """
+        prompts = prompts or self.prompts
+        if check_cache:
+            cached = self.cached_response(query, prompts)
+            if cached is not None:
+                return cached
+        split = self._split(query)
+        if split is not None:
+            answer = "".join(self._run_split(*split, prompts, trace=trace))
+            self.store_response(query, answer, prompts=prompts)
+            return answer
         # Keep existing behavior of including the instruction with the query for backward compatibility.
         # Note: The chat prompt already includes the instruction; appending here further emphasizes it.
-        query = self.prompt + "\n" + query
-        # RetrievalQA.invoke returns a dict with a 'result' key by default
-        out = self.qa.invoke({"query": query})
-        return out["result"] if isinstance(out, dict) and "result" in out else str(out)
+        question = prompts.instruction + "\n" + query
+        docs = self._retrieve(query, trace)
+        messages = self._format_messages(question, docs, prompts, trace)
+        with upstream_call(trace):
+            message = self.llm.invoke(messages)
+        answer = message.content
+        self._record_usage(messages, answer, message.usage_metadata, trace)
+        self.store_response(query, answer, prompts=prompts)
+        return answer
+
+    async def arun(
+        self, query: str, check_cache: bool = True, trace: Optional[Trace] = None, prompts: Optional[Prompts] = None
+    ) -> str:
+        """Async counterpart of ``run``."""
+        prompts = prompts or self.prompts
+        if check_cache:
+            cached = await self.acached_response(query, prompts)
+            if cached is not None:
+                return cached
+        split = self._split(query)
+        if split is not None:
+            answer = "".join([piece async for piece in self._arun_split(*split, prompts, trace=trace)])
+            self.store_response(query, answer, await self._aquery_vector(query), prompts)
+            return answer
+        question = prompts.instruction + "\n" + query
+        docs = await self._aretrieve(query, trace)
+        messages = self._format_messages(question, docs, prompts, trace)
+        with upstream_call(trace):
+            message = await self.llm.ainvoke(messages)
+        answer = message.content
+        self._record_usage(messages, answer, message.usage_metadata, trace)
+        self.store_response(query, answer, await self._aquery_vector(query), prompts)
+        return answer
+
+    def stream(
+        self, query: str, check_cache: bool = True, trace: Optional[Trace] = None, prompts: Optional[Prompts] = None
+    ) -> Iterator[str]:
+        """Yield the answer token by token as the chat model produces it.
+
+        Same retrieval and prompt as ``run``, but calls the LLM in streaming
+        mode instead of waiting for the full completion. A cached answer is
+        yielded in one piece, a split large input part by part.
+        """
+        prompts = prompts or self.prompts
+        if check_cache:
+            cached = self.cached_response(query, prompts)
+            if cached is not None:
+                yield cached
+                return
+        split = self._split(query)
+        if split is not None:
+            pieces = []
+            for piece in self._run_split(*split, prompts, trace=trace):
+                pieces.append(piece)
+                yield piece
+            self.store_response(query, "".join(pieces), prompts=prompts)
+            return
+        question = prompts.instruction + "\n" + query
+        docs = self._retrieve(query, trace)
+        messages = self._format_messages(question, docs, prompts, trace)
+        pieces = []
+        usage = None
+        start = time.perf_counter()
+        with upstream_call(trace):
+            for chunk in self.llm.stream(messages):
+                usage = chunk.usage_metadata or usage
+                if chunk.content:
+                    if not pieces:
+                        observe_stage("llm_first_token", time.perf_counter() - start, trace)
+                    pieces.append(chunk.content)
+                    yield chunk.content
+        answer = "".join(pieces)
+        self._record_usage(messages, answer, usage, trace)
+        self.store_response(query, answer, prompts=prompts)
+
+    async def astream(
+        self, query: str, check_cache: bool = True, trace: Optional[Trace] = None, prompts: Optional[Prompts] = None
+    ) -> AsyncIterator[str]:
+        """Async counterpart of ``stream``."""
+        prompts = prompts or self.prompts
+        if check_cache:
+            cached = await self.acached_response(query, prompts)
+            if cached is not None:
+                yield cached
+                return
+        split = self._split(query)
+        if split is not None:
+            pieces = []
+            async for piece in self._arun_split(*split, prompts, trace=trace):
+                pieces.append(piece)
+                yield piece
+            self.store_response(query, "".join(pieces), await self._aquery_vector(query), prompts)
+            return
+        question = prompts.instruction + "\n" + query
+        docs = await self._aretrieve(query, trace)
+        messages = self._format_messages(question, docs, prompts, trace)
+        pieces = []
+        usage = None
+        start = time.perf_counter()
+        with upstream_call(trace):
+            async for chunk in self.llm.astream(messages):
+                usage = chunk.usage_metadata or usage
+                if chunk.content:
+                    if not pieces:
+                        observe_stage("llm_first_token", time.perf_counter() - start, trace)
+                    pieces.append(chunk.content)
+                    yield chunk.content
+        answer = "".join(pieces)
+        self._record_usage(messages, answer, usage, trace)
+        self.store_response(query, answer, await self._aquery_vector(query), prompts)
+
+    async def abatch(
+        self,
+        queries: List[str],
+        max_parallel: int = 8,
+        traces: Optional[List[Trace]] = None,
+        prompts: Optional[List[Optional[Prompts]]] = None,
+        slot: Optional[Callable[[], AsyncContextManager]] = None,
+    ) -> AsyncIterator[Tuple[int, Optional[str], Optional[Exception], bool]]:
+        """Answer many queries, yielding ``(index, answer, error, cached)`` as each finishes.
+
+        All queries are embedded in one call and searched in one FAISS call;
+        only the LLM calls run per item, at most ``max_parallel`` at a time.
+        Cached answers are yielded first. A failing item reports its exception
+        without affecting the others. ``traces``, if given, holds one ``Trace``
+        per query for its prompt/LLM timings and token usage, and ``prompts``
+        the prompts of each query (None for the model's own). ``slot``, if
+        given, is entered around each LLM call (e.g. the server's concurrency
+        limit).
+        """
+        item_prompts = [(prompts[i] if prompts is not None else None) or self.prompts for i in range(len(queries))]
+        questions = [p.instruction + "\n" + query for p, query in zip(item_prompts, queries)]
+        plans = [self._retrieval_queries(query) for query in queries]
+        # One embedding call for everything: the user code of each query (only
+        # if the response cache matches near-duplicates) and every item's
+        # retrieval queries.
+        similar = [self._similarity_text(query) for query in queries]
+        cache_texts = [text for text in similar if text is not None]
+        try:
+            with stage("embed"):
+                embedded = await self.embeddings.aembed_queries(cache_texts + [q for plan in plans for q in plan])
+        except Exception as e:
+            for i in range(len(questions)):
+                yield i, None, e, False
+            return
+        cache_vectors = iter(embedded[:len(cache_texts)])
+        vectors = [None if text is None else next(cache_vectors) for text in similar]
+        plan_vectors, start = [], len(cache_texts)
+        for plan in plans:
+            plan_vectors.append(embedded[start:start + len(plan)])
+            start += len(plan)
+
+        pending = []
+        for i, query in enumerate(queries):
+            cached = self._lookup_response(query, vectors[i], item_prompts[i])
+            if cached is not None:
+                yield i, cached, None, True
+            else:
+                pending.append(i)
+        if not pending:
+            return
+
+        try:
+            with stage("search"):
+                found = await asyncio.to_thread(
+                    self._fused_search, [plans[i] for i in pending], [v for i in pending for v in plan_vectors[i]]
+                )
+        except Exception as e:
+            for i in pending:
+                yield i, None, e, False
+            return
+        hits = dict(zip(pending, found))
+
+        semaphore = asyncio.Semaphore(max_parallel)
+
+        async def answer(i: int) -> Tuple[int, Optional[str], Optional[Exception], bool]:
+            async with semaphore, (slot() if slot is not None else contextlib.nullcontext()):
+                trace = traces[i] if traces is not None else None
+                try:
+                    messages = self._format_messages(questions[i], hits[i], item_prompts[i], trace)
+                    with upstream_call(trace):
+                        message = await self.llm.ainvoke(messages)
+                    self._record_usage(messages, message.content, message.usage_metadata, trace)
+                    self.store_response(queries[i], message.content, vectors[i], item_prompts[i])
+                    return i, message.content, None, False
+                except Exception as e:
+                    return i, None, e, False
+
+        tasks = [asyncio.create_task(answer(i)) for i in pending]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # --------------- Large inputs (map-reduce over C units) ---------------
+    def _split(self, query: str) -> Optional[Tuple[list, List[List[int]]]]:
+        """Units and jobs for a large C input, or None to answer it in one piece.
+
+        Only the user's code is split and measured (see ``query_plan.user_code``):
+        the prose, fences and earlier turns of a transcript are not part of the file.
+        """
+        if self.split_threshold <= 0:
+            return None
+        code = user_code(query)
+        if count_tokens(code) <= self.split_threshold:
+            return None
+        units = split_units(code)
+        jobs = plan_jobs(units, self.split_unit_tokens)
+        return (units, jobs) if len(jobs) > 1 else None
+
+    def _split_questions(self, units: list, jobs: List[List[int]], prompts: Prompts) -> Tuple[List[str], List[str]]:
+        # Per job: the part's code alone for retrieval (so each part gets its
+        # own context) and the prompt question (with shared declarations).
+        shared = shared_declarations(units, self.split_shared_tokens) or "(none)"
+        retrieval, questions = [], []
+        for part, job in enumerate(jobs, 1):
+            code = "".join(units[i].text for i in job).strip()
+            retrieval.append(code)
+            question = UNIT_QUESTION.format(part=part, parts=len(jobs), shared=shared, code=code)
+            questions.append(prompts.instruction + "\n" + question)
+        return retrieval, questions
+
+    def _split_header(self, units: list) -> Tuple[str, List[str]]:
+        # The stitched file includes ipp.h once at the top; parts must not repeat
+        # headers the file already includes.
+        included = includes("".join(unit.text for unit in units))
+        header = "" if "ipp.h" in included else "#include <ipp.h>\n"
+        return header, included + ["ipp.h"]
+
+    def _run_split(
+        self, units: list, jobs: List[List[int]], prompts: Prompts, trace: Optional[Trace] = None
+    ) -> Iterator[str]:
+        """Refactor the jobs in parallel threads; yield the stitched file in order."""
+        retrieval, questions = self._split_questions(units, jobs, prompts)
+        found = self._retrieve_many(retrieval, trace)
+
+        def refactor(j: int) -> str:
+            messages = self._format_messages(questions[j], found[j], prompts, trace)
+            with upstream_call(trace):
+                message = self.llm.invoke(messages)
+            self._record_usage(messages, message.content, message.usage_metadata, trace)
+            return message.content
+
+        header, included = self._split_header(units)
+        with ThreadPoolExecutor(max_workers=max(1, self.split_max_parallel)) as pool:
+            futures = [pool.submit(refactor, j) for j in range(len(jobs))]
+            try:
+                yield "```c\n" + header
+                for piece in stitch_plan(units, jobs):
+                    if isinstance(piece, int):
+                        piece = clean_output(extract_code(futures[piece].result()), included)
+                    if piece:
+                        yield piece
+                yield "\n```"
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    async def _arun_split(
+        self, units: list, jobs: List[List[int]], prompts: Prompts, trace: Optional[Trace] = None
+    ) -> AsyncIterator[str]:
+        """Async counterpart of ``_run_split``; parts are yielded as soon as all before them are done."""
+        retrieval, questions = self._split_questions(units, jobs, prompts)
+        found = await self._aretrieve_many(retrieval, trace)
+        semaphore = asyncio.Semaphore(max(1, self.split_max_parallel))
+
+        async def refactor(j: int) -> str:
+            async with semaphore:
+                messages = self._format_messages(questions[j], found[j], prompts, trace)
+                with upstream_call(trace):
+                    message = await self.llm.ainvoke(messages)
+                self._record_usage(messages, message.content, message.usage_metadata, trace)
+                return message.content
+
+        header, included = self._split_header(units)
+        tasks = [asyncio.create_task(refactor(j)) for j in range(len(jobs))]
+        try:
+            yield "```c\n" + header
+            for piece in stitch_plan(units, jobs):
+                if isinstance(piece, int):
+                    piece = clean_output(extract_code(await tasks[piece]), included)
+                if piece:
+                    yield piece
+            yield "\n```"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # --------------- Response cache ---------------
+    def _cache_namespace(self, prompts: Prompts) -> str:
+        return ResponseCache.namespace(prompts.system, prompts.instruction, self.llm.model_name)
+
+    def _needs_vector(self) -> bool:
+        return self.response_cache is not None and self.response_cache.similarity is not None
+
+    def _lookup_response(self, query: str, vector: Optional[List[float]], prompts: Prompts) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        return self.response_cache.get(self._cache_namespace(prompts), query, vector)
+
+    def _similarity_text(self, query: str) -> Optional[str]:
+        # What near-duplicate lookups embed: the user's code alone (the
+        # namespace already covers the prompts). Code longer than the embedder
+        # reads would be truncated, and files sharing a header would get
+        # near-identical vectors, so it gets no vector and matches exactly only.
+        if not self._needs_vector():
+            return None
+        code = user_code(query)
+        return code if count_tokens(code) <= self.similarity_max_tokens else None
+
+    async def _aquery_vector(self, query: str) -> Optional[List[float]]:
+        # The similarity text's embedding; normally already in the embedding cache.
+        text = self._similarity_text(query)
+        return None if text is None else await self.embeddings.aembed_query(text)
+
+    def coalesce_key(self, query: str, prompts: Optional[Prompts] = None) -> str:
+        """Identity of a request: equal keys get the same answer, so they can share one computation."""
+        return ResponseCache.key(self._cache_namespace(prompts or self.prompts), query)
+
+    def cached_response(self, query: str, prompts: Optional[Prompts] = None) -> Optional[str]:
+        """Stored answer for ``query`` under ``prompts`` (default: the model's) and the model, if any."""
+        prompts = prompts or self.prompts
+        text = self._similarity_text(query)
+        vector = None if text is None else self.embeddings.embed_query(text)
+        return self._lookup_response(query, vector, prompts)
+
+    async def acached_response(self, query: str, prompts: Optional[Prompts] = None) -> Optional[str]:
+        """Async counterpart of ``cached_response``."""
+        prompts = prompts or self.prompts
+        return self._lookup_response(query, await self._aquery_vector(query), prompts)
+
+    def store_response(
+        self, query: str, answer: str, vector: Optional[List[float]] = None, prompts: Optional[Prompts] = None
+    ) -> None:
+        """Remember a completed answer (empty answers are not cached)."""
+        if self.response_cache is None or not answer:
+            return
+        prompts = prompts or self.prompts
+        if vector is None:
+            text = self._similarity_text(query)
+            vector = None if text is None else self.embeddings.embed_query(text)
+        self.response_cache.put(self._cache_namespace(prompts), query, answer, vector)
+
+    # --------------- Pipeline stages ---------------
+    def _retrieval_queries(self, query: str) -> List[str]:
+        return retrieval_queries(query, self.max_subqueries, self.subquery_tokens)
+
+    def _load_vstore(self, folder: str) -> "FAISS":
+        vstore = load_index(self.embeddings, folder)
+        # load_index applies the tuned (bench_index.py --save) or default query-time
+        # knobs of an approximate (IVF/HNSW) index; RAG_NPROBE/RAG_EF_SEARCH override them.
+        set_search_params(
+            vstore.index,
+            nprobe=int(os.environ["RAG_NPROBE"]) if os.getenv("RAG_NPROBE") else None,
+            ef_search=int(os.environ["RAG_EF_SEARCH"]) if os.getenv("RAG_EF_SEARCH") else None,
+        )
+        return vstore
+
+    def _load_lexical(self, folder: str) -> Optional[LexicalIndex]:
+        if os.getenv("RAG_LEXICAL", "1") != "1":
+            return None
+        lexical = LexicalIndex.load(folder)
+        if lexical is None:
+            print(
+                f"Warning: no {LEXICAL_NAME} in {folder}; retrieval is vector-only. "
+                "Run `python rag_creator.py migrate` (or `lexical`) to build it, or set RAG_LEXICAL=0."
+            )
+        return lexical
+
+    def _reload_index(self) -> bool:
+        # Switch to the current generation if it is not the one in use; the
+        # caller holds _index_write_lock.
+        folder = generation_dir(INDEX_DIR)
+        if os.path.abspath(folder) == os.path.abspath(self.index_dir):
+            return False
+        vstore, lexical = self._load_vstore(folder), self._load_lexical(folder)
+        self.vstore, self.lexical, self.index_dir = vstore, lexical, folder
+        self.retriever.vectorstore = vstore
+        # Cached answers may have been based on the old context.
+        if self.response_cache is not None:
+            self.response_cache.clear()
+        return True
+
+    def refresh_index(self) -> bool:
+        """Load a newer index generation saved by another process, if there is one.
+
+        Checks at most every ``index_reload_interval`` seconds, and not while
+        this process is updating the index itself. Searches running meanwhile
+        keep the generation they started with. Returns whether it reloaded.
+        """
+        now = time.monotonic()
+        if self.index_reload_interval <= 0 or now - self._index_checked < self.index_reload_interval:
+            return False
+        self._index_checked = now
+        if not self._index_write_lock.acquire(blocking=False):
+            return False
+        try:
+            return self._reload_index()
+        finally:
+            self._index_write_lock.release()
+
+    def _lexical_search(self, vstore: "FAISS", lexical: LexicalIndex, query: str, k: int) -> list:
+        docs = []
+        for doc_id in lexical.search(query, k):
+            doc = vstore.docstore.search(doc_id)
+            if not isinstance(doc, str):  # docstore returns an error string for unknown ids
+                docs.append(doc)
+        return docs
+
+    def _fused_search(self, plans: List[List[str]], vectors: list) -> List[list]:
+        # One faiss call for the vectors of all plans (flattened in plan order),
+        # then each plan's hit lists, vector and lexical, fused into its context documents.
+        if not vectors:
+            return [[] for _ in plans]
+        self.refresh_index()
+        k = self.retriever.search_kwargs.get("k", 4)
+        vstore, lexical = self.vstore, self.lexical
+        found = search_batch(vstore, vectors, k)
+        results, start = [], 0
+        for plan in plans:
+            rankings = found[start:start + len(plan)]
+            if lexical is not None:
+                rankings += [self._lexical_search(vstore, lexical, query, k) for query in plan]
+            results.append(fuse_ranked(rankings, self.context_docs))
+            start += len(plan)
+        return results
+
+    def _retrieve_many(self, inputs: List[str], trace: Optional[Trace] = None) -> List[list]:
+        """Context documents for each input, from one embedding call and one search call."""
+        plans = [self._retrieval_queries(text) for text in inputs]
+        with stage("embed", trace):
+            vectors = self.embeddings.embed_queries([q for plan in plans for q in plan])
+        with stage("search", trace):
+            return self._fused_search(plans, vectors)
+
+    async def _aretrieve_many(self, inputs: List[str], trace: Optional[Trace] = None) -> List[list]:
+        plans = [self._retrieval_queries(text) for text in inputs]
+        with stage("embed", trace):
+            vectors = await self.embeddings.aembed_queries([q for plan in plans for q in plan])
+        with stage("search", trace):
+            return await asyncio.to_thread(self._fused_search, plans, vectors)
+
+    def _retrieve(self, query: str, trace: Optional[Trace] = None) -> list:
+        return self._retrieve_many([query], trace)[0]
+
+    async def _aretrieve(self, query: str, trace: Optional[Trace] = None) -> list:
+        return (await self._aretrieve_many([query], trace))[0]
+
+    def _format_messages(self, question: str, docs: list, prompts: Prompts, trace: Optional[Trace] = None) -> list:
+        # Merge overlapping chunks, drop repeated text and cap the context at
+        # what the token budget leaves after the fixed parts of the prompt.
+        with stage("pack", trace):
+            fixed = count_tokens(prompts.system) + count_tokens(prompts.instruction) + count_tokens(question)
+            budget = max(self.min_context_tokens, self.prompt_token_budget - fixed)
+            context = pack_context(docs, budget)
+            return prompts.template.format_messages(context=context, question=question)
+
+    def _record_usage(self, messages: list, answer: str, usage: Optional[dict], trace: Optional[Trace] = None) -> None:
+        # Counts reported by the upstream when it sends them, else local estimates.
+        if usage:
+            prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+        else:
+            prompt_tokens = sum(count_tokens(message.content) for message in messages)
+            completion_tokens = count_tokens(answer)
+        TOKENS.inc(prompt_tokens, kind="prompt")
+        TOKENS.inc(completion_tokens, kind="completion")
+        if trace is not None:
+            # Accumulates: a split input makes one upstream call per part.
+            trace.prompt_tokens = (trace.prompt_tokens or 0) + prompt_tokens
+            trace.completion_tokens = (trace.completion_tokens or 0) + completion_tokens
     
+    def warm_up(self) -> None:
+        """Run one query embedding and one index search.
+
+        Forces the lazy parts of the embedder and FAISS to initialize so the
+        first real request does not pay for them.
+        """
+        # embed_documents bypasses the query cache, so the model really runs.
+        vector = self.embeddings.embed_documents(["warm-up"])[0]
+        self.vstore.similarity_search_by_vector(vector, k=1)
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the model's caches."""
+        stats = {
+            "query_embeddings": self.embeddings.cache.stats(),
+            "prompt_templates": self._prompt_templates.stats(),
+            "history_summaries": self.history.summaries.stats(),
+        }
+        if self.response_cache is not None:
+            stats["responses"] = self.response_cache.stats()
+        return stats
+
     def check_connection(self) -> bool:
         try:
-            response = self.run("Hello")
+            response = self.run("Hello", check_cache=False)
             return bool(response)
         except Exception as e:
             print(f"Model connection error: {e}")
             return False
 
     # --------------- Configuration helpers ---------------
-    def set_system_prompt(self, system_prompt: str) -> None:
-        """Update the system prompt at runtime.
+    def prompts_for(self, system_prompt: Optional[str] = None, instruction: Optional[str] = None) -> Prompts:
+        """Prompts for one call: ``system_prompt`` and ``instruction``, each defaulting to the model's own.
 
-        Note: This recreates the underlying RetrievalQA chain to ensure the new
-        system message is used in subsequent calls.
+        Templates are compiled once per distinct pair of texts and cached by
+        their hash, so per-request prompts cost a dictionary lookup. Pass the
+        result to ``run``/``arun``/``stream``/``astream``/``abatch``.
         """
-        self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
-
-        chat_prompt = ChatPromptTemplate.from_messages([
-            ("system", self.system_prompt),
-            (
-                "human",
-                "{instruction}\n\nContext:\n{context}\n\nQuestion:\n{question}",
-            ),
-        ]).partial(instruction=self.prompt)
-
-        self.qa = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            retriever=self.retriever,
-            chain_type="stuff",
-            chain_type_kwargs={"prompt": chat_prompt},
-        )
-
-    def add_pdf_to_rag(self, pdf_path: str) -> None:
-        """Add a PDF document to the RAG vector store."""
-        from langchain.document_loaders import PyPDFLoader
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
-        from langchain_community.vectorstores import FAISS
-
-        # Load and split the PDF document
-        loader = PyPDFLoader(pdf_path)
-        documents = loader.load()
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        docs = text_splitter.split_documents(documents)
+        if system_prompt is None:
+            system_prompt = self.prompts.system
+        if instruction is None:
+            instruction = self.prompts.instruction
+        key = ResponseCache.namespace(system_prompt, instruction)
+        prompts = self._prompt_templates.get(key)
+        if prompts is None:
+            prompts = Prompts(system_prompt, instruction)
+            self._prompt_templates.put(key, prompts)
+        return prompts
 
-        # Create embeddings for the new documents
-        new_embeddings = self.embeddings.embed_documents([doc.page_content for doc in docs])
+    def set_system_prompt(self, system_prompt: str) -> None:
+        """Change the default system prompt for subsequent calls.
 
-        # Load existing FAISS index
-        vstore = FAISS.load_local(
-            "ipp_index",
-            self.embeddings,
-            allow_dangerous_deserialization=True,
-        )
+        Calls already running keep the prompts they started with; calls that
+        pass their own ``prompts`` are not affected.
+        """
+        self.system_prompt = system_prompt or DEFAULT_SYSTEM_PROMPT
+        self.prompts = self.prompts_for(self.system_prompt)
 
-        # Add new documents and their embeddings to the vector store
-        vstore.add_texts(
-            [doc.page_content for doc in docs],
-            new_embeddings,
-        )
+    def add_pdf_to_rag(self, pdf_path: str) -> "IngestStats":
+        """Add or refresh a PDF document in the live RAG vector store.
 
-        # Save the updated index back to disk
-        vstore.save_local("ipp_index")
+        Only chunks whose text is not already indexed for this file are
+        embedded, and chunks that disappeared from it are deleted (see
+        ``ingest.ingest_pdfs``). The update is applied to a copy of the current
+        store, which is then swapped in and persisted; queries running
+        meanwhile keep using the previous store. A newer generation saved by
+        another process is loaded first, so its changes are not lost.
+        """
+        from ingest import ingest_pdfs, open_manifest
 
+        with self._index_write_lock:
+            self._reload_index()
+            vstore = clone_index(self.vstore)
+            manifest = open_manifest(vstore, self.index_dir)
+            vstore, manifest, stats = ingest_pdfs(
+                [pdf_path], self.embeddings, vstore=vstore, manifest=manifest, workers=0, log=None
+            )
+            self.vstore = vstore
+            self.retriever.vectorstore = vstore
+            self.index_dir = save_index_atomic(vstore, manifest=manifest)
+            self.lexical = self._load_lexical(self.index_dir)
+        # Cached answers may have been based on the old context.
+        if self.response_cache is not None:
+            self.response_cache.clear()
+        return stats
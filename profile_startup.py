@@ -0,0 +1,235 @@
+"""Import-time and startup profile of the model, GUI and API server.
+
+``imports`` runs ``python -X importtime -c "import <module>"`` in a fresh
+interpreter per module and reports the total import time, the slowest
+modules and any heavy library (torch, faiss, langchain integrations, ...)
+pulled in at import time. ``model`` times ``import model``, each step of
+``Model()``, the warm-up and, with ``--query``, a first answer.
+``server`` starts uvicorn and times how long it takes to accept requests,
+to report ``/ready`` and, with ``--query``, to answer a first completion.
+
+    python profile_startup.py imports --max-import-s 0.5
+    python profile_startup.py model --query "void f(void) {}"
+    python profile_startup.py server --port 8765 --json startup.json
+
+Every command exits non-zero when a budget (``--max-*``) is exceeded or,
+for ``imports``, when a module imports a forbidden heavy library, so it can
+guard time-to-first-request in CI or before a release.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+# Loaded on first use; importing model, gui or server must not pull them in.
+HEAVY = (
+    "torch", "transformers", "sentence_transformers", "onnxruntime", "faiss",
+    "langchain_community", "langchain_openai", "langchain_huggingface", "openai", "tiktoken",
+)
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def import_profile(module: str) -> Dict:
+    """Import ``module`` in a fresh interpreter under ``-X importtime``."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    entries = []
+    error = None
+    for line in out.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if match is None:
+            if line.strip() and not line.startswith("import time:"):
+                error = line.strip()  # the traceback's last line wins
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        entries.append({"module": name, "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                        "depth": (len(indent) - 1) // 2})
+    total_us = sum(entry["cumulative_us"] for entry in entries if entry["depth"] == 0)
+    loaded = {entry["module"].split(".")[0] for entry in entries}
+    return {
+        "module": module,
+        "ok": out.returncode == 0,
+        "error": error if out.returncode else None,
+        "import_s": round(total_us / 1e6, 4),
+        "modules": len(entries),
+        "heavy": sorted(loaded & set(HEAVY)),
+        "slowest": sorted(entries, key=lambda entry: entry["self_us"], reverse=True),
+    }
+
+
+def _probe_model(query: Optional[str]) -> None:
+    # Runs in a fresh interpreter: what the GUI loader thread or a server
+    # worker pays before its first answer.
+    timings: Dict[str, float] = {}
+    steps: Dict[str, float] = {}
+    start = time.perf_counter()
+    from model import Model
+
+    timings["import_s"] = time.perf_counter() - start
+    last = [None, time.perf_counter()]
+
+    def progress(step: str) -> None:
+        now = time.perf_counter()
+        if last[0] is not None:
+            steps[last[0]] = round(now - last[1], 4)
+        last[:] = [step, now]
+
+    mark = time.perf_counter()
+    model = Model(progress=progress)
+    progress("")  # closes the last step
+    timings["construct_s"] = time.perf_counter() - mark
+    mark = time.perf_counter()
+    model.warm_up()
+    timings["warm_up_s"] = time.perf_counter() - mark
+    if query is not None:
+        mark = time.perf_counter()
+        model.run(query, check_cache=False)
+        timings["first_answer_s"] = time.perf_counter() - mark
+    timings["total_s"] = time.perf_counter() - start
+    print(json.dumps({**{k: round(v, 4) for k, v in timings.items()}, "steps": steps}))
+
+
+def model_profile(query: Optional[str]) -> Dict:
+    args = [sys.executable, os.path.abspath(__file__), "model", "--probe"]
+    if query is not None:
+        args += ["--query", query]
+    out = subprocess.run(args, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def server_profile(port: int, query: Optional[str], timeout: float) -> Dict:
+    """Start the API server with warm-up on and time it up to its first answer."""
+    import httpx
+
+    base = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "RAG_WARMUP": "1"}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result: Dict = {"accepting_s": None, "ready_s": None}
+    try:
+        with httpx.Client(timeout=5.0) as client:
+            while time.perf_counter() - start < timeout:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"server exited with code {proc.returncode}")
+                try:
+                    response = client.get(f"{base}/ready")
+                except httpx.TransportError:
+                    time.sleep(0.05)
+                    continue
+                elapsed = time.perf_counter() - start
+                if result["accepting_s"] is None:
+                    result["accepting_s"] = round(elapsed, 4)
+                if response.status_code == 200:
+                    result["ready_s"] = round(elapsed, 4)
+                    break
+                if response.json().get("status") == "error":
+                    raise RuntimeError(f"model failed to load: {response.json().get('detail')}")
+                time.sleep(0.05)
+            if result["ready_s"] is not None and query is not None:
+                mark = time.perf_counter()
+                response = client.post(
+                    f"{base}/v1/chat/completions",
+                    json={"messages": [{"role": "user", "content": query}]},
+                    timeout=timeout,
+                )
+                response.raise_for_status()
+                result["first_answer_s"] = round(time.perf_counter() - mark, 4)
+                result["first_request_s"] = round(time.perf_counter() - start, 4)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+
+def _over(value: Optional[float], budget: Optional[float]) -> bool:
+    return budget is not None and (value is None or value > budget)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_imports = sub.add_parser("imports", help="Import time of modules in a fresh interpreter")
+    p_imports.add_argument("modules", nargs="*", default=["model", "gui", "server"])
+    p_imports.add_argument("--top", type=int, default=15, help="Slowest modules to list")
+    p_imports.add_argument("--max-import-s", type=float, default=None)
+    p_imports.add_argument("--allow-heavy", nargs="*", default=[], help="Modules allowed to import heavy libraries")
+
+    p_model = sub.add_parser("model", help="Import, construction and warm-up of Model")
+    p_model.add_argument("--query", default=None, help="Also time a first (uncached) answer")
+    p_model.add_argument("--max-total-s", type=float, default=None)
+    p_model.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+
+    p_server = sub.add_parser("server", help="Time from starting uvicorn to ready and first answer")
+    p_server.add_argument("--port", type=int, default=8765)
+    p_server.add_argument("--query", default=None, help="Also time a first completion")
+    p_server.add_argument("--timeout", type=float, default=300.0)
+    p_server.add_argument("--max-ready-s", type=float, default=None)
+
+    for p in (p_imports, p_model, p_server):
+        p.add_argument("--json", default=None, help="Also write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    failures: List[str] = []
+    if args.command == "imports":
+        results = [import_profile(module) for module in args.modules]
+        for r in results:
+            status = "ok" if r["ok"] else f"FAILED ({r['error']})"
+            print(f"{r['module']:<10} {r['import_s']:8.3f} s  {r['modules']:5d} modules  {status}")
+            if r["heavy"]:
+                print(f"           heavy: {', '.join(r['heavy'])}")
+            for entry in r["slowest"][:args.top]:
+                print(f"           {entry['self_us'] / 1000:9.1f} ms self {entry['cumulative_us'] / 1000:9.1f} ms cum  "
+                      f"{entry['module']}")
+            r["slowest"] = r["slowest"][:args.top]
+            if not r["ok"]:
+                failures.append(f"{r['module']}: import failed")
+            if _over(r["import_s"], args.max_import_s):
+                failures.append(f"{r['module']}: import took {r['import_s']:.3f}s > {args.max_import_s}s")
+            if r["heavy"] and r["module"] not in args.allow_heavy:
+                failures.append(f"{r['module']}: imports {', '.join(r['heavy'])} at import time")
+        result = {"imports": results}
+    elif args.command == "model":
+        if args.probe:
+            _probe_model(args.query)
+            return
+        result = model_profile(args.query)
+        print(f"import {result['import_s']:.3f}s, Model() {result['construct_s']:.3f}s, "
+              f"warm-up {result['warm_up_s']:.3f}s, total {result['total_s']:.3f}s")
+        for step, seconds in result["steps"].items():
+            print(f"  {step:<24} {seconds:8.3f} s")
+        if "first_answer_s" in result:
+            print(f"first answer {result['first_answer_s']:.3f}s")
+        if _over(result["total_s"], args.max_total_s):
+            failures.append(f"model startup took {result['total_s']:.3f}s > {args.max_total_s}s")
+    else:
+        result = server_profile(args.port, args.query, args.timeout)
+        print(f"accepting requests after {result['accepting_s']}s, ready after {result['ready_s']}s")
+        if "first_request_s" in result:
+            print(f"first answer {result['first_answer_s']:.3f}s (first request done {result['first_request_s']:.3f}s "
+                  f"after start)")
+        if _over(result["ready_s"], args.max_ready_s):
+            failures.append(f"server ready after {result['ready_s']}s > {args.max_ready_s}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"created": int(time.time()), "python": sys.version.split()[0], **result}, f, indent=2)
+    if failures:
+        sys.exit("startup budget exceeded:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Short, focused retrieval queries for a refactoring request.
+
+A request's text is mostly boilerplate for retrieval: the instruction prompt
+and, from the API server, the whole chat transcript flattened into
+``ROLE: content`` lines (system prompt included). Embedded as one query it
+spends MiniLM's 256 tokens on that boilerplate and truncates the code.
+
+``retrieval_queries`` keeps only the user's C code and describes it the way
+the IPP manuals are organised: the operations it performs (multiply-
+accumulate, convolution, threshold, ...) with the IPP function families that
+implement them (``ippsDotProd``, ``ippiThreshold``), on 1D signals or 2D
+images, the element types of its buffers as IPP type names, the signatures of the
+functions it defines, the library functions it calls, and finally the code
+itself. At most ``MAX_QUERIES`` queries of ``QUERY_TOKENS`` tokens each, so
+the embedding cost of a request is bounded whatever its size.
+"""
+import re
+from typing import List, Optional
+
+from c_units import DECLARATION, FUNCTION, STRUCT, code_blocks, split_units, strip_comments
+from tokens import truncate_tokens
+
+MAX_QUERIES = 4
+QUERY_TOKENS = 64
+MAX_CALLS = 8
+
+_ROLE = re.compile(r"^(SYSTEM|USER|ASSISTANT|TOOL): ", re.MULTILINE)
+# What real (unfenced) C looks like, as opposed to prose with a stray ";":
+# a function definition or declaration starting with a C type, an include or
+# define, or a for loop header.
+_C_TYPE = (
+    r"(?:(?:unsigned|signed|short|long|const|volatile)\s+)*"
+    r"(?:void|char|short|int|long|float|double|bool|size_t|\w+_t|Ipp\w+|(?:struct|union|enum)\s+\w+)"
+)
+_C_STORAGE = r"(?:(?:typedef|extern|static|inline|const)\s+)*"
+_C_FUNCTION = re.compile(rf"^[ \t]*{_C_STORAGE}{_C_TYPE}[\s*]+[A-Za-z_]\w*\s*\(", re.MULTILINE)
+_C_DECLARATION = re.compile(rf"^[ \t]*{_C_STORAGE}{_C_TYPE}[\s*]+[A-Za-z_]\w*\s*[\[(=;,]", re.MULTILINE)
+_C_DIRECTIVE = re.compile(r"^[ \t]*#[ \t]*(?:include[ \t]*[<\"]|define[ \t]+\w|pragma[ \t]+\w|ifn?def[ \t]+\w)", re.MULTILINE)
+_C_LOOP = re.compile(r"\bfor\s*\([^;()]*;[^;()]*;[^)]*\)")
+_CALL = re.compile(r"\b([A-Za-z_]\w*)\s*\(")
+_KEYWORDS = frozenset({"if", "for", "while", "switch", "return", "sizeof", "defined", "do", "else", "case"})
+# Element type of a pointer or array: "const float *src", "short dst[64]".
+_BUFFER = re.compile(r"\b((?:unsigned|signed)\s+(?:char|short|int|long)|\w+)\s*(?:const\s*)?(?:\*|\w+\s*\[)")
+_IPP_TYPES = {
+    "unsigned char": "Ipp8u", "uint8_t": "Ipp8u", "Ipp8u": "Ipp8u",
+    "signed char": "Ipp8s", "int8_t": "Ipp8s", "Ipp8s": "Ipp8s",
+    "unsigned short": "Ipp16u", "uint16_t": "Ipp16u", "Ipp16u": "Ipp16u",
+    "short": "Ipp16s", "signed short": "Ipp16s", "int16_t": "Ipp16s", "Ipp16s": "Ipp16s",
+    "unsigned int": "Ipp32u", "uint32_t": "Ipp32u", "Ipp32u": "Ipp32u",
+    "int": "Ipp32s", "signed int": "Ipp32s", "int32_t": "Ipp32s", "Ipp32s": "Ipp32s",
+    "float": "Ipp32f", "Ipp32f": "Ipp32f",
+    "double": "Ipp64f", "Ipp64f": "Ipp64f",
+    "Ipp32fc": "Ipp32fc", "Ipp64fc": "Ipp64fc", "Ipp16sc": "Ipp16sc",
+}
+
+_DEFINE = re.compile(r"^[ \t]*#[ \t]*define[ \t]+(\w+)", re.MULTILINE)
+_DIRECTIVE = re.compile(r"^[ \t]*#(?:[^\n]*\\\n)*[^\n]*", re.MULTILINE)
+_INDEX = re.compile(r"\[[^\[\]]*\]")
+_MAC = re.compile(r"\+=[^;]*\*|\b(\w+)\s*=\s*\1\s*\+[^;]*\*")
+_OFFSET_INDEX = re.compile(r"\[\s*\w+\s*[-+]\s*\w+\s*\]")
+_NESTED_LOOP = re.compile(r"\bfor\s*\([^)]*\)\s*\{?\s*for\s*\(")
+_2D_INDEX = re.compile(r"\[\s*\w+\s*\*\s*\w+\s*\+\s*\w+\s*\]|\]\s*\[|\w+\s*\*\s*\w*[Ss]tep\b")
+_LOOP = re.compile(r"\b(?:for|while)\s*\(")
+# Simple patterns, checked in order; each adds its description once.
+_OPERATIONS = [
+    ("threshold", re.compile(r"[<>]=?[^;?]*\?[^;:]*:")),
+    ("saturation", re.compile(r"\b(?:32767|32768|65535|255|127|128|[US]?(?:INT|SHRT|CHAR)\w*_M(?:AX|IN))\b")),
+    ("scale factor shift", re.compile(r">>\s*\w+")),
+    ("magnitude", re.compile(r"\bsqrt\w*\s*\([^;]*\*[^;]*\+[^;]*\*")),
+    ("element-wise arithmetic", re.compile(r"\w+\[(\w+)\]\s*=\s*\w+\[\1\]\s*[-+*/]\s*\w+\[\1\]")),
+    ("copy", re.compile(r"\bmem(?:cpy|move)\s*\(|\w+\[(\w+)\]\s*=\s*\w+\[\1\]\s*;")),
+    ("set", re.compile(r"\bmemset\s*\(|\w+\[\s*\w+\s*\]\s*=\s*-?[\d.]+f?\s*;")),
+    ("absolute value", re.compile(r"\bf?abs\w*\s*\(")),
+    ("min max", re.compile(r"\b(?:f?min|f?max)\w*\b")),
+    ("sum", re.compile(r"\b(?:sum|total)\w*\s*\+=")),
+    ("Fourier transform", re.compile(r"\b(?:fft|dft|fourier)\w*|\bcos\w*\s*\(\s*2\s*\*\s*(?:M_PI|PI|pi)\b", re.I)),
+    ("type conversion", re.compile(r"\(\s*(?:unsigned\s+|signed\s+)?(?:char|short|int|float|double|Ipp\w+)\s*\)\s*[\w(]")),
+    ("sort", re.compile(r"\bqsort\s*\(")),
+]
+# IPP function name stems per operation; prefixed with ipps (1D) or ippi (2D)
+# they match whole families of functions in the lexical index.
+_FUNCTION_STEMS = {
+    "multiply-accumulate": ("AddProduct",),
+    "convolution FIR filter": ("FIR", "Conv"),
+    "dot product": ("DotProd",),
+    "threshold": ("Threshold",),
+    "magnitude": ("Magnitude",),
+    "element-wise arithmetic": ("Add", "Sub", "Mul"),
+    "copy": ("Copy",),
+    "set": ("Set", "Zero"),
+    "absolute value": ("Abs",),
+    "min max": ("MinMax",),
+    "sum": ("Sum",),
+    "Fourier transform": ("FFT", "DFT"),
+    "type conversion": ("Convert",),
+    "sort": ("SortAscend",),
+}
+_2D_STEMS = {"FIR": "Filter"}
+
+
+class CodeFeatures:
+    """What retrieval needs to know about a piece of C code."""
+
+    __slots__ = ("functions", "calls", "types", "operations", "dimensions")
+
+    def __init__(self) -> None:
+        self.functions: List[str] = []  # texts of the functions the code defines
+        self.calls: List[str] = []  # functions called but not defined here
+        self.types: List[str] = []  # IPP names of the buffer element types
+        self.operations: List[str] = []
+        self.dimensions: Optional[str] = None  # "1D signal" or "2D image", if the code loops
+
+
+def _is_c(unit) -> bool:
+    if unit.kind == FUNCTION:
+        return bool(_C_FUNCTION.search(unit.text))
+    if unit.kind == DECLARATION:
+        return bool(_C_DECLARATION.search(unit.text))
+    return unit.kind == STRUCT
+
+
+def has_code(text: str) -> bool:
+    """Whether ``text`` holds C code.
+
+    A fenced block, an include or define, a for loop, or a top-level unit
+    that really is C: a function or declaration starting with a C type, or
+    an aggregate. A ";" or brace in prose ("Thanks; now ...") is not enough.
+    """
+    if code_blocks(text) or _C_DIRECTIVE.search(text) or _C_LOOP.search(text):
+        return True
+    return any(_is_c(unit) for unit in split_units(strip_comments(text)))
+
+
+def _code_start(text: str) -> int:
+    # Offset of the first line that starts C code, skipping the prose before it.
+    starts = [m.start() for m in (_C_DIRECTIVE.search(text), _C_DECLARATION.search(text)) if m is not None]
+    return min(starts) if starts else 0
+
+
+def user_code(text: str) -> str:
+    """The C code of a request.
+
+    For a flattened transcript that is the last user turn containing code
+    (or else the last user turn); of that, the fenced code blocks if any,
+    else the text from the first line of C on.
+    """
+    turns = list(_ROLE.finditer(text))
+    user = [i for i, turn in enumerate(turns) if turn.group(1) == "USER"]
+    if user:
+        def turn_text(i: int) -> str:
+            end = turns[i + 1].start() if i + 1 < len(turns) else len(text)
+            return text[turns[i].end():end]
+
+        chosen = next((turn_text(i) for i in reversed(user) if has_code(turn_text(i))), None)
+        text = chosen if chosen is not None else turn_text(user[-1])
+    blocks = code_blocks(text)
+    if blocks:
+        return "\n".join(block.strip() for block in blocks)
+    if has_code(text):
+        text = text[_code_start(text):]
+    return text.strip()
+
+
+def _unique(items: List[str]) -> List[str]:
+    return list(dict.fromkeys(items))
+
+
+def code_features(code: str) -> CodeFeatures:
+    features = CodeFeatures()
+    code = strip_comments(code)
+    defined = set(_DEFINE.findall(code))
+    for unit in split_units(code):
+        if unit.kind == FUNCTION:
+            defined.add(unit.name)
+            features.functions.append(unit.text.strip())
+
+    calls = [name for name in _CALL.findall(code) if name not in _KEYWORDS and name not in defined]
+    features.calls = _unique(calls)[:MAX_CALLS]
+    types = (_IPP_TYPES.get(" ".join(name.split())) for name in _BUFFER.findall(code))
+    features.types = _unique([name for name in types if name])
+
+    operations = []
+    if _MAC.search(_INDEX.sub("[]", code)):  # products inside subscripts are addressing
+        operations.append("multiply-accumulate")
+        if _OFFSET_INDEX.search(code) or _NESTED_LOOP.search(code):
+            operations.append("convolution FIR filter")
+        else:
+            operations.append("dot product")
+    operations += [name for name, pattern in _OPERATIONS if pattern.search(code)]
+    features.operations = operations
+    if _2D_INDEX.search(code):
+        features.dimensions = "2D image"
+    elif _LOOP.search(code):
+        features.dimensions = "1D signal"
+    return features
+
+
+def retrieval_queries(text: str, max_queries: int = MAX_QUERIES, max_tokens: int = QUERY_TOKENS) -> List[str]:
+    """Up to ``max_queries`` retrieval queries of at most ``max_tokens`` tokens for ``text``.
+
+    In priority order: operations, types and the IPP function names they
+    suggest, library calls, then the start
+    of each function the code defines (signature first), or of the code
+    itself if it defines none. Empty text gives no queries.
+    """
+    code = user_code(text)
+    if not code:
+        return []
+    features = code_features(code)
+    queries = []
+    described = ([features.dimensions] if features.dimensions else []) + features.operations + features.types
+    prefix = "ippi" if features.dimensions == "2D image" else "ipps"
+    described += _unique([
+        prefix + (_2D_STEMS.get(stem, stem) if prefix == "ippi" else stem)
+        for operation in features.operations for stem in _FUNCTION_STEMS.get(operation, ())
+    ])
+    if features.operations or features.types:
+        queries.append("IPP " + " ".join(described))
+    if features.calls:
+        queries.append("IPP functions replacing " + " ".join(features.calls))
+    # Includes and macros say little about what the code does.
+    queries += features.functions or [_DIRECTIVE.sub("", strip_comments(code))]
+    queries = [" ".join(query.split()) for query in queries]
+    queries = _unique([truncate_tokens(query, max_tokens) for query in queries if query])
+    return queries[:max(1, max_queries)]
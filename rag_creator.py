@@ -1,55 +1,171 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI
+"""Build the ``ipp_index`` vector store, or run a one-off query against it.
 
+Build (streaming, parallel pipeline; updates an existing index incrementally):
+    python rag_creator.py build ipps.pdf ippi.pdf ippcv.pdf --batch-size 256 --workers 8
+
+Migrate a pickled index.pkl docstore to the memory-mapped docstore.sqlite:
+    python rag_creator.py migrate
+
+Rebuild the lexical index (lexical.npz) of an existing index:
+    python rag_creator.py lexical
+
+Query (reads a code snippet from stdin, answers via LM Studio):
+    python rag_creator.py < snippet.c
+"""
+import argparse
 import sys
 
-# # 1. Load PDF
-# loader = PyPDFLoader("ipps.pdf")
-# docs = loader.load()
-
-# # 2. Split into chunks
-# splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-# chunks = splitter.split_documents(docs)
-
-# # 3. Local sentence embedding model (fast + small)
-# embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-
-# # 4. Store vectors with FAISS
-# vectorstore = FAISS.from_documents(chunks, embeddings)
-# vectorstore.save_local("ipp_index")
-
-# Load the vectorstore from disk
-vectorstore = FAISS.load_local(
-    "ipp_index",
-    HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"),
-    allow_dangerous_deserialization=True,
-)
-
-# 5. Create retriever
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 4})
-
-# 6. Connect LangChain to LM Studio (OpenAI-compatible API)
-llm = ChatOpenAI(
-    model="gpt-oss-20b",                 # whatever model name you’ve loaded in LM Studio
-    openai_api_base="http://localhost:1234/v1",  # LM Studio’s API endpoint
-    openai_api_key="lm-studio",          # arbitrary placeholder; LM Studio ignores it
-    temperature=0.2                      # tweak creativity if you want
-)
-
-# 7. Combine into RetrievalQA chain
-qa = RetrievalQA.from_chain_type(
-    llm=llm,
-    retriever=retriever,
-    chain_type="stuff",
-)
-
-# 8. Example query
-prompt = "Please refactor this code snippet to use IPP instead of basic C. Functional parity should be preserved."
-query = sys.stdin.readlines()
-query = prompt + "\n" + "".join(query)
-out = qa.invoke({"query": query})
-print(out["result"] if isinstance(out, dict) and "result" in out else out)
+from index_store import INDEX_DIR
+
+# Heavy langchain imports stay inside the commands: the build command's worker
+# processes re-import this module, and they only need pypdf.
+
+
+def build(args: argparse.Namespace) -> None:
+    import os
+
+    from embedding_backends import make_embeddings
+    from index_store import INDEX_NAME, convert_index, generation_dir, index_type_of, load_index, save_index_atomic
+    from ingest import ingest_pdfs, open_manifest
+
+    embeddings = make_embeddings()
+    vectorstore, manifest = None, None
+    if not args.rebuild and os.path.exists(os.path.join(generation_dir(args.out), f"{INDEX_NAME}.faiss")):
+        # Incremental: only new or changed text gets embedded.
+        vectorstore = load_index(embeddings, args.out, mmap=False)
+        manifest = open_manifest(vectorstore, args.out)
+
+    vectorstore, manifest, stats = ingest_pdfs(
+        args.pdfs,
+        embeddings,
+        vstore=vectorstore,
+        manifest=manifest,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+    )
+    if vectorstore is None:
+        sys.exit("No text extracted; index not written.")
+    if args.index_type and (args.retrain or index_type_of(vectorstore.index) != args.index_type):
+        convert_index(
+            vectorstore,
+            args.index_type,
+            nlist=args.nlist,
+            hnsw_m=args.hnsw_m,
+            pq_m=args.pq_m,
+            train_size=args.train_size,
+        )
+    written = save_index_atomic(vectorstore, args.out, manifest=manifest)
+    print(f"Wrote {written}: {stats.summary()}", file=sys.stderr)
+
+
+def migrate(args: argparse.Namespace) -> None:
+    from index_store import load_index, save_index_atomic
+
+    # Last time the trusted legacy pickle is read; afterwards only docstore.sqlite is used.
+    vectorstore = load_index(None, args.index, mmap=False)
+    save_index_atomic(vectorstore, args.index)
+    print(f"Migrated {args.index} to docstore.sqlite ({len(vectorstore.index_to_docstore_id)} chunks)", file=sys.stderr)
+
+
+def lexical(args: argparse.Namespace) -> None:
+    import os
+
+    from docstore import DOCSTORE_NAME
+    from index_store import generation_dir, load_index, save_index_atomic
+    from lexical import LEXICAL_NAME, LexicalIndex
+
+    docstore_path = os.path.join(generation_dir(args.index), DOCSTORE_NAME)
+    if not os.path.exists(docstore_path):
+        sys.exit(f"{docstore_path} not found; run `python rag_creator.py migrate` first.")
+    # Published as a new generation, like any other change to the index.
+    vectorstore = load_index(None, args.index, mmap=False)
+    written = save_index_atomic(vectorstore, args.index, rebuild_lexical=True)
+    index = LexicalIndex.load(written)
+    print(f"Wrote {os.path.join(written, LEXICAL_NAME)} ({len(index)} chunks, {len(index.vocab)} terms)",
+          file=sys.stderr)
+
+
+def query(args: argparse.Namespace) -> None:
+    from langchain.chains import RetrievalQA
+    from langchain_openai import ChatOpenAI
+
+    from embedding_backends import make_embeddings
+    from index_store import load_index
+
+    # Load the vectorstore from disk
+    vectorstore = load_index(make_embeddings(), args.index)
+
+    # Create retriever
+    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 4})
+
+    # Connect LangChain to LM Studio (OpenAI-compatible API)
+    llm = ChatOpenAI(
+        model="gpt-oss-20b",                 # whatever model name you’ve loaded in LM Studio
+        openai_api_base="http://localhost:1234/v1",  # LM Studio’s API endpoint
+        openai_api_key="lm-studio",          # arbitrary placeholder; LM Studio ignores it
+        temperature=0.2                      # tweak creativity if you want
+    )
+
+    # Combine into RetrievalQA chain
+    qa = RetrievalQA.from_chain_type(
+        llm=llm,
+        retriever=retriever,
+        chain_type="stuff",
+    )
+
+    # Example query
+    prompt = "Please refactor this code snippet to use IPP instead of basic C. Functional parity should be preserved."
+    lines = sys.stdin.readlines()
+    text = prompt + "\n" + "".join(lines)
+    out = qa.invoke({"query": text})
+    print(out["result"] if isinstance(out, dict) and "result" in out else out)
+
+
+def main(argv=None) -> None:
+    from index_store import HNSW_M, INDEX_TYPES, TRAIN_SIZE
+    from ingest import CHUNK_OVERLAP, CHUNK_SIZE, EMBED_BATCH_SIZE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command")
+
+    p_build = sub.add_parser("build", help="Build or incrementally update the FAISS index from PDFs")
+    p_build.add_argument("pdfs", nargs="+", help="PDF files to ingest (e.g. ipps.pdf ippi.pdf)")
+    p_build.add_argument("--out", default=INDEX_DIR, help="Output index folder")
+    p_build.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks embedded per batch")
+    p_build.add_argument("--workers", type=int, default=None, help="PDF parser processes (default: CPU count)")
+    p_build.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    p_build.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    p_build.add_argument("--rebuild", action="store_true", help="Ignore the existing index and start from scratch")
+    p_build.add_argument(
+        "--index-type", choices=INDEX_TYPES, default=None,
+        help="FAISS index type (default: keep the existing type; new indexes are flat)",
+    )
+    p_build.add_argument("--retrain", action="store_true", help="Retrain IVF centroids even if the type is unchanged")
+    p_build.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(n))")
+    p_build.add_argument("--hnsw-m", type=int, default=HNSW_M, help="HNSW neighbors per node")
+    p_build.add_argument("--pq-m", type=int, default=None, help="IVF-PQ sub-quantizers (must divide the dimension)")
+    p_build.add_argument("--train-size", type=int, default=TRAIN_SIZE, help="Max vectors sampled for IVF training")
+    p_build.set_defaults(func=build)
+
+    p_migrate = sub.add_parser("migrate", help="Convert a pickled index.pkl docstore to docstore.sqlite")
+    p_migrate.add_argument("--index", default=INDEX_DIR, help="Index folder")
+    p_migrate.set_defaults(func=migrate)
+
+    p_lexical = sub.add_parser("lexical", help="Rebuild the lexical (BM25) index from docstore.sqlite")
+    p_lexical.add_argument("--index", default=INDEX_DIR, help="Index folder")
+    p_lexical.set_defaults(func=lexical)
+
+    p_query = sub.add_parser("query", help="Answer a code snippet read from stdin (default)")
+    p_query.add_argument("--index", default=INDEX_DIR, help="Index folder")
+    p_query.set_defaults(func=query)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(["query"])
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
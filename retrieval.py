@@ -0,0 +1,98 @@
+"""Turning retrieved chunks into the context block of the prompt.
+
+A request is retrieved with several short queries (see ``query_plan``);
+``fuse_ranked`` merges their hit lists into one ranking.
+
+Chunks are split with ``chunk_overlap=200``, so neighbouring hits from the
+same page repeat part of each other's text. ``pack_context`` merges such
+chunks, drops duplicated text and fills the context up to a token budget
+in retrieval-rank order.
+"""
+from typing import Dict, List, Optional
+
+from tokens import count_tokens, truncate_tokens
+
+# Shortest shared run of characters treated as chunk overlap rather than chance.
+MIN_OVERLAP = 32
+# Below this many tokens a truncated chunk is more noise than context.
+MIN_PARTIAL_TOKENS = 64
+SEPARATOR = "\n\n"
+# Reciprocal-rank fusion constant: the larger, the less the top ranks dominate.
+RRF_K = 60
+
+
+def fuse_ranked(rankings: List[List["Document"]], limit: int) -> List["Document"]:
+    """The best ``limit`` chunks of several ranked hit lists, by reciprocal-rank fusion.
+
+    A chunk scores ``1 / (RRF_K + rank)`` summed over the lists that found
+    it, so chunks several queries agree on come first. The same chunk found
+    twice appears once; ties keep first-seen order.
+    """
+    scores: Dict[tuple, float] = {}
+    docs: Dict[tuple, "Document"] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            key = (doc.metadata.get("source"), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:limit]]
+
+
+def _overlap_merge(first: str, second: str) -> Optional[str]:
+    """``first`` + ``second`` without the text they share, if ``first`` ends
+    where ``second`` starts (or one contains the other); otherwise None."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    head = second[:MIN_OVERLAP]
+    if len(head) < MIN_OVERLAP:
+        return None
+    start = first.find(head)
+    while start != -1:
+        tail = first[start:]
+        if second.startswith(tail):
+            return first + second[len(tail):]
+        start = first.find(head, start + 1)
+    return None
+
+
+def merge_chunks(docs: List["Document"]) -> List[str]:
+    """Texts of ``docs`` in rank order, with overlapping chunks of the same
+    source merged into the position of the best-ranked one."""
+    blocks: List[dict] = []
+    for doc in docs:
+        text = doc.page_content.strip()
+        if not text:
+            continue
+        source = doc.metadata.get("source")
+        for block in blocks:
+            if block["source"] != source:
+                continue
+            merged = _overlap_merge(block["text"], text) or _overlap_merge(text, block["text"])
+            if merged is not None:
+                block["text"] = merged
+                break
+        else:
+            blocks.append({"source": source, "text": text})
+    return [block["text"] for block in blocks]
+
+
+def pack_context(docs: List["Document"], max_tokens: int) -> str:
+    """Deduplicated context from ``docs`` that fits in ``max_tokens``.
+
+    Blocks are added in rank order; the first block that does not fit is
+    truncated if enough room is left, and packing stops there.
+    """
+    parts: List[str] = []
+    remaining = max_tokens
+    for text in merge_chunks(docs):
+        cost = count_tokens(text) + (count_tokens(SEPARATOR) if parts else 0)
+        if cost <= remaining:
+            parts.append(text)
+            remaining -= cost
+            continue
+        if remaining >= MIN_PARTIAL_TOKENS:
+            parts.append(truncate_tokens(text, remaining - count_tokens(SEPARATOR)))
+        break
+    return SEPARATOR.join(parts)
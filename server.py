@@ -1,13 +1,22 @@
+import asyncio
+import contextlib
+import json
 import os
+import threading
 import time
 import uuid
 from typing import Any, Dict, List, Literal, Optional
 
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
+from coalesce import SingleFlight
+from metrics import CACHE_HITS, CACHE_MISSES, IN_FLIGHT, REGISTRY, REQUEST_SECONDS, Trace
+from tokens import count_tokens
+
 # Lazy import of the heavy RAG model to keep the server start lightweight
 from importlib import import_module
 
@@ -30,6 +39,8 @@ class ChatCompletionRequest(BaseModel):
 	temperature: Optional[float] = 0.2
 	stream: Optional[bool] = False
 	max_tokens: Optional[int] = None  # ignored; provided for compatibility
+	# extension: replaces the server's refactoring instruction for this request
+	instruction: Optional[str] = None
 
 
 class ChatMessageOut(BaseModel):
@@ -56,6 +67,24 @@ class ChatCompletionResponse(BaseModel):
 	model: str
 	choices: List[Choice]
 	usage: Usage = Usage()
+	cached: bool = False  # extension: answer served from the response cache
+
+
+# The only endpoint batch items may target.
+BATCH_ITEM_URL = "/v1/chat/completions"
+
+
+class BatchRequestItem(BaseModel):
+	# One line of an OpenAI batch input file
+	custom_id: Optional[str] = None
+	method: Optional[str] = "POST"
+	url: Optional[str] = BATCH_ITEM_URL
+	body: Dict[str, Any]
+
+
+class BatchRequest(BaseModel):
+	requests: List[BatchRequestItem]
+	max_parallel: Optional[int] = Field(default=None, description="Upstream calls in flight (capped by RAG_BATCH_MAX_PARALLEL)")
 
 
 class DeltaMessage(BaseModel):
@@ -75,6 +104,7 @@ class ChatCompletionChunk(BaseModel):
 	created: int
 	model: str
 	choices: List[ChoiceDelta]
+	usage: Optional[Usage] = None  # set on the final chunk only
 
 
 # -----------------------------
@@ -83,6 +113,19 @@ class ChatCompletionChunk(BaseModel):
 
 APP_NAME = "CapstoneRAGTool API"
 MODEL_ID = os.getenv("RAG_MODEL_ID", "capstone-rag")
+# Completions allowed to run at once, and how many more may wait for a slot
+# before new requests are rejected with 429.
+MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "64"))
+MAX_QUEUE = int(os.getenv("RAG_MAX_QUEUE", "256"))
+# Upper bound on upstream LLM calls a single batch request runs at once.
+BATCH_MAX_PARALLEL = int(os.getenv("RAG_BATCH_MAX_PARALLEL", "8"))
+# RAG_WARMUP=1 loads and warms the model in the background at startup instead
+# of on the first request.
+WARMUP = os.getenv("RAG_WARMUP", "0") == "1"
+# Seconds /health reuses the last upstream probe before running a new one.
+HEALTH_TTL = float(os.getenv("RAG_HEALTH_TTL", "60"))
+# RAG_TIMING_HEADERS=1 adds a Server-Timing header with per-stage durations.
+TIMING_HEADERS = os.getenv("RAG_TIMING_HEADERS", "0") == "1"
 
 app = FastAPI(title=APP_NAME, version="1.0.0")
 
@@ -98,26 +141,123 @@ app.add_middleware(
 
 rag_model: Any = None
 rag_model_error: Optional[str] = None
+rag_model_ready = False
+_model_lock = threading.Lock()
+_warmup_thread: Optional[threading.Thread] = None
 
 
 @app.on_event("startup")
 def _maybe_warm() -> None:
-	# Do nothing on startup; model will be loaded lazily on first use.
-	pass
+	# Lazy by default; with RAG_WARMUP=1 start loading right away so /ready
+	# flips before traffic arrives.
+	if WARMUP:
+		_start_warmup()
+
+
+def _start_warmup() -> None:
+	# Load the model on a background thread unless it is loaded or loading already.
+	global _warmup_thread
+	if rag_model_ready or (_warmup_thread is not None and _warmup_thread.is_alive()):
+		return
+	_warmup_thread = threading.Thread(target=_ensure_model, name="rag-warmup", daemon=True)
+	_warmup_thread.start()
 
 
 def _ensure_model() -> None:
-	global rag_model, rag_model_error
+	global rag_model, rag_model_error, rag_model_ready
 	if rag_model is not None:
 		return
+	# Double-checked so a burst of first requests builds exactly one Model.
+	with _model_lock:
+		if rag_model is not None:
+			return
+		try:
+			model_module = import_module("model")
+			RagModel = getattr(model_module, "Model")
+			model = RagModel()
+			model.warm_up()
+			rag_model = model
+			rag_model_error = None
+			rag_model_ready = True
+		except Exception as e:
+			rag_model_error = str(e)
+			rag_model = None
+
+
+_health_lock = threading.Lock()
+_health_result: Optional[Dict[str, Any]] = None
+_health_checked_at = 0.0
+
+
+def _probe_upstream() -> Dict[str, Any]:
+	# Full RAG + LLM round trip, cached for HEALTH_TTL seconds. Only one probe
+	# runs at a time; callers arriving meanwhile get the previous result.
+	global _health_result, _health_checked_at
+	if _health_result is not None and time.monotonic() - _health_checked_at < HEALTH_TTL:
+		return _health_result
+	if not _health_lock.acquire(blocking=_health_result is None):
+		return _health_result
 	try:
-		model_module = import_module("model")
-		RagModel = getattr(model_module, "Model")
-		rag_model = RagModel()
-		rag_model_error = None
-	except Exception as e:
-		rag_model_error = str(e)
-		rag_model = None
+		if _health_result is not None and time.monotonic() - _health_checked_at < HEALTH_TTL:
+			return _health_result
+		try:
+			ok = rag_model.check_connection()
+			result: Dict[str, Any] = {"status": "ok" if ok else "degraded"}
+		except Exception as e:
+			result = {"status": "degraded", "detail": str(e)}
+		result["checked_at"] = int(time.time())
+		_health_result = result
+		_health_checked_at = time.monotonic()
+		return result
+	finally:
+		_health_lock.release()
+
+
+class _ConcurrencyLimiter:
+	"""Bounds in-flight completions and caps how many may queue behind them."""
+
+	def __init__(self, max_concurrency: int, max_queue: int) -> None:
+		self._sem = asyncio.Semaphore(max_concurrency)
+		self.max_concurrency = max_concurrency
+		self.max_queue = max_queue
+		self.pending = 0  # running + waiting
+
+	def check(self) -> None:
+		"""Reject (429) a new request if the queue is full."""
+		if self.pending >= self.max_concurrency + self.max_queue:
+			raise HTTPException(
+				status_code=429,
+				detail="Server busy: too many queued requests",
+				headers={"Retry-After": "1"},
+			)
+
+	async def acquire(self, check: bool = True) -> None:
+		if check:
+			self.check()
+		self.pending += 1
+		try:
+			await self._sem.acquire()
+		except BaseException:
+			self.pending -= 1
+			raise
+
+	def release(self) -> None:
+		self._sem.release()
+		self.pending -= 1
+
+	@contextlib.asynccontextmanager
+	async def slot(self):
+		"""Hold a slot for one completion of an admitted batch (waits, never rejects)."""
+		await self.acquire(check=False)
+		try:
+			yield
+		finally:
+			self.release()
+
+
+limiter = _ConcurrencyLimiter(MAX_CONCURRENCY, MAX_QUEUE)
+# Identical completions in flight at the same time share one computation.
+coalescer = SingleFlight()
 
 
 # -----------------------------
@@ -126,17 +266,59 @@ def _ensure_model() -> None:
 
 def _messages_to_prompt(messages: List[ChatMessage]) -> str:
 	# Convert a list of chat messages into a flattened prompt string
-	# Preserve order; simple tagged transcript format
+	# Preserve order; simple tagged transcript format. System messages are
+	# not part of it: they become the request's system prompt (_request_prompts).
+	# Long chats are windowed to a token budget, older turns summarized.
+	turns = rag_model.history.fit([(m.role, m.content) for m in messages if m.role != "system"])
 	lines: List[str] = []
-	for m in messages:
-		role = m.role.upper()
-		lines.append(f"{role}: {m.content}")
+	for role, content in turns:
+		lines.append(f"{role.upper()}: {content}")
 	return "\n".join(lines).strip()
 
 
-def _fake_tokenize(text: str, chunk_size: int = 60) -> List[str]:
-	# Simple chunker to simulate streaming tokens
-	return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+def _request_prompts(req: ChatCompletionRequest):
+	# The request's system messages replace the default system prompt and its
+	# instruction the default instruction; compiled templates are shared
+	# between requests with the same texts (Model.prompts_for).
+	system = [m.content for m in req.messages if m.role == "system"]
+	return rag_model.prompts_for("\n\n".join(system) if system else None, req.instruction)
+
+
+def _content_event(completion_id: str, created: int, model_name: str, piece: str) -> str:
+	# Serialize one streamed content delta as an SSE event
+	chunk = ChatCompletionChunk(
+		id=completion_id,
+		created=created,
+		model=model_name,
+		choices=[ChoiceDelta(index=0, delta=DeltaMessage(content=piece))],
+	)
+	return f"data: {chunk.model_dump_json()}\n\n"
+
+
+def _batch_line(custom_id: str, response: Optional[Dict[str, Any]] = None, error: Optional[Dict[str, Any]] = None) -> str:
+	# One line of an OpenAI batch output file
+	line = {
+		"id": f"batch_req_{uuid.uuid4().hex}",
+		"custom_id": custom_id,
+		"response": response,
+		"error": error,
+	}
+	return json.dumps(line) + "\n"
+
+
+async def _replay(text: str):
+	# Serve a cached answer through the same streaming path as a live one
+	yield text
+
+
+def _usage(trace: Trace, prompt_text: str, answer: str) -> Usage:
+	# Upstream counts when the model recorded them; cache hits never reached
+	# the upstream, so estimate from the request and answer text.
+	if trace.prompt_tokens is None:
+		prompt_tokens, completion_tokens = count_tokens(prompt_text), count_tokens(answer)
+	else:
+		prompt_tokens, completion_tokens = trace.prompt_tokens, trace.completion_tokens
+	return Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
 
 
 # -----------------------------
@@ -165,63 +347,148 @@ def health() -> Dict[str, Any]:
 	_ensure_model()
 	if rag_model is None:
 		return {"status": "degraded", "detail": rag_model_error or "model not available"}
-	try:
-		ok = rag_model.check_connection()
-		return {"status": "ok" if ok else "degraded"}
-	except Exception as e:
-		return {"status": "degraded", "detail": str(e)}
+	return {
+		**_probe_upstream(),
+		"caches": rag_model.cache_stats(),
+		"coalescing": coalescer.stats(),
+		"upstreams": rag_model.llm.stats(),
+	}
+
+
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+	# Prometheus text format. Never loads the model; cache counters appear once it is.
+	IN_FLIGHT.set(limiter.pending)
+	if rag_model is not None:
+		for name, stats in rag_model.cache_stats().items():
+			CACHE_HITS.set(stats["hits"], cache=name)
+			CACHE_MISSES.set(stats["misses"], cache=name)
+	return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/ready")
+def ready():
+	# Cheap readiness probe: never touches the embedder, index or upstream LLM.
+	if rag_model_ready:
+		return {"status": "ready"}
+	_start_warmup()
+	status = "error" if rag_model_error else "loading"
+	return JSONResponse(status_code=503, content={"status": status, "detail": rag_model_error})
 
 
 @app.post("/v1/chat/completions")
-def chat_completions(req: ChatCompletionRequest):
+async def chat_completions(req: ChatCompletionRequest):
 	if not req.messages:
 		raise HTTPException(status_code=400, detail="messages must be a non-empty array")
-	_ensure_model()
+	await run_in_threadpool(_ensure_model)
 	if rag_model is None:
 		raise HTTPException(status_code=503, detail=f"Model unavailable: {rag_model_error}")
 
+	started = time.perf_counter()
 	created = int(time.time())
 	completion_id = f"chatcmpl-{uuid.uuid4().hex}"
 	prompt_text = _messages_to_prompt(req.messages)
+	prompts = _request_prompts(req)
+	model_name = req.model or MODEL_ID
+	trace = Trace()
 
+	# Cache hits are answered without taking a concurrency slot.
 	try:
-		full_text = rag_model.run(prompt_text)
+		cached = await rag_model.acached_response(prompt_text, prompts)
 	except Exception as e:
 		raise HTTPException(status_code=500, detail=f"Model error: {e}")
-
-	model_name = req.model or MODEL_ID
+	headers = {"X-Cache": "miss" if cached is None else "hit"}
+	if cached is None:
+		# Requests identical to one in flight subscribe to it (replaying what it
+		# has produced so far) instead of running their own; only the first
+		# takes a concurrency slot, for as long as the computation runs.
+		async def produce(flight_trace: Trace):
+			await limiter.acquire()
+			try:
+				async for piece in rag_model.astream(prompt_text, check_cache=False, trace=flight_trace, prompts=prompts):
+					yield piece
+			finally:
+				limiter.release()
+
+		flight, joined = coalescer.join(rag_model.coalesce_key(prompt_text, prompts), produce)
+		if joined:
+			headers["X-Cache"] = "coalesced"
+		trace = flight.trace
+		tokens = flight.subscribe()
+	else:
+		tokens = _replay(cached)
+
+	def finish() -> None:
+		REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="chat", cache=headers["X-Cache"])
 
 	if req.stream:
-		def event_stream():
-			# Initial role event
-			first_chunk = ChatCompletionChunk(
-				id=completion_id,
-				created=created,
-				model=model_name,
-				choices=[ChoiceDelta(index=0, delta=DeltaMessage(role="assistant"))],
-			)
-			yield f"data: {first_chunk.model_dump_json()}\n\n"
-
-			for piece in _fake_tokenize(full_text):
-				chunk = ChatCompletionChunk(
+		# Pull the first token before committing to a 200 so that retrieval or
+		# upstream connection failures still surface as a proper HTTP error.
+		try:
+			first_piece = await anext(tokens, None)
+		except HTTPException:
+			finish()
+			raise
+		except Exception as e:
+			finish()
+			raise HTTPException(status_code=500, detail=f"Model error: {e}")
+		if TIMING_HEADERS:
+			# Only the stages up to the first token are known at this point.
+			headers["Server-Timing"] = trace.server_timing()
+
+		async def event_stream():
+			try:
+				# Initial role event
+				first_chunk = ChatCompletionChunk(
 					id=completion_id,
 					created=created,
 					model=model_name,
-					choices=[ChoiceDelta(index=0, delta=DeltaMessage(content=piece))],
+					choices=[ChoiceDelta(index=0, delta=DeltaMessage(role="assistant"))],
 				)
-				yield f"data: {chunk.model_dump_json()}\n\n"
-
-			# Final stop signal
-			final_chunk = ChatCompletionChunk(
-				id=completion_id,
-				created=created,
-				model=model_name,
-				choices=[ChoiceDelta(index=0, delta=DeltaMessage(), finish_reason="stop")],
-			)
-			yield f"data: {final_chunk.model_dump_json()}\n\n"
-			yield "data: [DONE]\n\n"
+				yield f"data: {first_chunk.model_dump_json()}\n\n"
+
+				finish_reason = "stop"
+				pieces: List[str] = []
+				try:
+					if first_piece is not None:
+						pieces.append(first_piece)
+						yield _content_event(completion_id, created, model_name, first_piece)
+					async for piece in tokens:
+						pieces.append(piece)
+						yield _content_event(completion_id, created, model_name, piece)
+				except Exception as e:
+					# Headers are already sent; report the failure in-band like OpenAI does.
+					finish_reason = "error"
+					error = {"error": {"message": f"Model error: {e}", "type": "server_error"}}
+					yield f"data: {json.dumps(error)}\n\n"
+
+				# Final stop signal
+				final_chunk = ChatCompletionChunk(
+					id=completion_id,
+					created=created,
+					model=model_name,
+					choices=[ChoiceDelta(index=0, delta=DeltaMessage(), finish_reason=finish_reason)],
+					usage=_usage(trace, prompt_text, "".join(pieces)),
+				)
+				yield f"data: {final_chunk.model_dump_json()}\n\n"
+				yield "data: [DONE]\n\n"
+			finally:
+				# Unsubscribe now if the client went away mid-stream.
+				await tokens.aclose()
+				finish()
+
+		return StreamingResponse(event_stream(), media_type="text/event-stream", headers=headers)
 
-		return StreamingResponse(event_stream(), media_type="text/event-stream")
+	try:
+		full_text = "".join([piece async for piece in tokens])
+	except HTTPException:
+		raise
+	except Exception as e:
+		raise HTTPException(status_code=500, detail=f"Model error: {e}")
+	finally:
+		finish()
+	if TIMING_HEADERS:
+		headers["Server-Timing"] = trace.server_timing()
 
 	# Non-streaming
 	response = ChatCompletionResponse(
@@ -235,9 +502,83 @@ def chat_completions(req: ChatCompletionRequest):
 				finish_reason="stop",
 			)
 		],
-		usage=Usage(),
+		usage=_usage(trace, prompt_text, full_text),
+		cached=cached is not None,
 	)
-	return JSONResponse(content=response.model_dump())
+	return JSONResponse(content=response.model_dump(), headers=headers)
+
+
+@app.post("/v1/batch/chat/completions")
+async def batch_chat_completions(req: BatchRequest):
+	"""Run many chat completions; results stream back as JSONL as each finishes.
+
+	Input items and output lines follow OpenAI's batch file format. Invalid or
+	failing items produce an ``error`` line and do not fail the batch.
+	"""
+	if not req.requests:
+		raise HTTPException(status_code=400, detail="requests must be a non-empty array")
+	await run_in_threadpool(_ensure_model)
+	if rag_model is None:
+		raise HTTPException(status_code=503, detail=f"Model unavailable: {rag_model_error}")
+
+	max_parallel = max(1, min(req.max_parallel or BATCH_MAX_PARALLEL, BATCH_MAX_PARALLEL))
+	invalid: List[str] = []
+	items: List[tuple] = []
+	for i, item in enumerate(req.requests):
+		custom_id = item.custom_id or f"request-{i}"
+		if item.url != BATCH_ITEM_URL or (item.method or "POST").upper() != "POST":
+			message = f"Unsupported {item.method} {item.url}; batch items must be POST {BATCH_ITEM_URL}"
+			invalid.append(_batch_line(custom_id, error={"code": "invalid_request", "message": message}))
+			continue
+		try:
+			chat = ChatCompletionRequest.model_validate(item.body)
+			if not chat.messages:
+				raise ValueError("messages must be a non-empty array")
+		except Exception as e:
+			invalid.append(_batch_line(custom_id, error={"code": "invalid_request", "message": str(e)}))
+			continue
+		items.append((custom_id, chat))
+
+	# Admitted like any request (429 when the queue is full); then every item
+	# holds its own concurrency slot while its upstream call runs, so the batch
+	# counts as up to max_parallel in-flight completions.
+	limiter.check()
+	started = time.perf_counter()
+
+	async def lines():
+		try:
+			for line in invalid:
+				yield line
+			queries = [_messages_to_prompt(chat.messages) for _, chat in items]
+			prompts = [_request_prompts(chat) for _, chat in items]
+			traces = [Trace() for _ in items]
+			async for i, answer, error, from_cache in rag_model.abatch(
+				queries, max_parallel=max_parallel, traces=traces, prompts=prompts, slot=limiter.slot
+			):
+				custom_id, chat = items[i]
+				if error is not None:
+					yield _batch_line(custom_id, error={"code": "model_error", "message": str(error)})
+					continue
+				completion = ChatCompletionResponse(
+					id=f"chatcmpl-{uuid.uuid4().hex}",
+					created=int(time.time()),
+					model=chat.model or MODEL_ID,
+					choices=[
+						Choice(
+							index=0,
+							message=ChatMessageOut(role="assistant", content=answer),
+							finish_reason="stop",
+						)
+					],
+					usage=_usage(traces[i], queries[i], answer),
+					cached=from_cache,
+				)
+				response = {"status_code": 200, "request_id": completion.id, "body": completion.model_dump()}
+				yield _batch_line(custom_id, response=response)
+		finally:
+			REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="batch", cache="n/a")
+
+	return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 if __name__ == "__main__":
@@ -245,5 +586,9 @@ if __name__ == "__main__":
 
 	host = os.getenv("HOST", "0.0.0.0")
 	port = int(os.getenv("PORT", "8000"))
-	uvicorn.run("server:app", host=host, port=port, reload=False)
+	# Workers share the memory-mapped index through the OS page cache and pick up
+	# index generations saved by each other (RAG_INDEX_RELOAD_INTERVAL); set
+	# RAG_EMBEDDINGS_URL so they also share one embedding model (embed_service.py).
+	workers = int(os.getenv("WORKERS", "1"))
+	uvicorn.run("server:app", host=host, port=port, reload=False, workers=workers)
 
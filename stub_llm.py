@@ -0,0 +1,151 @@
+"""Local OpenAI-compatible stub LLM for load testing without OpenRouter.
+
+Answers ``POST /v1/chat/completions`` (streaming and not) with canned IPP
+refactoring text after a configurable delay, at a configurable token rate,
+and fails a configurable share of requests:
+
+    python stub_llm.py --port 8200 --latency 0.3 --tokens-per-sec 80 --error-rate 0.01
+    OPENROUTER_BASE_URL=http://127.0.0.1:8200/v1 OPENROUTER_API_KEY=stub python server.py
+
+``--latency`` is the time to the first token; the rest of the completion then
+arrives at ``--tokens-per-sec``.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from tokens import count_tokens
+
+app = FastAPI(title="CapstoneRAGTool stub LLM", version="1.0.0")
+
+# Overwritten from the command line in __main__.
+config: Dict[str, Any] = {
+	"latency": 0.2,
+	"jitter": 0.0,
+	"tokens_per_sec": 50.0,
+	"completion_tokens": 200,
+	"error_rate": 0.0,
+	"error_status": 500,
+	"stream_error_rate": 0.0,
+}
+
+ANSWER = (
+	"Here is the snippet refactored to use IPP. The loop is replaced by a single "
+	"ippsFIRSR_32f call after the spec and buffer are sized with ippsFIRSRGetSize "
+	"and initialized with ippsFIRSRInit_32f. Status codes are checked after every "
+	"call and the work buffer is released with ippsFree. "
+)
+
+
+def _completion_words(n: int) -> list:
+	# n whitespace-separated pieces, each streamed as one "token"
+	words = ANSWER.split()
+	return [(words[i % len(words)] + " ") for i in range(n)]
+
+
+def _delay() -> float:
+	return max(0.0, config["latency"] + random.uniform(-config["jitter"], config["jitter"]))
+
+
+def _usage(body: Dict[str, Any], completion: str) -> Dict[str, int]:
+	prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+	prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(completion)
+	return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _error(status: int) -> JSONResponse:
+	return JSONResponse(
+		status_code=status,
+		content={"error": {"message": "injected failure", "type": "server_error", "code": status}},
+	)
+
+
+@app.get("/v1/models")
+def list_models() -> Dict[str, Any]:
+	return {"object": "list", "data": [{"id": "stub", "object": "model", "created": 0, "owned_by": "local"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+	body = await request.json()
+	if random.random() < config["error_rate"]:
+		await asyncio.sleep(_delay())
+		return _error(config["error_status"])
+
+	completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+	created = int(time.time())
+	model = body.get("model") or "stub"
+	max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+	words = _completion_words(min(config["completion_tokens"], max_tokens or config["completion_tokens"]))
+	interval = 1.0 / config["tokens_per_sec"] if config["tokens_per_sec"] > 0 else 0.0
+
+	def chunk(delta: Dict[str, Any], finish_reason=None, usage=None) -> str:
+		data = {
+			"id": completion_id,
+			"object": "chat.completion.chunk",
+			"created": created,
+			"model": model,
+			"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+		}
+		if usage is not None:
+			data["usage"] = usage
+		return f"data: {json.dumps(data)}\n\n"
+
+	if body.get("stream"):
+		fail_at = random.randrange(len(words)) if words and random.random() < config["stream_error_rate"] else None
+
+		async def events():
+			await asyncio.sleep(_delay())
+			yield chunk({"role": "assistant", "content": ""})
+			for i, word in enumerate(words):
+				if i == fail_at:
+					# Drop the connection mid-stream, as a failing upstream would.
+					raise RuntimeError("injected stream failure")
+				if i:
+					await asyncio.sleep(interval)
+				yield chunk({"content": word})
+			yield chunk({}, finish_reason="stop")
+			if (body.get("stream_options") or {}).get("include_usage"):
+				yield chunk({}, usage=_usage(body, "".join(words)))
+			yield "data: [DONE]\n\n"
+
+		return StreamingResponse(events(), media_type="text/event-stream")
+
+	await asyncio.sleep(_delay() + interval * max(0, len(words) - 1))
+	text = "".join(words)
+	return {
+		"id": completion_id,
+		"object": "chat.completion",
+		"created": created,
+		"model": model,
+		"choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+		"usage": _usage(body, text),
+	}
+
+
+if __name__ == "__main__":
+	import uvicorn
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8200)
+	parser.add_argument("--latency", type=float, default=config["latency"], help="Seconds to the first token")
+	parser.add_argument("--jitter", type=float, default=config["jitter"], help="Uniform +/- seconds added to --latency")
+	parser.add_argument("--tokens-per-sec", type=float, default=config["tokens_per_sec"], help="0 sends all tokens at once")
+	parser.add_argument("--completion-tokens", type=int, default=config["completion_tokens"])
+	parser.add_argument("--error-rate", type=float, default=config["error_rate"], help="Share of requests answered with --error-status")
+	parser.add_argument("--error-status", type=int, default=config["error_status"])
+	parser.add_argument("--stream-error-rate", type=float, default=config["stream_error_rate"], help="Share of streams cut off midway")
+	parser.add_argument("--seed", type=int, default=None)
+	args = parser.parse_args()
+	random.seed(args.seed)
+	for key in config:
+		config[key] = getattr(args, key)
+	uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+
+
+async def _until(condition) -> None:
+    while not condition():
+        await asyncio.sleep(0)
+
+
+def test_late_joiner_gets_the_replay_then_live_pieces():
+    async def run():
+        coalescer = SingleFlight()
+        gates = [asyncio.Event(), asyncio.Event()]
+
+        async def produce(trace):
+            yield "a"
+            yield "b"
+            await gates[0].wait()
+            yield "c"
+            await gates[1].wait()
+            yield "d"
+
+        flight, joined = coalescer.join("k", produce)
+        assert not joined
+        first = flight.subscribe()
+        await _until(lambda: flight.pieces == ["a", "b"])
+        assert await anext(first) == "ab"
+
+        late, joined = coalescer.join("k", produce)
+        assert joined and late is flight
+        second = late.subscribe()
+        assert await anext(second) == "ab"
+        gates[0].set()
+        assert await anext(second) == "c"
+        gates[1].set()
+        assert await anext(second) == "d"
+        assert await anext(second, None) is None
+        assert "".join([piece async for piece in first]) == "cd"
+        assert coalescer.stats() == {"in_flight": 0, "started": 1, "joined": 1}
+
+    asyncio.run(run())
+
+
+def test_last_subscriber_leaving_cancels_and_unregisters():
+    async def run():
+        coalescer = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def produce(trace):
+            yield "a"
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        flight, _ = coalescer.join("k", produce)
+        subscribers = [flight.subscribe(), flight.subscribe()]
+        for tokens in subscribers:
+            assert await anext(tokens) == "a"
+
+        await subscribers[0].aclose()
+        await asyncio.sleep(0)
+        assert not flight.task.done()
+        assert coalescer.stats()["in_flight"] == 1
+
+        await subscribers[1].aclose()
+        # Unregistered right away: a new request must not join the dying flight.
+        assert coalescer.stats()["in_flight"] == 0
+        with pytest.raises(asyncio.CancelledError):
+            await flight.task
+        assert cancelled.is_set()
+        _, joined = coalescer.join("k", produce)
+        assert not joined
+
+    asyncio.run(run())
+
+
+def test_every_subscriber_gets_the_error():
+    async def run():
+        coalescer = SingleFlight()
+        gate = asyncio.Event()
+
+        async def produce(trace):
+            yield "a"
+            await gate.wait()
+            raise RuntimeError("upstream down")
+
+        flight, _ = coalescer.join("k", produce)
+        subscribers = [flight.subscribe(), flight.subscribe()]
+        for tokens in subscribers:
+            assert await anext(tokens) == "a"
+        gate.set()
+        for tokens in subscribers:
+            with pytest.raises(RuntimeError, match="upstream down"):
+                await anext(tokens)
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_limiter_rejection_reaches_every_subscriber():
+    pytest.importorskip("fastapi")
+    from fastapi import HTTPException
+
+    from server import _ConcurrencyLimiter
+
+    async def run():
+        limiter = _ConcurrencyLimiter(max_concurrency=1, max_queue=0)
+        await limiter.acquire()  # the only slot is taken
+        coalescer = SingleFlight()
+
+        async def produce(trace):
+            await limiter.acquire()
+            try:
+                yield "never"
+            finally:
+                limiter.release()
+
+        flight, _ = coalescer.join("k", produce)
+        late, joined = coalescer.join("k", produce)
+        assert joined and late is flight
+        results = await asyncio.gather(
+            anext(flight.subscribe()), anext(late.subscribe()), return_exceptions=True
+        )
+        assert [getattr(r, "status_code", None) for r in results] == [429, 429]
+        assert all(isinstance(r, HTTPException) for r in results)
+        assert limiter.pending == 1
+        assert coalescer.stats()["in_flight"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+from langchain_community.vectorstores import FAISS  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+
+from index_store import CURRENT_NAME, clone_index, current_generation, load_index, make_index, save_index_atomic  # noqa: E402
+
+
+def _store(n: int = 20) -> FAISS:
+    vectors = np.random.default_rng(0).normal(size=(n, 8)).astype("float32")
+    docs = {f"d{i}": Document(page_content=f"chunk {i} ippsAdd_32f", metadata={"source": "a.pdf"}) for i in range(n)}
+    return FAISS(
+        embedding_function=None,
+        index=make_index("flat", vectors),
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id={i: f"d{i}" for i in range(n)},
+    )
+
+
+def test_save_switches_generation_without_touching_readers(tmp_path):
+    folder = str(tmp_path)
+    first = save_index_atomic(_store(), folder)
+    assert current_generation(folder) == os.path.basename(first)
+    reader = load_index(None, folder)
+
+    update = clone_index(reader)
+    update.docstore.delete(["d0"])
+    update.index.remove_ids(np.array([0], dtype="int64"))
+    update.index_to_docstore_id = {i: f"d{i + 1}" for i in range(update.index.ntotal)}
+    second = save_index_atomic(update, folder)
+
+    assert second != first and current_generation(folder) == os.path.basename(second)
+    # The old generation's files are unchanged, so its reader still maps position 0 to d0.
+    assert reader.index_to_docstore_id[0] == "d0"
+    assert reader.docstore.search("d0").page_content == "chunk 0 ippsAdd_32f"
+    # The updated store now reads the new generation.
+    assert update.docstore.path.startswith(second)
+    assert load_index(None, folder).index_to_docstore_id[0] == "d1"
+
+
+def test_old_generations_are_removed(tmp_path):
+    folder = str(tmp_path)
+    for _ in range(5):
+        save_index_atomic(_store(), folder)
+    names = sorted(os.listdir(folder))
+    assert names == [CURRENT_NAME, "gen-000003", "gen-000004", "gen-000005"]
+
+
+def test_model_picks_up_a_generation_saved_elsewhere(tmp_path, monkeypatch):
+    import threading
+    import types
+
+    import model
+
+    folder = str(tmp_path)
+    first = save_index_atomic(_store(), folder)
+    monkeypatch.setattr(model, "INDEX_DIR", folder)
+    m = model.Model.__new__(model.Model)
+    m.embeddings = None
+    m.index_dir = first
+    m.vstore = load_index(None, first)
+    m.lexical = None
+    m.retriever = types.SimpleNamespace(vectorstore=m.vstore)
+    m.response_cache = None
+    m._index_write_lock = threading.Lock()
+    m.index_reload_interval = 1e-9
+    m._index_checked = 0.0
+
+    assert not m.refresh_index()
+    second = save_index_atomic(_store(5), folder)
+    assert m.refresh_index()
+    assert m.index_dir == second and m.retriever.vectorstore is m.vstore
+    assert m.vstore.index.ntotal == 5
+
+
+def test_rebuilding_lexical_publishes_a_generation(tmp_path):
+    folder = str(tmp_path)
+    first = save_index_atomic(_store(), folder)
+    before = os.path.getmtime(os.path.join(first, "lexical.npz"))
+    second = save_index_atomic(load_index(None, folder, mmap=False), folder, rebuild_lexical=True)
+    assert second != first and current_generation(folder) == os.path.basename(second)
+    assert os.path.getmtime(os.path.join(first, "lexical.npz")) == before
+    assert os.path.exists(os.path.join(second, "lexical.npz"))
+
+
+def test_search_params_are_published_as_a_generation(tmp_path):
+    from index_store import load_search_params
+
+    folder = str(tmp_path)
+    first = save_index_atomic(_store(), folder)
+    second = save_index_atomic(load_index(None, folder, mmap=False), folder, search_params={"nprobe": 4})
+    assert not os.path.exists(os.path.join(first, "search_params.json"))
+    vstore = load_index(None, folder)
+    assert load_search_params(vstore.index, second) == {"nprobe": 4}
+    # Carried over by later saves.
+    third = save_index_atomic(load_index(None, folder, mmap=False), folder)
+    assert load_search_params(vstore.index, third) == {"nprobe": 4}
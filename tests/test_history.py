@@ -0,0 +1,23 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from history import SUMMARY_PREFIX, HistoryWindow  # noqa: E402
+
+C_FILE = "Refactor this to IPP:\n```c\n#include <ipp.h>\n\n" + "\n\n".join(
+    f"void scale{i}(const float *src, float *dst, int len)\n{{\n    for (int i = 0; i < len; i++)\n        dst[i] = src[i] * {i}.0f;\n}}"
+    for i in range(12)
+) + "\n```"
+
+
+def test_prose_follow_up_keeps_code_turn_whole():
+    turns = [
+        ("user", C_FILE),
+        ("assistant", "Use ippsMulC_32f in each function. " * 40),
+        ("user", "Thanks; now handle the double case too."),
+    ]
+    window = HistoryWindow(max_tokens=len(C_FILE) // 8, summary_tokens=16)
+    fitted = window.fit(turns)
+    assert fitted[0] == ("user", C_FILE)
+    assert fitted[-1] == turns[-1]
+    assert fitted[1][1].startswith(SUMMARY_PREFIX) or len(fitted) == 2
@@ -0,0 +1,37 @@
+import types
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+from index_store import delete_ids, index_vectors, load_search_params, make_index, save_search_params  # noqa: E402
+
+
+class _Docstore:
+    def delete(self, ids):
+        self.deleted = ids
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "ivfpq", "hnsw"])
+def test_delete_keeps_positions_aligned(index_type):
+    vectors = np.random.default_rng(0).normal(size=(4000, 32)).astype("float32")
+    vstore = types.SimpleNamespace(
+        index=make_index(index_type, vectors),
+        index_to_docstore_id={i: f"d{i}" for i in range(len(vectors))},
+        docstore=_Docstore(),
+    )
+    before = index_vectors(vstore.index)
+    delete_ids(vstore, [f"d{i}" for i in range(0, len(vectors), 3)])
+    after = index_vectors(vstore.index)
+    assert vstore.index.ntotal == len(vstore.index_to_docstore_id) == len(vectors) - len(range(0, len(vectors), 3))
+    for pos, doc_id in vstore.index_to_docstore_id.items():
+        np.testing.assert_allclose(after[pos], before[int(doc_id[1:])], atol=1e-5)
+
+
+def test_search_params_apply_only_to_the_tuned_index(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(4000, 32)).astype("float32")
+    tuned = make_index("ivf", vectors)
+    save_search_params(tuned, str(tmp_path), nprobe=32)
+    assert load_search_params(tuned, str(tmp_path)) == {"nprobe": 32}
+    assert load_search_params(make_index("ivf", vectors, nlist=16), str(tmp_path)) == {"nprobe": 8}
@@ -0,0 +1,68 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from lexical import LEXICAL_NAME, LexicalIndex, tokenize  # noqa: E402
+
+DOCS = [
+    ("getsize", "ippsFIRSRGetSize computes the sizes of the FIR filter specification and work buffer "
+                "for a single-rate filter of a given tap count."),
+    ("init", "ippsFIRSRInit_32f initializes the specification structure of a single-rate FIR filter."),
+    ("fir", "ippsFIRSR_32f filters a block of float samples with a single-rate FIR filter."),
+    ("copy", "ippsCopy_32f copies the elements of a float vector to another vector."),
+    ("iir", "ippsIIR_64f filters a block of double samples with an IIR filter."),
+]
+
+
+def test_identifiers_are_indexed_whole_and_by_parts():
+    terms = tokenize("ippsFIRSR_32f")
+    assert "ippsfirsr_32f" in terms
+    assert {"ipps", "firsr", "32f"} <= set(terms)
+
+
+def test_exact_identifier_ranks_first():
+    index = LexicalIndex.build(DOCS)
+    hits = index.search("How do I call ippsFIRSR_32f on a block of samples?", 5)
+    assert hits[0] == "fir"
+    assert hits.index("fir") < hits.index("getsize")
+
+
+def test_identifier_prefix_finds_longer_identifiers():
+    index = LexicalIndex.build(DOCS)
+    # "ippsFIRS" is not a term, nor is its part "firs": only the prefix matches.
+    assert index.search("firs", 5) == []
+    hits = index.search("ippsFIRS", 5)
+    assert set(hits[:3]) == {"fir", "getsize", "init"}
+    assert set(hits[3:]) <= {"copy", "iir"}  # on the shared "ipps" part alone
+
+
+def test_search_returns_only_matching_chunks():
+    index = LexicalIndex.build(DOCS)
+    assert index.search("ippsCopy_32f", 5)[0] == "copy"
+    assert index.search("quaternion", 5) == []
+    assert LexicalIndex.empty().search("ippsFIRSR_32f", 5) == []
+
+
+def test_save_load_round_trip(tmp_path):
+    index = LexicalIndex.build(DOCS)
+    assert LexicalIndex.load(str(tmp_path)) is None
+    index.save(str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == [LEXICAL_NAME]
+
+    loaded = LexicalIndex.load(str(tmp_path))
+    assert loaded.ids == index.ids
+    assert loaded.vocab == index.vocab
+    for name in ("lengths", "indptr", "rows", "tf"):
+        assert np.array_equal(getattr(loaded, name), getattr(index, name))
+    query = "single-rate ippsFIRSR filter"
+    assert np.allclose(loaded.scores(query), index.scores(query))
+    assert loaded.search(query, 5) == index.search(query, 5)
+
+
+def test_updated_matches_a_fresh_build():
+    index = LexicalIndex.build(DOCS[:3])
+    updated = index.updated(added=DOCS[3:], deleted=["getsize"])
+    rebuilt = LexicalIndex.build(DOCS[1:])
+    assert sorted(updated.ids) == sorted(rebuilt.ids)
+    for query in ("ippsFIRSR_32f", "float vector", "ippsIIR_64f double"):
+        assert updated.search(query, 5) == rebuilt.search(query, 5)
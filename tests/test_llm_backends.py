@@ -0,0 +1,171 @@
+import json
+import time
+import types
+
+import pytest
+
+import llm_backends
+from llm_backends import LLMPool, NoUpstreamAvailable, Upstream
+
+
+class FakeHTTPError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {"retry-after": retry_after}
+        self.response = types.SimpleNamespace(status_code=status_code, headers=headers)
+
+
+class FakeLLM:
+    """Plays back one scripted outcome per call: a value, an error, or stream chunks."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def _next(self):
+        self.calls += 1
+        return self.outcomes.pop(0)
+
+    def invoke(self, messages, **kwargs):
+        outcome = self._next()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def stream(self, messages, **kwargs):
+        for item in self._next():
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+def _upstream(name, *outcomes, weight=1.0, failure_threshold=5, cooldown=30.0):
+    # Skips __init__: no HTTP clients, just the balancing and breaker state.
+    upstream = Upstream.__new__(Upstream)
+    upstream.base_url = f"http://{name}/v1"
+    upstream.model = "m"
+    upstream.weight = weight
+    upstream.failure_threshold = failure_threshold
+    upstream.cooldown = cooldown
+    upstream.outstanding = 0
+    upstream.failures = 0
+    upstream.opened_at = None
+    upstream.probing = False
+    upstream.llm = FakeLLM(*outcomes)
+    return upstream
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    pytest.importorskip("openai")  # is_retryable checks openai's connection errors
+    slept = []
+    monkeypatch.setattr(llm_backends.time, "sleep", slept.append)
+    return slept
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_fails_over_to_another_upstream(delays, status):
+    # The heavier upstream is tried first.
+    first = _upstream("a", FakeHTTPError(status), weight=2)
+    second = _upstream("b", "answer")
+    pool = LLMPool([first, second])
+    assert pool.invoke([]) == "answer"
+    assert (first.llm.calls, second.llm.calls) == (1, 1)
+    assert (first.failures, second.failures) == (1, 0)
+    assert len(delays) == 1
+
+
+def test_client_errors_are_neither_retried_nor_counted(delays):
+    first = _upstream("a", FakeHTTPError(400), weight=2)
+    second = _upstream("b", "answer")
+    pool = LLMPool([first, second])
+    with pytest.raises(FakeHTTPError):
+        pool.invoke([])
+    assert second.llm.calls == 0
+    assert first.failures == 0 and first.opened_at is None
+    assert first.outstanding == 0
+    assert delays == []
+
+
+def test_half_open_upstream_allows_one_probe(delays):
+    upstream = _upstream("a", failure_threshold=1)
+    pool = LLMPool([upstream])
+    upstream.record_failure(time.monotonic() - 60)  # opened a cooldown ago
+    assert upstream.stats()["circuit"] == "half-open"
+
+    assert pool._acquire([]) is upstream
+    assert upstream.probing
+    with pytest.raises(NoUpstreamAvailable):
+        pool._acquire([])
+
+    # A failed probe opens the circuit again for a full cooldown.
+    pool._release(upstream, FakeHTTPError(503))
+    assert upstream.stats()["circuit"] == "open"
+    with pytest.raises(NoUpstreamAvailable):
+        pool._acquire([])
+
+    # A successful probe closes it.
+    upstream.opened_at -= 60
+    pool._release(pool._acquire([]))
+    assert upstream.stats()["circuit"] == "closed"
+    assert pool._acquire([]) is upstream and pool._acquire([]) is upstream
+
+
+def test_stream_is_retried_before_its_first_chunk(delays):
+    first = _upstream("a", [FakeHTTPError(503)], weight=2)
+    second = _upstream("b", ["x", "y"])
+    pool = LLMPool([first, second])
+    assert list(pool.stream([])) == ["x", "y"]
+    assert first.failures == 1
+
+
+def test_stream_is_not_retried_after_its_first_chunk(delays):
+    first = _upstream("a", ["x", FakeHTTPError(503)], weight=2)
+    second = _upstream("b", ["y"])
+    pool = LLMPool([first, second])
+    received = []
+    with pytest.raises(FakeHTTPError):
+        for chunk in pool.stream([]):
+            received.append(chunk)
+    assert received == ["x"]
+    assert second.llm.calls == 0
+    assert first.failures == 1 and first.outstanding == 0
+
+
+@pytest.mark.parametrize("retry_after, expected", [("2", 2.0), ("120", 8.0)])
+def test_retry_after_is_honoured_up_to_max_backoff(delays, retry_after, expected):
+    upstream = _upstream("a", FakeHTTPError(429, retry_after=retry_after), "answer")
+    pool = LLMPool([upstream], max_attempts=2, max_backoff=8.0)
+    assert pool.invoke([]) == "answer"
+    assert delays == [expected]
+
+
+def test_last_error_surfaces_when_attempts_run_out(delays):
+    upstream = _upstream("a", FakeHTTPError(502), FakeHTTPError(503))
+    pool = LLMPool([upstream], max_attempts=2)
+    with pytest.raises(FakeHTTPError, match="503"):
+        pool.invoke([])
+    assert upstream.failures == 2
+
+
+def test_default_upstream_requires_a_key(monkeypatch):
+    monkeypatch.delenv(llm_backends.UPSTREAMS_ENV, raising=False)
+    monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
+    with pytest.raises(ValueError, match="OPENROUTER_API_KEY"):
+        llm_backends._upstream_specs()
+
+
+def test_missing_api_key_env_fails_unless_allowed(monkeypatch):
+    monkeypatch.delenv("GPU_KEY", raising=False)
+    specs = [{"base_url": "http://gpu1:1234/v1", "model": "m", "api_key_env": "GPU_KEY"}]
+    monkeypatch.setenv(llm_backends.UPSTREAMS_ENV, json.dumps(specs))
+    with pytest.raises(ValueError, match="GPU_KEY"):
+        llm_backends._upstream_specs()
+
+    specs[0]["allow_no_key"] = True
+    monkeypatch.setenv(llm_backends.UPSTREAMS_ENV, json.dumps(specs))
+    assert llm_backends._upstream_specs()[0]["api_key"] is None
+
+    monkeypatch.setenv("GPU_KEY", "secret")
+    assert llm_backends._upstream_specs()[0]["api_key"] == "secret"
@@ -0,0 +1,61 @@
+import types
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+import model  # noqa: E402
+from c_units import FUNCTION  # noqa: E402
+from tokens import count_tokens  # noqa: E402
+
+FUNCTIONS = "\n\n".join(
+    f"void scale{i}(const float *src, float *dst, int len)\n{{\n    for (int i = 0; i < len; i++)\n        dst[i] = src[i] * {i}.0f;\n}}"
+    for i in range(8)
+)
+TRANSCRIPT = (
+    "USER: Please refactor this file to IPP.\n```c\n#include <stdio.h>\n\n" + FUNCTIONS + "\n```\n"
+    "ASSISTANT: Sure.\n\nUSER: Thanks; now handle the double case too."
+)
+
+
+def _model(threshold: int) -> model.Model:
+    m = model.Model.__new__(model.Model)
+    m.split_threshold = threshold
+    m.split_unit_tokens = 60
+    m.split_shared_tokens = 200
+    m.split_max_parallel = 2
+    m.prompts = types.SimpleNamespace(system="", instruction="Refactor.")
+    m._retrieve_many = lambda inputs, trace=None: [[] for _ in inputs]
+    m._format_messages = lambda question, docs, prompts, trace=None: question
+    m._record_usage = lambda messages, answer, usage, trace=None: None
+    m.llm = types.SimpleNamespace(
+        invoke=lambda question: types.SimpleNamespace(
+            content="```c\n#include <stdio.h>\n/* refactored */\n```", usage_metadata=None
+        )
+    )
+    return m
+
+
+def test_split_units_hold_only_user_code():
+    units, jobs = _model(threshold=50)._split(TRANSCRIPT)
+    assert len(jobs) > 1
+    text = "".join(unit.text for unit in units)
+    assert "```" not in text and "USER:" not in text and "Please" not in text
+    assert units[0].text.startswith("#include <stdio.h>")
+    assert all(units[i].kind == FUNCTION for job in jobs for i in job)
+
+
+def test_stitched_file_keeps_include_and_one_fence():
+    m = _model(threshold=50)
+    answer = "".join(m._run_split(*m._split(TRANSCRIPT), m.prompts))
+    assert answer.startswith("```c\n#include <ipp.h>\n#include <stdio.h>")
+    assert answer.count("#include <stdio.h>") == 1
+    assert answer.count("```") == 2 and answer.endswith("/* refactored */\n```")
+    assert "Please" not in answer and "Thanks" not in answer
+
+
+def test_threshold_ignores_assistant_turns():
+    code = "#include <stdio.h>\n\n" + FUNCTIONS
+    transcript = "USER: ```c\n" + code + "\n```\nASSISTANT: " + "Long explanation. " * 2000 + "\nUSER: And now?"
+    assert _model(threshold=count_tokens(code) + 10)._split(transcript) is None
+    assert _model(threshold=count_tokens(code) - 10)._split(transcript) is not None
@@ -0,0 +1,46 @@
+from query_plan import has_code, retrieval_queries, user_code
+
+CODE_TURN = """USER: Refactor this to IPP:
+```c
+#include <stdio.h>
+
+void scale(const float *src, float *dst, int len, float k)
+{
+    for (int i = 0; i < len; i++)
+        dst[i] = src[i] * k;
+}
+```
+ASSISTANT: Use ippsMulC_32f:
+```c
+void scale(const float *src, float *dst, int len, float k)
+{
+    ippsMulC_32f(src, k, dst, len);
+}
+```
+"""
+
+
+def test_prose_with_punctuation_is_not_code():
+    assert not has_code("Thanks; now handle the double case too.")
+    assert not has_code("Can you {please} keep the loop?")
+    assert not has_code("# If you can, keep the names")
+
+
+def test_unfenced_c_is_code():
+    assert has_code("int sum(const int *a, int n) { return 0; }")
+    assert has_code("static const Ipp32f taps[4] = {1, 2, 3, 4};")
+    assert has_code("#include <ipp.h>")
+    assert has_code("for (i = 0; i < n; i++) s += a[i];")
+
+
+def test_user_code_skips_prose_follow_up():
+    transcript = CODE_TURN + "USER: Thanks; now handle the double case too."
+    code = user_code(transcript)
+    assert code.startswith("#include <stdio.h>")
+    assert "void scale(" in code and "Thanks" not in code
+    assert all("Thanks" not in q for q in retrieval_queries(transcript))
+
+
+def test_user_code_drops_leading_prose():
+    code = user_code("USER: Please vectorize:\n#include <ipp.h>\nvoid zero(float *a, int n) { for (int i = 0; i < n; i++) a[i] = 0; }")
+    assert code.startswith("#include <ipp.h>")
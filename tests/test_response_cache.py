@@ -0,0 +1,46 @@
+import types
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("numpy")
+
+import model  # noqa: E402
+from cache import ResponseCache  # noqa: E402
+
+TRUNCATE_CHARS = 400  # the fake embedder reads this much, like MiniLM's 256 tokens
+
+HEADER = "#include <ipp.h>\n#include <stdio.h>\n\n" + "".join(f"#define GAIN_{i} {i}.0f\n" for i in range(40))
+
+
+class TruncatingEmbeddings:
+    def embed_query(self, text):
+        text = text[:TRUNCATE_CHARS]
+        return [float(text.count(c)) for c in "abcdefghijklmnopqrstuvwxyz0123456789{}();"]
+
+
+def _model() -> model.Model:
+    m = model.Model.__new__(model.Model)
+    m.response_cache = ResponseCache(similarity=0.99)
+    m.similarity_max_tokens = 170
+    m.embeddings = TruncatingEmbeddings()
+    m.llm = types.SimpleNamespace(model_name="m")
+    m.prompts = types.SimpleNamespace(system="", instruction="Refactor.")
+    return m
+
+
+def _file(body: str) -> str:
+    return f"USER: Refactor this:\n```c\n{HEADER}\n{body}\n```"
+
+
+def test_files_sharing_a_header_do_not_match():
+    m = _model()
+    m.store_response(_file("void a(float *x, int n) { for (int i = 0; i < n; i++) x[i] = 0; }"), "answer a")
+    assert m.cached_response(_file("double b(const double *y) { return y[0] * y[1]; }")) is None
+
+
+def test_short_code_matches_despite_different_prose():
+    m = _model()
+    code = "```c\nvoid a(float *x, int n) { for (int i = 0; i < n; i++) x[i] = 0; }\n```"
+    m.store_response("USER: Refactor this:\n" + code, "answer a")
+    assert m.cached_response("USER: Could you convert this to IPP?\n" + code) == "answer a"
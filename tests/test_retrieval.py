@@ -0,0 +1,80 @@
+import types
+
+from retrieval import MIN_PARTIAL_TOKENS, SEPARATOR, fuse_ranked, merge_chunks, pack_context
+from tokens import count_tokens
+
+
+def _doc(text: str, source: str = "page.html"):
+    return types.SimpleNamespace(page_content=text, metadata={"source": source})
+
+
+def test_fuse_ranked_prefers_chunks_several_rankings_agree_on():
+    a, b, c, d = (_doc(text) for text in "abcd")
+    # b is second in both lists; a and c are first in one list each.
+    fused = fuse_ranked([[a, b, d], [c, b]], limit=4)
+    assert [doc.page_content for doc in fused] == ["b", "a", "c", "d"]
+
+
+def test_fuse_ranked_deduplicates_and_limits():
+    first, again = _doc("same"), _doc("same")
+    other_page = _doc("same", source="other.html")
+    x = _doc("x")
+    # The same text from another page is a different chunk.
+    assert fuse_ranked([[first, x], [again, other_page]], limit=10) == [first, x, other_page]
+    assert fuse_ranked([[first, x], [again, other_page]], limit=2) == [first, x]
+
+
+def test_fuse_ranked_keeps_first_seen_order_on_ties():
+    a, b = _doc("a"), _doc("b")
+    assert [doc.page_content for doc in fuse_ranked([[a], [b]], limit=2)] == ["a", "b"]
+    assert fuse_ranked([], limit=3) == []
+
+
+def _text(tag: str, sentences: int) -> str:
+    return " ".join(f"{tag} sentence {i} sets tap {i * 7} of the filter." for i in range(sentences))
+
+
+def test_overlapping_chunks_merge_without_repeating_the_shared_text():
+    page = _text("page", 20)
+    first, second = page[:400], page[250:]
+    shared = page[250:400]
+    for docs in ([_doc(first), _doc(second)], [_doc(second), _doc(first)]):
+        merged = merge_chunks(docs)
+        assert merged == [page]
+        assert merged[0].count(shared) == 1
+
+
+def test_merge_chunks_keeps_other_sources_and_rank_order():
+    page = _text("page", 20)
+    other = _text("other", 3)
+    docs = [_doc(page[:400]), _doc(other), _doc(page[100:300]), _doc(page[250:], source="copy.html")]
+    # The contained chunk disappears; the same text on another page stays.
+    assert merge_chunks(docs) == [page[:400], other, page[250:]]
+
+
+def test_pack_context_never_exceeds_the_budget():
+    docs = [_doc(_text(f"doc{i}", 5 + i), source=f"{i}.html") for i in range(8)]
+    for budget in range(0, 2000, 37):
+        assert count_tokens(pack_context(docs, budget)) <= budget
+
+
+def test_pack_context_truncates_the_first_block_that_does_not_fit():
+    blocks = [_text("first", 4), _text("second", 40), _text("third", 2)]
+    docs = [_doc(text, source=str(i)) for i, text in enumerate(blocks)]
+    first_cost = count_tokens(blocks[0])
+
+    context = pack_context(docs, first_cost + MIN_PARTIAL_TOKENS + 10)
+    head, tail = context.split(SEPARATOR)
+    assert head == blocks[0]
+    assert tail and blocks[1].startswith(tail) and tail != blocks[1]
+    assert "third" not in context  # packing stops at the truncated block
+
+    # Too little room left for a useful part: the block is left out.
+    assert pack_context(docs, first_cost + MIN_PARTIAL_TOKENS - 1) == blocks[0]
+
+
+def test_pack_context_keeps_whole_blocks_in_rank_order():
+    blocks = [_text("first", 2), _text("second", 2)]
+    docs = [_doc(text, source=str(i)) for i, text in enumerate(blocks)]
+    assert pack_context(docs, 10_000) == SEPARATOR.join(blocks)
+    assert pack_context([], 100) == ""